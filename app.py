@@ -1,22 +1,191 @@
 import os
-import boto3
 import datetime
-import asyncio
-from flask import Flask, jsonify, make_response, request
+import gzip
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, has_request_context, jsonify, make_response, request
+from bloom import BloomFilter
+from catalogue import Catalogue, CatalogueStore, encode_catalogue
+from dependencies import DependencyIndex, EntryCache
+from emission_factors import compute_emissions, parse_factors
+from geo import BoxIndex, PlaceIndex, bounding_box, parse_lat_lng, route_distance, simplify
+from heatmap import cell_bounds, heat_by_cell
+from journeys import (ITEM_SORT_KEY, item_partition, journey_records, journey_totals, leg_record,
+                      parse_reference, route_partition, split_partition, stale_records)
+from list_planner import choose_origins, simulate_substitutions
+from route_graph import METRICS, RouteGraph, to_number
+from sketches import DistinctSketch, QuantileSketch
+from storage import (BATCH_GET_LIMIT, NotFoundError, SQLiteStorage, UnprocessedKeysError, create_storage,
+                     get_item_legs, lat_lng_attribute, lat_lng_text, lat_lng_value, number_attribute, number_text,
+                     number_value, split_item_id)
+from tiles import create_tile_store, encode_tile, patch_tile, tile_bounds, tiles_for_line
 
 app = Flask(__name__)
 
-dynamodb_client = boto3.client('dynamodb')
-
-if os.environ.get('IS_OFFLINE'):
-    dynamodb_client = boto3.client(
-        'dynamodb', region_name='localhost', endpoint_url='http://localhost:8000'
-    )
-
 ITEM_TABLE = os.environ['ITEM_TABLE']
 SHOPPING_LIST_TABLE = os.environ['SHOPPING_LIST_TABLE']
 SAVED_LIST_TABLE = os.environ['SAVED_LIST_TABLE']
 ROUTE_TABLE = os.environ['ROUTE_TABLE']
+EMISSION_FACTOR_TABLE = os.environ['EMISSION_FACTOR_TABLE']
+HEATMAP_TABLE = os.environ['HEATMAP_TABLE']
+STATS_TABLE = os.environ['STATS_TABLE']
+CATALOGUE_TABLE = os.environ['CATALOGUE_TABLE']
+# optional single table keeping each food item together with copies of its legs, every write
+# goes to it as well as the other tables when it is set
+JOURNEY_TABLE = os.environ.get('JOURNEY_TABLE')
+# endpoints that read journeys from the journey table instead of the item and route tables,
+# comma separated, so reads can be moved over one endpoint at a time once it is backfilled
+JOURNEY_READ_ENDPOINTS = frozenset(
+    endpoint.strip() for endpoint in os.environ.get('JOURNEY_READ_ENDPOINTS', '').split(',') if endpoint.strip())
+
+# the (hash, range) key attributes of each table
+TABLE_KEYS = {
+    ITEM_TABLE: ('name', 'origin'),
+    SHOPPING_LIST_TABLE: ('userId', 'itemId'),
+    SAVED_LIST_TABLE: ('userId', 'createdAt'),
+    ROUTE_TABLE: ('origin', 'destination'),
+    EMISSION_FACTOR_TABLE: ('version',),
+    HEATMAP_TABLE: ('resolution', 'cell'),
+    STATS_TABLE: ('userId', 'period'),
+    CATALOGUE_TABLE: ('pk', 'sk'),
+}
+if JOURNEY_TABLE:
+    TABLE_KEYS[JOURNEY_TABLE] = ('pk', 'sk')
+# DynamoDB, or an embedded SQLite database when STORAGE_BACKEND is "sqlite"
+storage = create_storage(TABLE_KEYS, ITEM_TABLE, ROUTE_TABLE, SHOPPING_LIST_TABLE)
+
+# version of the emission factor table item that holds the factor set in use
+CURRENT_FACTOR_VERSION = 'current'
+# number of item table partitions queried at the same time
+QUERY_WORKERS = 10
+# most what-if scenarios that can be simulated in one request
+MAX_SCENARIOS = 500
+# most legs returned by a viewport search
+MAX_BBOX_RESULTS = 200
+# most places returned by a nearby search
+MAX_NEARBY_RESULTS = 500
+# limits on the pareto journey search so it stays interactive
+MAX_PARETO_RESULTS = 100
+MAX_PARETO_TIME_BUDGET_MS = 5000
+# most keys that can be read in one batch request
+MAX_BATCH_GET_KEYS = 300
+# most shopping list adds and deletes in one batch request
+MAX_BATCH_OPERATIONS = 500
+# what each kind of shopping list operation is reported as once it has been written
+BATCH_OPERATIONS = {'add': 'added', 'delete': 'deleted'}
+# how far, as a fraction, a route's distance can be from the length of its coordinates
+DISTANCE_TOLERANCE = float(os.environ.get('DISTANCE_TOLERANCE', 0.25))
+# number of seconds a warm container keeps using its snapshot of the route table and emission factors
+ROUTE_SNAPSHOT_TTL = int(os.environ.get('ROUTE_SNAPSHOT_TTL', 300))
+
+# map tiles of the route network are kept in the S3 bucket TILE_BUCKET, shared by every container,
+# or on the local filesystem under TILE_STORE_DIR when no bucket is set, which only suits a single host
+TILE_STORE_DIR = os.environ.get('TILE_STORE_DIR', '/tmp/tiles')
+TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', 8))
+# lowest zoom level whose tiles are rebuilt from every leg crossing them when a route is added, the tiles
+# of lower zoom levels cover so much of the network that rebuilding them would read most of the route
+# table, so the added leg is patched into them instead
+TILE_LIVE_MIN_ZOOM = int(os.environ.get('TILE_LIVE_MIN_ZOOM', 6))
+# number of seconds browsers and CDNs can keep a tile before checking its ETag again, kept short as
+# tiles are rebuilt whenever a route is added
+TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', 5 * 60))
+tile_store = create_tile_store(TILE_STORE_DIR)
+
+# sizes in degrees of the grid cells the emissions heatmap is kept at
+HEATMAP_RESOLUTIONS = tuple(float(resolution) for resolution in
+                            os.environ.get('HEATMAP_RESOLUTIONS', '5,1').split(','))
+# most rasterized routes a warm container keeps
+MAX_CACHED_RASTERS = 10000
+route_rasters = {}
+# granularities of the per-user rollups of saved lists, with the length of the createdAt prefix naming their period
+STATS_GRANULARITIES = {'day': len('2024-01-31'), 'month': len('2024-01')}
+# partition of the stats table keeping sketches of every saved list for the global statistics, split
+# over shards so checkouts at the same time rarely update the same item
+GLOBAL_STATS_USER = '#global'
+SKETCH_SHARDS = int(os.environ.get('SKETCH_SHARDS', 8))
+# attempts at updating a shard that another checkout keeps updating first, each at a random shard
+SKETCH_WRITE_RETRIES = 5
+# number of seconds the merged sketches are used for before the shards are read again
+SKETCH_CHECK_INTERVAL = int(os.environ.get('SKETCH_CHECK_INTERVAL', 60))
+# the sketches of every saved list: the emissions of each list and the distinct users and foods
+SKETCHES = {'emissions': QuantileSketch, 'users': DistinctSketch, 'foods': DistinctSketch}
+
+# compact memory mapped snapshots of the item and route tables, kept on the local filesystem
+# so every process on the machine and every warm invocation reuses the same file
+CATALOGUE_DIR = os.environ.get('CATALOGUE_DIR', '/tmp/catalogue')
+# number of seconds between checks of the catalogue version item for changes
+CATALOGUE_CHECK_INTERVAL = int(os.environ.get('CATALOGUE_CHECK_INTERVAL', 30))
+# item of the catalogue table counting the writes to the item and route tables
+CATALOGUE_VERSION_KEY = {'pk': {'S': 'catalogue'}, 'sk': {'S': 'version'}}
+# partitions of the catalogue table recording which items and routes have been written, so a
+# bundle knows which of its keys are out of date; each write is a record sorted by its version in the
+# partition "changes#shard" of its version, so writes are spread over CHANGE_SHARDS partitions and the
+# writes since a version are read with a key condition on each of them instead of reading the whole log;
+# CHANGE_SHARDS must not be lowered while records remain in the partitions it would leave out
+CATALOGUE_CHANGES_PREFIX = 'changes#'
+CHANGE_SHARDS = int(os.environ.get('CHANGE_SHARDS', 8))
+# digits the version is padded to in the sort key of a change, so the keys sort in version order
+CHANGE_VERSION_DIGITS = 20
+# most keys recorded in one change, keeping the record well under the DynamoDB item size limit
+CHANGE_KEYS_PER_RECORD = 1000
+# prefix of the catalogue table partitions recording which food items use a route, "uses#origin,destination",
+# so a write to a route can find the cached results derived from it
+DEPENDENCY_PREFIX = 'uses#'
+# most food item totals read from storage that a warm container keeps
+ITEM_TOTALS_CACHE_SIZE = int(os.environ.get('ITEM_TOTALS_CACHE_SIZE', 10000))
+# most bytes of finished get_route responses a warm container keeps
+ROUTE_CACHE_BYTES = int(os.environ.get('ROUTE_CACHE_BYTES', 32 * 1024 * 1024))
+# how often the filter of food item keys wrongly says an item that does not exist might
+ITEM_FILTER_ERROR_RATE = float(os.environ.get('ITEM_FILTER_ERROR_RATE', 0.01))
+# least number of seconds between the extra checks of the catalogue version made before a miss of the
+# filter is trusted, an item written by another container within that time can be missed
+ITEM_FILTER_RECHECK_INTERVAL = float(os.environ.get('ITEM_FILTER_RECHECK_INTERVAL', 1))
+catalogue_store = CatalogueStore(CATALOGUE_DIR)
+# read-only catalogue, with coordinates, built by build_bundle.py and shipped beside app.py
+CATALOGUE_BUNDLE = os.environ.get('CATALOGUE_BUNDLE',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogue.bundle'))
+
+# in memory snapshot of the route table, and the graph and spatial indexes built from it,
+# made the first time they are needed
+route_snapshot = None
+route_snapshot_loaded_at = 0
+route_graph = None
+place_indexes = None
+route_box_index = None
+# the emission factor set in use, loaded the first time it is needed
+emission_factors = None
+emission_factors_loaded_at = 0
+# the catalogue in use, when the version item was last checked, the lowest version that has
+# this container's own writes in it, and the thread building a newer catalogue
+catalogue = None
+catalogue_checked_at = 0
+catalogue_version = 0
+catalogue_min_version = 0
+catalogue_build = None
+# the bundle, opened the first time it is needed, and the items and routes written since it was built
+bundle = None
+bundle_opened = False
+bundle_checked_at = 0
+bundle_changes = {'item': set(), 'route': set(), 'all': False}
+local_changes = {'item': set(), 'route': set(), 'all': False}
+# the results cached by this container and the food items they were derived from, and the
+# version of the tables whose writes by other containers have been invalidated
+dependency_index = DependencyIndex()
+item_totals_cache = EntryCache('item_totals', dependency_index, max_entries=ITEM_TOTALS_CACHE_SIZE)
+# the body of each get_route response, gzip compressed for clients that accept it
+route_response_cache = EntryCache('route_responses', dependency_index, max_bytes=ROUTE_CACHE_BYTES)
+dependencies_version = None
+# the sketches of every shard merged together, and when the shards were read
+global_sketches = None
+global_sketches_read_at = 0
+# every food item key, built from a catalogue and kept up to date with the change log, the version
+# of the catalogue it was built from, and how many lookups it has answered without reading storage
+item_filter = None
+item_filter_version = None
+item_filter_rejected = 0
 
 
 @app.route('/food/item', methods=['POST'])
@@ -27,15 +196,17 @@ def create_item():
     if not name or not origin or not legs:
         return jsonify({'error': 'Please provide both "name" and "origin" and "legs"'}), 400
     legs_dynamodb = [{'M': {'origin': {'S': leg['origin']}, 'destination': {'S': leg['destination']}}} for leg in legs]
-    dynamodb_client.put_item(
-        TableName=ITEM_TABLE, Item={'name': {'S': name}, 'origin': {'S': origin}, 'legs': {'L': legs_dynamodb}}
-    )
+    item = {'name': {'S': name}, 'origin': {'S': origin}, 'legs': {'L': legs_dynamodb}}
+    storage.put_item(TableName=ITEM_TABLE, Item=item)
+    write_journey(item)
+    write_item_dependencies(item)
+    bump_catalogue_version('item', [(name, origin)])
     return jsonify({'name': name, 'origin': origin, 'legs': legs})
 
 
 @app.route('/food/item/<string:name>/<string:origin>')
 def get_item(name, origin):
-    result = dynamodb_client.get_item(
+    result = storage.get_item(
         TableName=ITEM_TABLE, Key={'name': {'S': name}, 'origin': {'S': origin}}
     )
     item = result.get('Item')
@@ -48,6 +219,66 @@ def get_item(name, origin):
     )
 
 
+@app.route('/food/items:batchGet', methods=['POST'])
+def batch_get_items():
+    keys = batch_get_keys()
+    if keys is None:
+        return jsonify({'error': f'Please provide "keys" as a list of at most {MAX_BATCH_GET_KEYS} objects '
+                                 f'with a "name" and an "origin"'}), 400
+    # getting every unique item the filter does not rule out in as few BatchGetItem calls as possible
+    absent = absent_items(keys)
+    items = storage.batch_get(ITEM_TABLE, ('name', 'origin'), [key for key in keys if key not in absent])
+    results = []
+    for name, origin in keys:
+        item = items.get((name, origin))
+        if not item:
+            results.append({'name': name, 'origin': origin,
+                            'error': f'Could not find food item with name "{name}" and origin "{origin}"'})
+            continue
+        legs = [{'origin': leg_origin, 'destination': leg_destination}
+                for leg_origin, leg_destination in get_item_legs(item)]
+        results.append({'name': name, 'origin': origin, 'item': {'name': name, 'origin': origin, 'legs': legs}})
+    return jsonify({'results': results})
+
+
+def batch_get_keys(capitalize=False):
+    # the (name, origin) keys of a batch read in the order they were asked for, or None if they are not valid
+    keys = (request.json or {}).get('keys')
+    if not isinstance(keys, list) or not keys or len(keys) > MAX_BATCH_GET_KEYS:
+        return None
+    if not all(isinstance(key, dict) and isinstance(key.get('name'), str) and key['name'] and
+               isinstance(key.get('origin'), str) and key['origin'] for key in keys):
+        return None
+    if capitalize:
+        return [(capitalize_first_letter(key['name']), capitalize_first_letter(key['origin'])) for key in keys]
+    return [(key['name'], key['origin']) for key in keys]
+
+
+@app.route('/food/<string:name>/origins')
+def get_food_origins(name):
+    name = capitalize_first_letter(name)
+    items = query_food_origins(name)
+    if not items:
+        raise NotFoundError(f'Could not find food item with name "{name}"')
+    # getting the legs of all the origins together and sorting them by emissions
+    origins = sorted(storage.totals_for_items(items).values(),
+                     key=lambda totals: (totals['emissions'], totals['origin']))
+    return jsonify({'name': name, 'origins': origins})
+
+
+def query_food_origins(name):
+    # every origin of a food item is in the same partition of the item table
+    items = {}
+    for item in storage.query_table(
+        ITEM_TABLE,
+        KeyConditionExpression='#name = :name',
+        ExpressionAttributeNames={'#name': 'name'},
+        ExpressionAttributeValues={':name': {'S': name}}
+    ):
+        items[(item['name']['S'], item['origin']['S'])] = item
+    return items
+
+
 @app.route('/shoppingList/item', methods=['POST'])
 def add_item():
     userId = request.json.get('userId')
@@ -56,7 +287,7 @@ def add_item():
     itemId = name + ',' + origin
     if not name or not origin or not userId:
         return jsonify({'error': 'Please provide both "name" and "origin" and "userId"'}), 400
-    dynamodb_client.put_item(
+    storage.put_item(
         TableName=SHOPPING_LIST_TABLE, Item={'userId': {'S': userId}, 'itemId': {'S': itemId}}
     )
     return jsonify({'userId': userId, 'itemId': itemId})
@@ -70,75 +301,178 @@ def delete_item():
     itemId = name + ',' + origin
     if not name or not origin or not userId:
         return jsonify({'error': 'Please provide both "name" and "origin" and "userId"'}), 400
-    dynamodb_client.delete_item(
+    storage.delete_item(
         TableName=SHOPPING_LIST_TABLE, Key={'userId': {'S': userId}, 'itemId': {'S': itemId}}
     )
     return jsonify({'message': 'Item deleted successfully'})
 
 
+@app.route('/shoppingList/items:batch', methods=['POST'])
+def batch_shopping_list_items():
+    userId = (request.json or {}).get('userId')
+    operations = (request.json or {}).get('operations')
+    if not userId or not isinstance(operations, list) or not operations or len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'Please provide "userId" and "operations" as a list of at most '
+                                 f'{MAX_BATCH_OPERATIONS} adds and deletes'}), 400
+    # checking every operation before writing any of them, so a bad one leaves the list as it was
+    errors = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+            errors.append({'index': index, 'error': 'Please provide "op" as "add" or "delete"'})
+        elif not isinstance(operation.get('name'), str) or not operation['name'] or \
+                not isinstance(operation.get('origin'), str) or not operation['origin']:
+            errors.append({'index': index, 'error': 'Please provide both "name" and "origin"'})
+    if errors:
+        return jsonify({'error': 'Some of the operations are not valid, none were written', 'errors': errors}), 400
+    item_ids = [operation['name'] + ',' + operation['origin'] for operation in operations]
+    # BatchWriteItem rejects two writes of the same key, so only the last operation on each item is written
+    last = {item_id: index for index, item_id in enumerate(item_ids)}
+    requests = []
+    for item_id, index in last.items():
+        key = {'userId': {'S': userId}, 'itemId': {'S': item_id}}
+        if operations[index]['op'] == 'add':
+            requests.append({'PutRequest': {'Item': key}})
+        else:
+            requests.append({'DeleteRequest': {'Key': key}})
+    # writing them 25 at a time, retrying what DynamoDB leaves unprocessed
+    failed = set()
+    for unprocessed in storage.batch_write(SHOPPING_LIST_TABLE, requests):
+        key = unprocessed['PutRequest']['Item'] if 'PutRequest' in unprocessed else unprocessed['DeleteRequest']['Key']
+        failed.add(key['itemId']['S'])
+    results = []
+    for index, (operation, item_id) in enumerate(zip(operations, item_ids)):
+        if last[item_id] != index:
+            status = 'superseded'
+        elif item_id in failed:
+            status = 'failed'
+        else:
+            status = BATCH_OPERATIONS[operation['op']]
+        results.append({'op': operation['op'], 'itemId': item_id, 'status': status})
+    return jsonify({'userId': userId, 'results': results})
+
+
 @app.route('/shoppingList/details/<string:userId>')
 def get_list_details(userId):
-    # get all the items in the shopping list belonging to the user
-    result = dynamodb_client.query(
-        TableName=SHOPPING_LIST_TABLE,
-        KeyConditionExpression='userId = :userId',
-        ExpressionAttributeValues={
-            ':userId': {'S': userId}
-        }
-    )
+    # getting every item in the shopping list along with the totals of its journey, which the
+    # storage backend resolves in as few round trips as it can (a single join with SQLite)
+    items = []
     # initialising totals for the whole shopping list
     total_distance = 0
     total_emissions = 0
     total_lead_time = 0
-    items = result.get("Items")
-    # for each item in the list
-    for item in items:
-        # splitting itemId into name and origin
-        name = item.get('itemId').get('S').split(',')[0]
-        origin = item.get('itemId').get('S').split(',')[1]
-        # retrieving the item to get the legs of the journey
-        item_result = dynamodb_client.get_item(
-            TableName=ITEM_TABLE, Key={'name': {'S': name}, 'origin': {'S': origin}}
-        )
-        item_details = item_result.get('Item')
-        if not item_details:
-            return jsonify({'error': f'Could not find food item with name "{name}" and origin "{origin}"'}), 404
-        legs_dynamodb = item_details['legs']['L']
-        legs = [{'origin': leg['M']['origin']['S'], 'destination': leg['M']['destination']['S']} for leg in
-                legs_dynamodb]
-        # initialising totals for the food item
-        distance = 0
-        emissions = 0
-        lead_time = 0
-        # for each leg of the journey adding the distance, emissions and lead time
-        for leg in legs:
-            route_origin = leg.get('origin')
-            route_destination = leg.get('destination')
-            route_result = dynamodb_client.get_item(
-                TableName=ROUTE_TABLE, Key={'origin': {'S': route_origin}, 'destination': {'S': route_destination}}
-            )
-            route = route_result.get('Item')
-            if not route:
-                return jsonify({'error': f'Could not find route with origin "{route_origin}" and destination "{route_destination}"'}), 404
-            distance += int(route.get('distance').get('S'))
-            emissions += int(route.get('emissions').get('S'))
-            lead_time += int(route.get('lead_time').get('S'))
+    for item, item_details in list_item_totals(userId):
         # appending the item details to the item
-        item['itemDetails'] = {
-            'name': name,
-            'origin': origin,
-            'distance': distance,
-            'emissions': emissions,
-            'lead_time': lead_time,
-        }
+        item['itemDetails'] = item_details
+        items.append(item)
         # adding the distance, emissions and lead time of each food item to the shopping list total
-        total_distance += distance
-        total_emissions += emissions
-        total_lead_time += lead_time
+        total_distance += item_details['distance']
+        total_emissions += item_details['emissions']
+        total_lead_time += item_details['lead_time']
     return jsonify(items, {'total_distance': total_distance}, {'total_emissions': total_emissions},
                    {'total_lead_time': total_lead_time})
 
 
+@app.route('/shoppingList/optimize/<string:userId>')
+def optimize_list(userId):
+    # optional limits on the lead time of each item and of the whole list
+    try:
+        max_item_lead_time = request.args.get('max_item_lead_time')
+        max_item_lead_time = int(max_item_lead_time) if max_item_lead_time is not None else None
+        max_lead_time = request.args.get('max_lead_time')
+        max_lead_time = int(max_lead_time) if max_lead_time is not None else None
+    except ValueError:
+        return jsonify({'error': '"max_item_lead_time" and "max_lead_time" must be whole numbers'}), 400
+    if (max_item_lead_time is not None and max_item_lead_time < 0) or (max_lead_time is not None and max_lead_time < 0):
+        return jsonify({'error': '"max_item_lead_time" and "max_lead_time" must not be negative'}), 400
+    list_items = [split_item_id(item['itemId']['S']) for item in storage.query_table(
+        SHOPPING_LIST_TABLE,
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': {'S': userId}}
+    )]
+    # getting every origin of every food in the list, querying each food's partition in parallel
+    names = list(dict.fromkeys(name for name, _ in list_items))
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        candidates = {}
+        for items in executor.map(query_food_origins, names):
+            candidates.update(items)
+    # the legs of all the candidates are resolved together
+    candidate_totals = storage.totals_for_items(candidates)
+    options = []
+    for name, origin in list_items:
+        if (name, origin) not in candidate_totals:
+            raise NotFoundError(f'Could not find food item with name "{name}" and origin "{origin}"')
+        item_options = [totals for (option_name, _), totals in candidate_totals.items() if option_name == name
+                        and (max_item_lead_time is None or totals['lead_time'] <= max_item_lead_time)]
+        if not item_options:
+            return jsonify({'error': f'No origin of "{name}" has a lead time of at most {max_item_lead_time}'}), 400
+        options.append(item_options)
+    choices = choose_origins([[(totals['emissions'], totals['lead_time']) for totals in item_options]
+                              for item_options in options], max_lead_time)
+    if choices is None:
+        return jsonify({'error': f'No choice of origins has a total lead time of at most {max_lead_time}'}), 400
+    items = []
+    for (name, origin), item_options, choice in zip(list_items, options, choices):
+        items.append({'current': candidate_totals[(name, origin)], 'optimal': item_options[choice]})
+    current_emissions = sum(item['current']['emissions'] for item in items)
+    optimal_emissions = sum(item['optimal']['emissions'] for item in items)
+    return jsonify({
+        'userId': userId,
+        'items': items,
+        'total_distance': sum(item['optimal']['distance'] for item in items),
+        'total_emissions': optimal_emissions,
+        'total_lead_time': sum(item['optimal']['lead_time'] for item in items),
+        'emissions_saved': current_emissions - optimal_emissions,
+    })
+
+
+@app.route('/shoppingList/simulate', methods=['POST'])
+def simulate_list():
+    userId = request.json.get('userId')
+    scenarios = request.json.get('scenarios')
+    if not userId or not scenarios:
+        return jsonify({'error': 'Please provide both "userId" and "scenarios"'}), 400
+    if len(scenarios) > MAX_SCENARIOS:
+        return jsonify({'error': f'Please provide at most {MAX_SCENARIOS} "scenarios"'}), 400
+    list_items = [split_item_id(item['itemId']['S']) for item in storage.query_table(
+        SHOPPING_LIST_TABLE,
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': {'S': userId}}
+    )]
+    # each scenario is a list of swaps of an item in the list for another item
+    swaps = []
+    for n, scenario in enumerate(scenarios):
+        try:
+            scenario_swaps = [((str(swap['from']['name']), str(swap['from']['origin'])),
+                               (str(swap['to']['name']), str(swap['to']['origin']))) for swap in scenario]
+        except (KeyError, TypeError):
+            return jsonify({'error': f'Scenario {n} must be a list of "from" and "to" items with "name" and "origin"'}), 400
+        for removed, _ in scenario_swaps:
+            # an item can only be swapped out as many times as it is in the list
+            if [swap[0] for swap in scenario_swaps].count(removed) > list_items.count(removed):
+                return jsonify({'error': f'Scenario {n} swaps "{removed[0]}" from "{removed[1]}" which is not in the list'}), 400
+        swaps.append(scenario_swaps)
+    # loading the totals of every item in the list or in any scenario once
+    item_keys = list(dict.fromkeys(list_items + [item for scenario in swaps for swap in scenario for item in swap]))
+    item_totals = resolve_item_totals(item_keys)
+    index = {key: i for i, key in enumerate(item_keys)}
+    base_counts = [0] * len(item_keys)
+    for key in list_items:
+        base_counts[index[key]] += 1
+    totals = [[item_totals[key][metric] for metric in METRICS] for key in item_keys]
+    # working out the totals of every scenario together
+    base_totals, scenario_totals = simulate_substitutions(
+        base_counts, totals, [[(index[removed], index[added]) for removed, added in scenario] for scenario in swaps]
+    )
+    base = {f'total_{metric}': to_number(value) for metric, value in zip(METRICS, base_totals)}
+    results = []
+    for scenario_total in scenario_totals:
+        result = {f'total_{metric}': to_number(value) for metric, value in zip(METRICS, scenario_total)}
+        result['emissions_saved'] = to_number(base_totals[METRICS.index('emissions')] -
+                                              scenario_total[METRICS.index('emissions')])
+        results.append(result)
+    return jsonify({'userId': userId, 'current': base, 'scenarios': results})
+
+
 @app.route('/savedList/list', methods=['POST'])
 def add_list():
     userId = request.json.get('userId')
@@ -163,13 +497,19 @@ def add_list():
         }
         new_item['items']['L'].append({'M': item_id})
     # saving the shopping list to the table of saved shopping lists
-    dynamodb_client.put_item(
+    storage.put_item(
         TableName=SAVED_LIST_TABLE, Item=new_item
     )
+    # adding the emissions of the list's journeys to the heatmap and the list to the user's rollups
+    item_ids = [item['M']['itemId']['S'] for item in new_item['items']['L']]
+    update_heatmap(item_ids)
+    totals = saved_list_totals(item_ids)
+    update_stats(userId, current_time, totals)
+    update_sketches(userId, item_ids, totals['emissions'])
     # deleting all the items in the SHOPPING_LIST_TABLE associated with the userId to start a new shopping list
     for item in items:
         item_id = item.get('itemId').get('S')
-        dynamodb_client.delete_item(
+        storage.delete_item(
             TableName=SHOPPING_LIST_TABLE,
             Key={
                 'userId': {'S': userId},
@@ -179,30 +519,280 @@ def add_list():
     return jsonify({'message': 'Items saved successfully'})
 
 
+def count_list_routes(item_ids):
+    # how many times each route appears in the journeys of a collection of bought items,
+    # items that can not be found are left out
+    item_counts = {}
+    for item_id in item_ids:
+        key = split_item_id(item_id)
+        item_counts[key] = item_counts.get(key, 0) + 1
+    items = storage.batch_get(ITEM_TABLE, ('name', 'origin'), list(item_counts))
+    route_counts = {}
+    for key, item in items.items():
+        for leg in get_item_legs(item):
+            route_counts[leg] = route_counts.get(leg, 0) + item_counts[key]
+    return route_counts
+
+
+def get_route_geometry(keys):
+    # the (emissions, [lat, lng] coordinates) of each route
+    routes = storage.batch_get(
+        ROUTE_TABLE, ('origin', 'destination'), keys,
+        ProjectionExpression='#origin, #destination, #emissions, #coordinates',
+        ExpressionAttributeNames={'#origin': 'origin', '#destination': 'destination', '#emissions': 'emissions',
+                                  '#coordinates': 'coordinates'}
+    )
+    return {key: (number_value(route['emissions']), [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])]
+                                                     for coord in route['coordinates']['L']])
+            for key, route in routes.items()}
+
+
+def update_heatmap(item_ids):
+    # adding the emissions of newly bought items to the heatmap cells their journeys pass through
+    # with atomic counters, so the heatmap never has to be rebuilt from the whole history; routes other
+    # containers have written since the last check lose their rasters first
+    sync_dependencies()
+    route_counts = count_list_routes(item_ids)
+    routes = get_route_geometry(list(route_counts))
+    if len(route_rasters) > MAX_CACHED_RASTERS:
+        route_rasters.clear()
+    updates = []
+    for resolution in HEATMAP_RESOLUTIONS:
+        heat = heat_by_cell(routes, route_counts, resolution, route_rasters)
+        updates.extend((str(resolution), cell, emissions) for cell, emissions in heat.items())
+
+    def add_heat(update):
+        resolution, cell, emissions = update
+        storage.update_item(
+            TableName=HEATMAP_TABLE,
+            Key={'resolution': {'S': resolution}, 'cell': {'S': cell}},
+            UpdateExpression='ADD emissions :emissions',
+            ExpressionAttributeValues={':emissions': {'N': str(round(emissions, 3))}}
+        )
+
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        list(executor.map(add_heat, updates))
+
+
+@app.route('/heatmap', methods=['GET'])
+def get_heatmap():
+    resolution = request.args.get('resolution', str(HEATMAP_RESOLUTIONS[-1]))
+    try:
+        resolution = float(resolution)
+    except ValueError:
+        resolution = None
+    if resolution not in HEATMAP_RESOLUTIONS:
+        return jsonify({'error': f'"resolution" must be one of {", ".join(str(r) for r in HEATMAP_RESOLUTIONS)}'}), 400
+    # optional viewport to limit the cells to
+    try:
+        bounds = [float(request.args.get(name, default)) for name, default in
+                  (('minLat', -90), ('minLng', -180), ('maxLat', 90), ('maxLng', 180))]
+    except ValueError:
+        return jsonify({'error': '"minLat", "minLng", "maxLat" and "maxLng" must be numbers'}), 400
+    min_lat, min_lng, max_lat, max_lng = bounds
+    cells = []
+    # every cell of a resolution is in one partition of the heatmap table
+    for cell in storage.query_table(
+        HEATMAP_TABLE,
+        KeyConditionExpression='#resolution = :resolution',
+        ExpressionAttributeNames={'#resolution': 'resolution'},
+        ExpressionAttributeValues={':resolution': {'S': str(resolution)}}
+    ):
+        lat, lng = cell_bounds(cell['cell']['S'], resolution)
+        if lat + resolution < min_lat or lat > max_lat or lng + resolution < min_lng or lng > max_lng:
+            continue
+        cells.append({'lat': lat, 'lng': lng, 'emissions': to_number(float(cell['emissions']['N']))})
+    cells.sort(key=lambda cell: -cell['emissions'])
+    return jsonify({'resolution': resolution, 'cells': cells})
+
+
+def stats_periods(created_at):
+    # sort keys of the rollups a list saved at created_at counts towards, e.g. "day#2024-01-31"
+    return [f'{granularity}#{created_at[:length]}' for granularity, length in STATS_GRANULARITIES.items()]
+
+
+def found_item_totals(item_keys):
+    # the totals of each unique food item, leaving out items that can not be found
+    item_keys = list(dict.fromkeys(item_keys))
+    try:
+        return resolve_item_totals(item_keys)
+    except NotFoundError:
+        item_totals = {}
+        for key in item_keys:
+            try:
+                item_totals.update(resolve_item_totals([key]))
+            except NotFoundError:
+                pass
+        return item_totals
+
+
+def saved_list_totals(item_ids, item_totals=None):
+    # the distance, emissions and lead time of the items of a saved list and how many of them there are,
+    # items that can not be found are left out like they are from the heatmap
+    keys = [split_item_id(item_id) for item_id in item_ids]
+    if item_totals is None:
+        item_totals = found_item_totals(keys)
+    found = [item_totals[key] for key in keys if key in item_totals]
+    totals = {metric: sum(item[metric] for item in found) for metric in METRICS}
+    totals['items'] = len(found)
+    return totals
+
+
+def update_stats(user_id, created_at, totals):
+    # adding a saved list to the user's daily and monthly rollups with atomic counters,
+    # so they never have to be worked out again from the user's whole history
+    names = {f'#{name}': name for name in METRICS + ('items', 'lists')}
+    values = {f':{name}': {'N': str(totals[name])} for name in METRICS + ('items',)}
+    values[':lists'] = {'N': '1'}
+    for period in stats_periods(created_at):
+        storage.update_item(
+            TableName=STATS_TABLE,
+            Key={'userId': {'S': user_id}, 'period': {'S': period}},
+            UpdateExpression='ADD ' + ', '.join(f'{name} {name.replace("#", ":")}' for name in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+
+def sketch_shard_key(shard):
+    return {'userId': {'S': GLOBAL_STATS_USER}, 'period': {'S': f'sketch#{shard:02d}'}}
+
+
+def read_sketches(shard_item):
+    # the sketches of a shard, empty sketches for a shard that has not been written yet
+    return {name: sketch_type.from_bytes(bytes(shard_item[name]['B'])) if shard_item and name in shard_item
+            else sketch_type() for name, sketch_type in SKETCHES.items()}
+
+
+def add_to_sketches(sketches, user_id, item_ids, emissions):
+    sketches['emissions'].add(emissions)
+    sketches['users'].add(user_id)
+    for item_id in item_ids:
+        sketches['foods'].add(split_item_id(item_id)[0])
+
+
+def write_sketches(shard, sketches, version=None):
+    # writing the sketches of a shard, on condition that it has not been written since it was
+    # read at version, raising ConditionalCheckFailedException if it has
+    item = dict(sketch_shard_key(shard), version={'N': str((version or 0) + 1)})
+    item.update({name: {'B': sketch.to_bytes()} for name, sketch in sketches.items()})
+    kwargs = {}
+    if version is not None:
+        kwargs = {'ConditionExpression': 'attribute_not_exists(#version) OR #version = :version',
+                  'ExpressionAttributeNames': {'#version': 'version'},
+                  'ExpressionAttributeValues': {':version': {'N': str(version)}}}
+    storage.put_item(TableName=STATS_TABLE, Item=item, **kwargs)
+
+
+def update_sketches(user_id, item_ids, emissions):
+    # adding a saved list to the sketches of a random shard, reading the shard and writing it back
+    # on condition that no other checkout wrote it in between, trying another shard if one did
+    for _ in range(SKETCH_WRITE_RETRIES):
+        shard = random.randrange(SKETCH_SHARDS)
+        shard_item = storage.get_item(TableName=STATS_TABLE, Key=sketch_shard_key(shard)).get('Item')
+        sketches = read_sketches(shard_item)
+        add_to_sketches(sketches, user_id, item_ids, emissions)
+        try:
+            write_sketches(shard, sketches, int(shard_item['version']['N']) if shard_item else 0)
+            return
+        except storage.exceptions.ConditionalCheckFailedException:
+            continue
+    app.logger.warning('Could not add a saved list of "%s" to the global sketches', user_id)
+
+
+def get_global_sketches():
+    # the sketches of every shard merged together, read again every SKETCH_CHECK_INTERVAL seconds
+    global global_sketches, global_sketches_read_at
+    if global_sketches is None or time.time() - global_sketches_read_at > SKETCH_CHECK_INTERVAL:
+        shards = storage.batch_get(STATS_TABLE, ('userId', 'period'),
+                                   [(GLOBAL_STATS_USER, f'sketch#{shard:02d}') for shard in range(SKETCH_SHARDS)])
+        merged = read_sketches(None)
+        for shard_item in shards.values():
+            for name, sketch in read_sketches(shard_item).items():
+                merged[name].merge(sketch)
+        global_sketches = merged
+        global_sketches_read_at = time.time()
+    return global_sketches
+
+
+@app.route('/stats', methods=['GET'])
+def get_global_stats():
+    try:
+        percentiles = [float(percentile) for percentile in request.args.get('percentiles', '10,25,50,75,90').split(',')]
+        emissions = request.args.get('emissions')
+        emissions = float(emissions) if emissions is not None else None
+    except ValueError:
+        return jsonify({'error': '"percentiles" must be comma separated numbers and "emissions" a number'}), 400
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        return jsonify({'error': '"percentiles" must be between 0 and 100'}), 400
+    sketches = get_global_sketches()
+    result = {
+        'lists': len(sketches['emissions']),
+        'distinct_users': sketches['users'].count(),
+        'distinct_foods': sketches['foods'].count(),
+        'emissions_percentiles': {f'{percentile:g}': None if len(sketches['emissions']) == 0 else
+                                  to_number(sketches['emissions'].quantile(percentile / 100))
+                                  for percentile in percentiles},
+    }
+    # the share of saved lists with more emissions than a basket with these emissions
+    if emissions is not None:
+        fraction = sketches['emissions'].fraction_above(emissions)
+        result['greener_than'] = None if fraction is None else round(fraction, 4)
+    return jsonify(result)
+
+
+@app.route('/stats/<string:userId>', methods=['GET'])
+def get_stats(userId):
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in STATS_GRANULARITIES:
+        return jsonify({'error': f'"granularity" must be one of {", ".join(STATS_GRANULARITIES)}'}), 400
+    # every rollup of a user is in one partition of the stats table, in order of their period
+    periods = []
+    for rollup in storage.query_table(
+        STATS_TABLE,
+        KeyConditionExpression='userId = :userId AND begins_with(#period, :granularity)',
+        ExpressionAttributeNames={'#period': 'period'},
+        ExpressionAttributeValues={':userId': {'S': userId}, ':granularity': {'S': f'{granularity}#'}}
+    ):
+        period = {'period': rollup['period']['S'].split('#', 1)[1]}
+        period.update({f'total_{metric}': to_number(float(rollup[metric]['N'])) for metric in METRICS})
+        period.update({name: int(rollup[name]['N']) for name in ('items', 'lists')})
+        periods.append(period)
+    return jsonify({'userId': userId, 'granularity': granularity, 'periods': periods})
+
+
 @app.route('/savedList/list/<string:userId>', methods=['GET'])
-async def get_saved_list(userId):
+def get_saved_list(userId):
     # retrieve all saved lists for the user
-    result = dynamodb_client.query(
+    result = storage.query(
         TableName=SAVED_LIST_TABLE,
         KeyConditionExpression='userId = :userId',
         ExpressionAttributeValues={
             ':userId': {'S': userId}
         }
     )
+    # building the plan of every unique food item across all the saved lists,
+    # so the same item bought every week is only looked up once
+    item_keys = []
+    for saved_list in result['Items']:
+        for saved_item in saved_list['items']['L']:
+            item_keys.append(split_item_id(saved_item['M']['itemId']['S']))
+    # resolving each unique item and each unique leg once
+    item_totals = resolve_item_totals(item_keys)
+
     saved_lists = []
     # for each saved list
     for saved_list in result['Items']:
-        saved_items = saved_list['items']['L']
-        # asynchronously getting the item details of each item in the saved list
-        items = await asyncio.gather(*[create_list_item(item) for item in saved_items])
-
+        items = []
         # totals to keep track of distance, emissions and lead time for entire saved list
         total_distance = 0
         total_emissions = 0
         total_lead_time = 0
 
-        # appending to the totals the distance, emissions and lead time of each item
-        for item in items:
+        # assembling the saved list from the resolved items
+        for saved_item in saved_list['items']['L']:
+            item = dict(item_totals[split_item_id(saved_item['M']['itemId']['S'])])
+            items.append(item)
             total_distance += item['distance']
             total_emissions += item['emissions']
             total_lead_time += item['lead_time']
@@ -220,56 +810,6 @@ async def get_saved_list(userId):
     return jsonify(saved_lists)
 
 
-async def create_list_item(item):
-    name = item['M']['itemId']['S'].split(',')[0]
-    origin = item['M']['itemId']['S'].split(',')[1]
-    # get the item from the item table to get the legs
-    result = dynamodb_client.get_item(
-        TableName=ITEM_TABLE, Key={'name': {'S': name}, 'origin': {'S': origin}}
-    )
-    saved_item = result['Item']
-    if not saved_item:
-        return jsonify({'error': f'Could not find food item with name "{name}" and origin "{origin}"'}), 404
-
-    legs = saved_item['legs']['L']
-
-    # asynchronously gathers route information for each leg of the journey
-    routes = await asyncio.gather(*[get_route_info(leg) for leg in legs])
-
-    # total distance, emissions and lead time for a food item
-    distance = 0
-    emissions = 0
-    lead_time = 0
-
-    # appending distance, emissions and lead time of each leg of the journey to the food item's total
-    for route in routes:
-        distance += int(route['distance']['S'])
-        emissions += int(route['emissions']['S'])
-        lead_time += int(route['lead_time']['S'])
-    # return a dictionary with a food item's details
-    return {
-        'name': saved_item['name']['S'],
-        'origin': saved_item['origin']['S'],
-        'distance': distance,
-        'emissions': emissions,
-        'lead_time': lead_time,
-    }
-
-
-async def get_route_info(leg):
-    route_origin = leg['M']['origin']['S']
-    route_destination = leg['M']['destination']['S']
-    # get route details for a leg of the journey
-    route_result = dynamodb_client.get_item(
-        TableName=ROUTE_TABLE, Key={'origin': {'S': route_origin}, 'destination': {'S': route_destination}}
-    )
-    route = route_result.get('Item')
-    if not route:
-        return jsonify({
-            'error': f'Could not find route with origin "{route_origin}" and destination "{route_destination}"'}), 404
-    return route
-
-
 @app.route('/route', methods=['POST'])
 def add_route():
     origin = request.json.get('origin')
@@ -280,41 +820,790 @@ def add_route():
     transport_mode = request.json.get('transport_mode')
     distance = request.json.get('distance')
     emissions = request.json.get('emissions')
+    points = request.json.get('coordinates') or []
     coordinates = []
-    for item in request.json.get('coordinates'):
+    for item in points:
         coordinates.append({'L': [{'N': str(item[0])}, {'N': str(item[1])}]})
-    if not origin or not destination or not origin_lat_lng or not destination_lat_lng or not lead_time or not transport_mode or not distance or not emissions or not coordinates:
+    if not origin or not destination or not origin_lat_lng or not destination_lat_lng or not lead_time or not transport_mode or not coordinates:
         return jsonify({'error': 'Please provide all required attributes'}), 400
-    dynamodb_client.put_item(
-        TableName=ROUTE_TABLE,
-        Item={'origin': {'S': origin}, 'destination': {'S': destination}, 'origin_lat_lng': {'S': origin_lat_lng},
-              'destination_lat_lng': {'S': destination_lat_lng}, 'lead_time': {'S': lead_time},
-              'transport_mode': {'S': transport_mode}, 'distance': {'S': distance}, 'emissions': {'S': emissions},
-              'coordinates': {'L': coordinates}}
-    )
+    # working out the distance of the leg from its coordinates, to fill it in if it was not
+    # provided or to check the distance provided is close to it
+    try:
+        computed_distance = route_distance(points, origin_lat_lng, destination_lat_lng)
+        provided_distance = float(distance) if distance else None
+    except (TypeError, ValueError):
+        return jsonify({'error': '"distance" must be a number, "coordinates" a list of [lat, lng] pairs and '
+                                 '"origin_lat_lng" and "destination_lat_lng" must be "lat,lng"'}), 400
+    if provided_distance is None:
+        distance = str(round(computed_distance))
+    elif not computed_distance:
+        # coordinates that all sit on one spot have no length to check the distance against
+        pass
+    elif abs(provided_distance - computed_distance) > DISTANCE_TOLERANCE * computed_distance:
+        return jsonify({'error': f'"distance" {distance} does not match the {round(computed_distance)} km '
+                                 f'of the route coordinates'}), 400
+    # numbers are stored as N and places as [lat, lng] numeric pairs
+    try:
+        route = {'origin': {'S': origin}, 'destination': {'S': destination},
+                 'origin_lat_lng': lat_lng_attribute(origin_lat_lng),
+                 'destination_lat_lng': lat_lng_attribute(destination_lat_lng),
+                 'lead_time': number_attribute(int(lead_time)), 'transport_mode': {'S': transport_mode},
+                 'distance': number_attribute(int(distance)), 'coordinates': {'L': coordinates},
+                 # bounding box of the leg as [min lat, min lng, max lat, max lng] for viewport searches
+                 'bbox': {'L': [{'N': str(value)} for value in bounding_box(points)]}}
+    except ValueError:
+        return jsonify({'error': '"lead_time" and "distance" must be whole numbers and "origin_lat_lng" and '
+                                 '"destination_lat_lng" must be "lat,lng"'}), 400
+    # emissions are worked out from the distance and the factor of the transport mode,
+    # the emissions provided are only used for transport modes without a factor
+    factor_version, factors = get_emission_factors()
+    computed_emissions = compute_emissions(distance, transport_mode, factors)
+    if computed_emissions is not None:
+        route['emissions'] = number_attribute(computed_emissions)
+        route['emission_factor_version'] = {'S': factor_version}
+    elif emissions:
+        try:
+            route['emissions'] = number_attribute(int(emissions))
+        except ValueError:
+            return jsonify({'error': '"emissions" must be a whole number'}), 400
+    else:
+        return jsonify({'error': f'Please provide "emissions", there is no emission factor for "{transport_mode}"'}), 400
+    # the route it replaces, if any, comes back with the write so its old geometry can be taken off the map
+    previous = storage.put_item(TableName=ROUTE_TABLE, Item=route, ReturnValues='ALL_OLD').get('Attributes')
+    update_journey_legs(route)
+    bump_catalogue_version('route', [(origin, destination)])
+    update_route_snapshot(route_summary(route))
+    update_route_tiles(route, previous)
     return jsonify({'message': 'Route added successfully'})
 
 
+@app.route('/route/path', methods=['GET'])
+def get_route_path():
+    source = request.args.get('from')
+    target = request.args.get('to')
+    minimize = request.args.get('minimize', 'emissions')
+    if not source or not target:
+        return jsonify({'error': 'Please provide both "from" and "to"'}), 400
+    if minimize not in METRICS:
+        return jsonify({'error': f'"minimize" must be one of {", ".join(METRICS)}'}), 400
+    source = capitalize_first_letter(source)
+    target = capitalize_first_letter(target)
+    graph = get_route_graph()
+    path = graph.shortest_path(source, target, minimize)
+    if path is None:
+        raise NotFoundError(f'Could not find a route from "{source}" to "{target}"')
+    totals = graph.path_totals(path)
+    return jsonify({'from': source, 'to': target, 'minimize': minimize,
+                    'legs': [graph.edge(e) for e in path],
+                    'total_distance': totals['distance'], 'total_emissions': totals['emissions'],
+                    'total_lead_time': totals['lead_time']})
+
+
+@app.route('/route/pareto', methods=['GET'])
+def get_route_pareto():
+    source = request.args.get('from')
+    target = request.args.get('to')
+    if not source or not target:
+        return jsonify({'error': 'Please provide both "from" and "to"'}), 400
+    try:
+        limit = min(int(request.args.get('limit', 20)), MAX_PARETO_RESULTS)
+        time_budget_ms = min(int(request.args.get('time_budget_ms', 500)), MAX_PARETO_TIME_BUDGET_MS)
+    except ValueError:
+        return jsonify({'error': '"limit" and "time_budget_ms" must be whole numbers'}), 400
+    if limit < 1 or time_budget_ms < 1:
+        return jsonify({'error': '"limit" and "time_budget_ms" must be positive'}), 400
+    source = capitalize_first_letter(source)
+    target = capitalize_first_letter(target)
+    graph = get_route_graph()
+    if not graph.has_node(source) or not graph.has_node(target):
+        raise NotFoundError(f'Could not find a route from "{source}" to "{target}"')
+    paths, complete = graph.pareto_paths(source, target, limit, time_budget_ms / 1000)
+    journeys = []
+    for path in paths:
+        totals = graph.path_totals(path)
+        journeys.append({'legs': [graph.edge(e) for e in path], 'total_distance': totals['distance'],
+                         'total_emissions': totals['emissions'], 'total_lead_time': totals['lead_time']})
+    # complete is false when the search stopped at the limit or ran out of time,
+    # the journeys returned are still all on the frontier
+    return jsonify({'from': source, 'to': target, 'journeys': journeys, 'complete': complete})
+
+
+def get_route_snapshot():
+    # a summary of every route in the route table, leaving out the coordinates, which is reused
+    # for later requests in a warm container until it is too old
+    global route_snapshot, route_snapshot_loaded_at, route_graph, place_indexes, route_box_index
+    if route_snapshot is None or time.time() - route_snapshot_loaded_at > ROUTE_SNAPSHOT_TTL:
+        # the catalogue has every route already, the route table is only read without one
+        current_catalogue = get_catalogue()
+        if current_catalogue is not None:
+            route_snapshot = current_catalogue.route_summaries()
+        else:
+            route_snapshot = [route_summary(route) for route in scan_route_summaries()]
+        route_snapshot_loaded_at = time.time()
+        # anything built from the old snapshot is rebuilt when it is next needed
+        route_graph = None
+        place_indexes = None
+        route_box_index = None
+    return route_snapshot
+
+
+def scan_route_summaries():
+    # every route in the route table, leaving out the coordinates
+    return storage.scan_table(
+        ROUTE_TABLE,
+        ProjectionExpression='#origin, #destination, #origin_lat_lng, #destination_lat_lng, '
+                             '#distance, #emissions, #lead_time, #bbox, #transport_mode',
+        ExpressionAttributeNames={'#origin': 'origin', '#destination': 'destination',
+                                  '#origin_lat_lng': 'origin_lat_lng',
+                                  '#destination_lat_lng': 'destination_lat_lng', '#distance': 'distance',
+                                  '#emissions': 'emissions', '#lead_time': 'lead_time', '#bbox': 'bbox',
+                                  '#transport_mode': 'transport_mode'}
+    )
+
+
+def get_catalogue():
+    # the newest catalogue this container has, checking the version item at most every
+    # CATALOGUE_CHECK_INTERVAL seconds and building a newer catalogue in the background when it changed,
+    # returns None while there is no catalogue yet or this container has written something newer than it
+    global catalogue
+    if catalogue is None:
+        # another process, or an earlier invocation of this container, may have built one already
+        catalogue = catalogue_store.latest()
+    version = check_catalogue_version()
+    if catalogue is None or catalogue.version < version:
+        newer = catalogue_store.open(version)
+        if newer is not None:
+            catalogue = newer
+        else:
+            start_catalogue_build(version)
+    if catalogue is None or catalogue.version < catalogue_min_version:
+        return None
+    return catalogue
+
+
+def check_catalogue_version():
+    # the version of the item and route tables, reading the version item at most every CATALOGUE_CHECK_INTERVAL seconds
+    global catalogue_checked_at, catalogue_version
+    if time.time() - catalogue_checked_at > CATALOGUE_CHECK_INTERVAL:
+        catalogue_checked_at = time.time()
+        catalogue_version = load_catalogue_version()
+    return catalogue_version
+
+
+def load_catalogue_version():
+    result = storage.get_item(TableName=CATALOGUE_TABLE, Key=CATALOGUE_VERSION_KEY, ConsistentRead=True)
+    item = result.get('Item')
+    return int(item['version']['N']) if item else 0
+
+
+def bump_catalogue_version(kind='all', keys=()):
+    # counting a write to the item or route table so every container builds a new catalogue,
+    # this container stops using its catalogue until it has caught up with its own write
+    # kind is "item" or "route" for writes of the keys, or "all" for a write of the whole table,
+    # and is recorded in the change log so bundles stop using what it replaced
+    global catalogue_min_version
+    started = time.perf_counter()
+    keys = list(keys)
+    if kind == 'all':
+        local_changes['all'] = True
+    else:
+        local_changes[kind].update(keys)
+    # one record, and so one version, for every CHANGE_KEYS_PER_RECORD keys
+    parts = [keys[i:i + CHANGE_KEYS_PER_RECORD] for i in range(0, len(keys), CHANGE_KEYS_PER_RECORD)] or [[]]
+    result = storage.update_item(
+        TableName=CATALOGUE_TABLE,
+        Key=CATALOGUE_VERSION_KEY,
+        UpdateExpression='ADD #version :count',
+        ExpressionAttributeNames={'#version': 'version'},
+        ExpressionAttributeValues={':count': {'N': str(len(parts))}},
+        ReturnValues='UPDATED_NEW'
+    )
+    version = int(result['Attributes']['version']['N'])
+    catalogue_min_version = max(catalogue_min_version, version)
+    for i, part in enumerate(parts):
+        storage.put_item(TableName=CATALOGUE_TABLE, Item=change_record(version - len(parts) + 1 + i, kind, part))
+    # dropping what this container has cached from the items or routes straight away
+    changes = {'item': set(), 'route': set(), 'all': kind == 'all'}
+    if kind != 'all':
+        changes[kind].update(keys)
+    invalidate_changes(changes, started)
+    update_item_filter(changes)
+
+
+def change_record(version, kind, keys):
+    return {'pk': {'S': change_partition(version)}, 'sk': {'S': change_sort_key(version)}, 'kind': {'S': kind},
+            'version': {'N': str(version)}, 'keys': {'L': [{'L': [{'S': key[0]}, {'S': key[1]}]} for key in keys]}}
+
+
+def get_bundle():
+    # the bundle, or None when there is no bundle or the whole of a table has been written since it
+    # was built; while the tables are newer than the bundle the change log is read again at most
+    # every CATALOGUE_CHECK_INTERVAL seconds to find the keys written since
+    global bundle, bundle_opened, bundle_checked_at, bundle_changes
+    if not bundle_opened:
+        bundle_opened = True
+        try:
+            bundle = Catalogue(CATALOGUE_BUNDLE)
+        except (FileNotFoundError, ValueError):
+            bundle = None
+    if bundle is None:
+        return None
+    if check_catalogue_version() > bundle.version and time.time() - bundle_checked_at > CATALOGUE_CHECK_INTERVAL:
+        bundle_checked_at = time.time()
+        bundle_changes = read_changes(bundle.version)
+    if bundle_changes['all'] or local_changes['all']:
+        return None
+    return bundle
+
+
+def change_partition(version):
+    return f'{CATALOGUE_CHANGES_PREFIX}{int(version) % CHANGE_SHARDS}'
+
+
+def change_sort_key(version):
+    return str(int(version)).zfill(CHANGE_VERSION_DIGITS)
+
+
+def read_changes(version):
+    # the items and routes written since a version of the tables, from the change log, along with
+    # the newest version read, which is the version given when nothing has been written since
+    changes = {'item': set(), 'route': set(), 'all': False, 'version': version}
+    with ThreadPoolExecutor(max_workers=CHANGE_SHARDS) as executor:
+        shards = list(executor.map(lambda shard: list(storage.query_table(
+            CATALOGUE_TABLE,
+            KeyConditionExpression='pk = :pk AND sk > :version',
+            ExpressionAttributeValues={':pk': {'S': f'{CATALOGUE_CHANGES_PREFIX}{shard}'},
+                                       ':version': {'S': change_sort_key(version)}}
+        )), range(CHANGE_SHARDS)))
+    for change in (change for shard in shards for change in shard):
+        changes['version'] = max(changes['version'], int(change['version']['N']))
+        if change['kind']['S'] == 'all':
+            changes['all'] = True
+        else:
+            changes[change['kind']['S']].update(tuple(value['S'] for value in key['L']) for key in change['keys']['L'])
+    # trim_changes.py deletes the records up to a version after saying so on the version item, which is read
+    # after the records so a trim that removed some of them is always seen; everything written since a
+    # version older than that can no longer be told apart
+    result = storage.get_item(TableName=CATALOGUE_TABLE, Key=CATALOGUE_VERSION_KEY, ConsistentRead=True)
+    trimmed = result.get('Item', {}).get('trimmed')
+    if trimmed is not None and version < int(trimmed['N']):
+        changes['all'] = True
+        changes['version'] = max(changes['version'], int(result['Item']['version']['N']))
+    return changes
+
+
+def item_dependency_records(item):
+    # catalogue table records saying the food item uses the route of each of its legs
+    return [{'pk': {'S': f'{DEPENDENCY_PREFIX}{leg[0]},{leg[1]}'},
+             'sk': {'S': f'{item["name"]["S"]},{item["origin"]["S"]}'}} for leg in set(get_item_legs(item))]
+
+
+def write_item_dependencies(item):
+    # records of legs an earlier version of the item had are left, they only make a write to
+    # that route invalidate a little more than it needs to
+    storage.batch_write(CATALOGUE_TABLE, [{'PutRequest': {'Item': record}}
+                                          for record in item_dependency_records(item)])
+
+
+def route_users(route_key):
+    # the keys of the food items that use a route
+    return [split_item_id(record['sk']['S']) for record in storage.query_table(
+        CATALOGUE_TABLE,
+        KeyConditionExpression='pk = :pk',
+        ExpressionAttributeValues={':pk': {'S': f'{DEPENDENCY_PREFIX}{route_key[0]},{route_key[1]}'}}
+    )]
+
+
+def invalidate_changes(changes, started=None):
+    # removing the cached results derived from written items, or from items using written routes,
+    # and every cached result when the whole of a table was written; the users of the routes are
+    # looked up in parallel, as a recompute can write many routes at once, and not at all while this
+    # container has nothing cached
+    if changes['all']:
+        dependency_index.clear()
+        route_rasters.clear()
+        return
+    # a written route may have new coordinates, so its rasters are made again when the heatmap next uses it
+    for raster_key in list(route_rasters):
+        if raster_key[0] in changes['route']:
+            route_rasters.pop(raster_key, None)
+    items = set(changes['item'])
+    if changes['route'] and not dependency_index.empty():
+        with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+            for users in executor.map(route_users, changes['route']):
+                items.update(users)
+    dependency_index.invalidate(items, started)
+
+
+def sync_dependencies():
+    # invalidating what other containers have written since the last check, which happens at most
+    # every CATALOGUE_CHECK_INTERVAL seconds along with the check of the catalogue version
+    global dependencies_version
+    version = check_catalogue_version()
+    if dependencies_version is None:
+        # nothing has been cached before the first check
+        dependencies_version = version
+    elif version > dependencies_version:
+        changes = read_changes(dependencies_version)
+        invalidate_changes(changes)
+        update_item_filter(changes)
+        # and making the bundle skip them straight away, so nothing is cached again from its old copy
+        bundle_changes['all'] = bundle_changes['all'] or changes['all']
+        for kind in ('item', 'route'):
+            bundle_changes[kind] = bundle_changes[kind] | changes[kind]
+        # a write whose version has been counted but whose change is not recorded yet is read next time
+        dependencies_version = changes['version']
+
+
+def get_item_filter():
+    # the filter of every food item key, built from the newest catalogue and the changes written since,
+    # or None while there is no catalogue or the whole of the item table has been written since it;
+    # items written by other containers are added when sync_dependencies reads the change log
+    global item_filter, item_filter_version
+    sync_dependencies()
+    if item_filter is not None and not item_filter.full():
+        return item_filter
+    get_catalogue()
+    if catalogue is None or catalogue.version == item_filter_version:
+        return item_filter
+    item_filter_version = catalogue.version
+    changes = read_changes(catalogue.version)
+    if changes['all']:
+        item_filter = None
+        return None
+    keys = catalogue.item_key_pairs()
+    added = changes['item']
+    # leaving room for as many new items again before the error rate goes up
+    built = BloomFilter(2 * (len(keys) + len(added)), ITEM_FILTER_ERROR_RATE)
+    built.update(keys)
+    built.update(added)
+    item_filter = built
+    return item_filter
+
+
+def update_item_filter(changes):
+    # adding written items to the filter, which can no longer be trusted after a write to the whole table
+    global item_filter
+    if changes['all']:
+        item_filter = None
+    elif item_filter is not None:
+        for key in changes['item']:
+            item_filter.add(key)
+
+
+def item_absent(name, origin):
+    # whether the food item definitely does not exist, reading no more than the version item
+    return (name, origin) in absent_items([(name, origin)])
+
+
+def absent_items(keys):
+    # the food item keys that definitely do not exist, reading no more than the version item; the filter
+    # only holds the items other containers had written when the change log was last read, so before
+    # misses are trusted the version is checked again, at most once every ITEM_FILTER_RECHECK_INTERVAL
+    # seconds so requests for made up items can not keep reading it
+    global item_filter_rejected, catalogue_checked_at
+    current_filter = get_item_filter()
+    if current_filter is None:
+        return set()
+    missing = {key for key in keys if key not in current_filter}
+    if missing and time.time() - catalogue_checked_at > ITEM_FILTER_RECHECK_INTERVAL:
+        catalogue_checked_at = 0
+        current_filter = get_item_filter()
+        if current_filter is None:
+            return set()
+        missing = {key for key in missing if key not in current_filter}
+    item_filter_rejected += len(missing)
+    return missing
+
+
+@app.route('/metrics/caches', methods=['GET'])
+def get_cache_metrics():
+    # how much each cache is used and how far and how fast writes invalidate them
+    filter_metrics = None
+    if item_filter is not None:
+        filter_metrics = {'keys': item_filter.count, 'capacity': item_filter.capacity, 'bits': item_filter.size,
+                          'version': item_filter_version, 'rejected': item_filter_rejected}
+    return jsonify({'dependencies': dependency_index.metrics(),
+                    'caches': {name: cache.metrics() for name, cache in dependency_index.caches.items()},
+                    'item_filter': filter_metrics})
+
+
+def changed_since_bundle(key, legs):
+    # whether a food item or any of the routes of its legs has been written since the bundle was built
+    return (key in bundle_changes['item'] or key in local_changes['item'] or
+            any(leg in bundle_changes['route'] or leg in local_changes['route'] for leg in legs))
+
+
+def start_catalogue_build(version):
+    global catalogue_build
+    if catalogue_build is not None and catalogue_build.is_alive():
+        return
+    catalogue_build = threading.Thread(target=build_catalogue, args=(version,), daemon=True)
+    catalogue_build.start()
+
+
+def build_catalogue(version):
+    # reading the item and route tables into a catalogue of the version, the version is read before
+    # the tables so anything written while they are read makes the next check build again;
+    # only one process on the machine builds at a time, the others pick up its file when they next check
+    global catalogue
+    with catalogue_store.build_lock() as locked:
+        if not locked:
+            return
+        built = catalogue_store.open(version)
+        if built is None:
+            catalogue_store.write(version, encode_catalogue(
+                version, scan_route_summaries(), storage.scan_table(ITEM_TABLE), bbox=route_bbox))
+            built = catalogue_store.open(version)
+    if built is not None and (catalogue is None or built.version > catalogue.version):
+        catalogue = built
+
+
+def get_route_graph():
+    global route_graph
+    routes = get_route_snapshot()
+    if route_graph is None:
+        route_graph = RouteGraph(routes)
+    return route_graph
+
+
+def get_place_index(end):
+    # spatial index of the places routes start from (end="origin") or go to (end="destination")
+    global place_indexes
+    routes = get_route_snapshot()
+    if place_indexes is None:
+        place_indexes = {}
+        for route_end in ('origin', 'destination'):
+            places = {}
+            for route in routes:
+                places[route[route_end]] = parse_lat_lng(route[f'{route_end}_lat_lng'])
+            place_indexes[route_end] = PlaceIndex((name, lat, lng) for name, (lat, lng) in places.items())
+    return place_indexes[end]
+
+
+def route_summary(route):
+    # the parts of a route table item kept in the snapshot
+    return {
+        'origin': route['origin']['S'],
+        'destination': route['destination']['S'],
+        'origin_lat_lng': lat_lng_text(route['origin_lat_lng']),
+        'destination_lat_lng': lat_lng_text(route['destination_lat_lng']),
+        'distance': number_text(route['distance']),
+        'emissions': number_text(route['emissions']),
+        'lead_time': number_text(route['lead_time']),
+        'bbox': route_bbox(route),
+    }
+
+
+def update_route_snapshot(route):
+    # keeping a loaded snapshot in step with a route that was just written instead of
+    # reading the whole route table again, the graph and indexes are rebuilt from it when next needed
+    global route_graph, place_indexes, route_box_index
+    if route_snapshot is None:
+        return
+    key = (route['origin'], route['destination'])
+    for i, snapshot_route in enumerate(route_snapshot):
+        if (snapshot_route['origin'], snapshot_route['destination']) == key:
+            route_snapshot[i] = route
+            break
+    else:
+        route_snapshot.append(route)
+    route_graph = None
+    place_indexes = None
+    route_box_index = None
+
+
+def route_bbox(route):
+    # routes added before bounding boxes were stored use the box around their two ends
+    if 'bbox' in route:
+        return tuple(float(value['N']) for value in route['bbox']['L'])
+    return bounding_box([lat_lng_value(route['origin_lat_lng']), lat_lng_value(route['destination_lat_lng'])])
+
+
+def get_route_box_index():
+    global route_box_index
+    routes = get_route_snapshot()
+    if route_box_index is None:
+        route_box_index = BoxIndex([route['bbox'] for route in routes])
+    return route_box_index
+
+
+@app.route('/route/bbox', methods=['GET'])
+def get_routes_in_bbox():
+    try:
+        min_lat = float(request.args['minLat'])
+        min_lng = float(request.args['minLng'])
+        max_lat = float(request.args['maxLat'])
+        max_lng = float(request.args['maxLng'])
+        zoom = int(request.args['zoom']) if 'zoom' in request.args else None
+    except KeyError:
+        return jsonify({'error': 'Please provide "minLat", "minLng", "maxLat" and "maxLng"'}), 400
+    except ValueError:
+        return jsonify({'error': '"minLat", "minLng", "maxLat" and "maxLng" must be numbers and "zoom" a whole number'}), 400
+    if min_lat > max_lat or min_lng > max_lng:
+        return jsonify({'error': '"minLat" and "minLng" must be less than "maxLat" and "maxLng"'}), 400
+    if zoom is None:
+        # the zoom level at which the viewport is about one 256 pixel tile wide
+        zoom = max(0, int(math.log2(360 / max(max_lng - min_lng, 1e-9))))
+    routes = get_route_snapshot()
+    matches = get_route_box_index().search(min_lat, min_lng, max_lat, max_lng)
+    truncated = len(matches) > MAX_BBOX_RESULTS
+    keys = [(routes[i]['origin'], routes[i]['destination']) for i in matches[:MAX_BBOX_RESULTS]]
+    # only the coordinates of the legs in the viewport are read from the route table
+    coordinates = storage.batch_get(
+        ROUTE_TABLE, ('origin', 'destination'), keys,
+        ProjectionExpression='#origin, #destination, #coordinates',
+        ExpressionAttributeNames={'#origin': 'origin', '#destination': 'destination', '#coordinates': 'coordinates'}
+    )
+    # simplifying each leg so no detail smaller than a pixel at the zoom level is sent
+    tolerance = 360 / (256 * 2 ** zoom)
+    legs = []
+    for i, key in zip(matches, keys):
+        if key not in coordinates:
+            continue
+        points = [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])]
+                  for coord in coordinates[key]['coordinates']['L']]
+        legs.append({'origin': key[0], 'destination': key[1],
+                     'distance': routes[i]['distance'], 'emissions': routes[i]['emissions'],
+                     'bbox': list(routes[i]['bbox']), 'coordinates': simplify(points, tolerance)})
+    return jsonify({'zoom': zoom, 'legs': legs, 'truncated': truncated})
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def get_tile(z, x, y):
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        raise NotFoundError(f'Could not find tile {z}/{x}/{y}')
+    tile = tile_store.read(z, x, y)
+    # tiles no leg crosses are not stored and are sent back empty, without letting anyone keep the empty
+    # tile, as it may not have been built yet or a route crossing it may be added later
+    if tile is None:
+        response = make_response('', 204)
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response = make_response(tile)
+        response.headers['Content-Type'] = 'application/x-foodmiles-tile'
+        response.headers['Cache-Control'] = f'public, max-age={TILE_MAX_AGE}'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def update_route_tiles(route, previous=None):
+    # bringing every map tile the new or the replaced geometry of a leg crosses up to date, the tiles of
+    # high zoom levels are rebuilt from every leg crossing them and the leg is patched into the others;
+    # two routes added into the same low zoom tile at the same moment can lose one patch until
+    # build_tiles.py next runs
+    key = (route['origin']['S'], route['destination']['S'])
+    feature = {'origin': key[0], 'destination': key[1], 'emissions': number_text(route['emissions']),
+               'coordinates': route_coordinates(route)}
+    lines = [feature['coordinates']] + ([route_coordinates(previous)] if previous else [])
+    tiles = set().union(*(tiles_for_line(line, zoom) for line in lines for zoom in range(TILE_MAX_ZOOM + 1)))
+    build_tiles({tile for tile in tiles if tile[0] >= TILE_LIVE_MIN_ZOOM})
+    for zoom, x, y in tiles:
+        if zoom < TILE_LIVE_MIN_ZOOM:
+            tile_store.write(zoom, x, y, patch_tile(tile_store.read(zoom, x, y), zoom, x, y, key, feature))
+
+
+def route_coordinates(route):
+    return [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])] for coord in route['coordinates']['L']]
+
+
+def build_tiles(tiles):
+    # encoding and storing a set of (z, x, y) tiles from the legs that cross each of them
+    routes = get_route_snapshot()
+    index = get_route_box_index()
+    tile_routes = {tile: index.search(*tile_bounds(*tile)) for tile in tiles}
+    keys = {(routes[i]['origin'], routes[i]['destination']) for matches in tile_routes.values() for i in matches}
+    # reading the coordinates of every leg needed by any of the tiles once
+    coordinates = storage.batch_get(
+        ROUTE_TABLE, ('origin', 'destination'), list(keys),
+        ProjectionExpression='#origin, #destination, #coordinates',
+        ExpressionAttributeNames={'#origin': 'origin', '#destination': 'destination', '#coordinates': 'coordinates'}
+    )
+    for (zoom, x, y), matches in tile_routes.items():
+        features = []
+        for i in matches:
+            key = (routes[i]['origin'], routes[i]['destination'])
+            if key in coordinates:
+                features.append({'origin': key[0], 'destination': key[1], 'emissions': routes[i]['emissions'],
+                                 'coordinates': [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])]
+                                                 for coord in coordinates[key]['coordinates']['L']]})
+        tile_store.write(zoom, x, y, encode_tile(zoom, x, y, features))
+
+
+@app.route('/route/nearby', methods=['GET'])
+def get_nearby_places():
+    end = request.args.get('end', 'origin')
+    if end not in ('origin', 'destination'):
+        return jsonify({'error': '"end" must be one of origin, destination'}), 400
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args['radius']) if 'radius' in request.args else None
+        k = int(request.args['k']) if 'k' in request.args else None
+    except KeyError:
+        return jsonify({'error': 'Please provide "lat" and "lng" and one of "radius" or "k"'}), 400
+    except ValueError:
+        return jsonify({'error': '"lat", "lng" and "radius" must be numbers and "k" a whole number'}), 400
+    if radius is None and k is None:
+        return jsonify({'error': 'Please provide "lat" and "lng" and one of "radius" or "k"'}), 400
+    index = get_place_index(end)
+    # k nearest places, optionally within the radius, or every place within the radius
+    if k is not None:
+        places = index.nearest(lat, lng, min(k, MAX_NEARBY_RESULTS), radius)
+    else:
+        places = index.within(lat, lng, radius)[:MAX_NEARBY_RESULTS]
+    return jsonify({'end': end, 'places': [
+        {'name': name, 'lat_lng': f'{place_lat},{place_lng}', 'distance': round(distance, 1)}
+        for name, place_lat, place_lng, distance in places
+    ]})
+
+
+@app.route('/emissionFactors', methods=['POST'])
+def add_emission_factors():
+    version = request.json.get('version')
+    factors = request.json.get('factors')
+    if not version or not factors or version == CURRENT_FACTOR_VERSION:
+        return jsonify({'error': 'Please provide both "version" and "factors"'}), 400
+    try:
+        factors = {str(mode): float(factor) for mode, factor in factors.items()}
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'error': '"factors" must map each transport mode to a number'}), 400
+    factor_set = {'factor_version': {'S': version},
+                  'factors': {'M': {mode: {'N': str(factor)} for mode, factor in factors.items()}},
+                  'createdAt': {'S': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}}
+    # factor sets are never changed once added, a new set needs a new version
+    try:
+        storage.put_item(
+            TableName=EMISSION_FACTOR_TABLE, Item=dict(factor_set, version={'S': version}),
+            ConditionExpression='attribute_not_exists(version)'
+        )
+    except storage.exceptions.ConditionalCheckFailedException:
+        return jsonify({'error': f'Emission factor version "{version}" already exists'}), 409
+    # making the new set the one used by add_route
+    storage.put_item(
+        TableName=EMISSION_FACTOR_TABLE, Item=dict(factor_set, version={'S': CURRENT_FACTOR_VERSION})
+    )
+    invalidate_emission_factors()
+    return jsonify({'version': version, 'factors': factors})
+
+
+@app.route('/emissionFactors', defaults={'version': CURRENT_FACTOR_VERSION})
+@app.route('/emissionFactors/<string:version>')
+def get_emission_factor_set(version):
+    factor_version, factors = load_emission_factors(version)
+    if factor_version is None:
+        raise NotFoundError(f'Could not find emission factor version "{version}"')
+    return jsonify({'version': factor_version, 'factors': factors})
+
+
+def load_emission_factors(version=CURRENT_FACTOR_VERSION):
+    # the (version, factors) of a factor set, or (None, {}) if there is no such set
+    result = storage.get_item(TableName=EMISSION_FACTOR_TABLE, Key={'version': {'S': version}})
+    item = result.get('Item')
+    if not item:
+        return None, {}
+    return parse_factors(item)
+
+
+def get_emission_factors():
+    # the factor set in use, reused for later requests in a warm container until it is too old
+    global emission_factors, emission_factors_loaded_at
+    if emission_factors is None or time.time() - emission_factors_loaded_at > ROUTE_SNAPSHOT_TTL:
+        emission_factors = load_emission_factors()
+        emission_factors_loaded_at = time.time()
+    return emission_factors
+
+
+def invalidate_emission_factors():
+    global emission_factors
+    emission_factors = None
+
+
 @app.route('/route/<string:name>/<string:origin>', methods=['GET'])
 def get_route(name, origin):
     # first letter of items stored in the database has capital letter
     # calling method to convert request params to correct format if not already correct
     name = capitalize_first_letter(name)
     origin = capitalize_first_letter(origin)
-    # getting the item with provided name and origin
-    result = dynamodb_client.get_item(
-        TableName=ITEM_TABLE, Key={'name': {'S': name}, 'origin': {'S': origin}}
-    )
-    item = result.get('Item')
+    # serving the finished body of an earlier response for the item until it or one of its routes is written
+    sync_dependencies()
+    compressed = request.accept_encodings['gzip'] > 0
+    key = (name, origin, tuple(sorted(request.args.items(multi=True))), 'gzip' if compressed else 'identity')
+    body = route_response_cache.get(key)
+    if body is None:
+        generation = dependency_index.generation
+        response = make_response(route_response(name, origin))
+        if response.status_code != 200:
+            return response
+        body = response.get_data()
+        if compressed:
+            body = gzip.compress(body)
+        route_response_cache.put(key, body, [(name, origin)], generation)
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if compressed:
+        response.content_encoding = 'gzip'
+    return response
+
+
+def route_response(name, origin):
+    # an item the filter says does not exist is answered from the catalogue, so probing made up
+    # names and origins does not read storage at all
+    if item_absent(name, origin):
+        suggestions = [{'name': suggestion[0], 'origin': suggestion[1]}
+                       for suggestion in catalogue.suggestions(name, origin)]
+        return jsonify({'error': f'Could not find food item with name "{name}" and origin "{origin}"',
+                        'suggestions': suggestions}), 404
+    # getting the item with provided name and origin along with the route of each leg of its journey
+    item, routes = get_journey(name, origin)
     # if an item with the name and origin does not exist, returning a 404 error
     # with tailored suggestions of other searches
     if not item:
         suggestions = get_suggestions(name, origin)
         return jsonify({'error': f'Could not find food item with name "{name}" and origin "{origin}"',
                         'suggestions': suggestions}), 404
-    # getting legs of journey in the food item
-    legs_dynamodb = item['legs']['L']
-    legs = [{'origin': leg['M']['origin']['S'], 'destination': leg['M']['destination']['S']} for leg in legs_dynamodb]
+    return jsonify(*journey_payload(name, origin, routes))
+
+
+@app.route('/route:batchGet', methods=['POST'])
+def batch_get_routes():
+    keys = batch_get_keys(capitalize=True)
+    if keys is None:
+        return jsonify({'error': f'Please provide "keys" as a list of at most {MAX_BATCH_GET_KEYS} objects '
+                                 f'with a "name" and an "origin"'}), 400
+    absent = absent_items(keys)
+    unique_keys = [key for key in dict.fromkeys(keys) if key not in absent]
+    # journeys that have not changed since the bundle was built are read from it, the rest
+    # with one BatchGetItem of their items and one of all their legs
+    journeys = {}
+    current_bundle = get_bundle()
+    if current_bundle is not None:
+        for key in unique_keys:
+            journey = current_bundle.journey(*key, skip=changed_since_bundle)
+            if journey is not None:
+                journeys[key] = journey
+    missing = [key for key in unique_keys if key not in journeys]
+    if missing:
+        journeys.update(storage.journeys(missing))
+    results = []
+    for name, origin in keys:
+        item, routes = journeys.get((name, origin), (None, []))
+        if not item:
+            results.append({'name': name, 'origin': origin,
+                            'error': f'Could not find food item with name "{name}" and origin "{origin}"'})
+            continue
+        missing_legs = [leg for leg, route in zip(get_item_legs(item), routes) if route is None]
+        if missing_legs:
+            results.append({'name': name, 'origin': origin,
+                            'error': f'Could not find route with origin "{missing_legs[0][0]}" '
+                                     f'and destination "{missing_legs[0][1]}"'})
+            continue
+        results.append({'name': name, 'origin': origin, 'route': journey_payload(name, origin, routes)})
+    return jsonify({'results': results})
+
+
+def journey_payload(name, origin, routes):
+    # the legs, totals and points of the journey of a food item, as the list get_route responds with
     items = []
     # variables to store accumulative distance, emissions and lead time
     distance = 0
@@ -322,15 +1611,7 @@ def get_route(name, origin):
     lead_time = 0
     points = []
     # getting details of each leg of the journey
-    for leg in legs:
-        route_origin = leg.get('origin')
-        route_destination = leg.get('destination')
-        route_result = dynamodb_client.get_item(
-            TableName=ROUTE_TABLE, Key={'origin': {'S': route_origin}, 'destination': {'S': route_destination}}
-        )
-        item = route_result.get('Item')
-        if not item:
-            return jsonify({'error': 'Could not find route with provided "origin" and "destination"'}), 404
+    for item in routes:
         coordinates = []
         # converting coordinates into the correct format to be used in creating the map
         for coord in item.get('coordinates').get('L'):
@@ -338,25 +1619,158 @@ def get_route(name, origin):
         # appending to an items list json objects containing the information for each leg of the journey
         items.append(
             {'origin': item.get('origin').get('S'), 'destination': item.get('destination').get('S'),
-             'origin_lat_lng': item.get('origin_lat_lng').get('S'),
-             'destination_lat_lng': item.get('destination_lat_lng').get('S'),
-             'lead_time': item.get('lead_time').get('S'),
-             'transport_mode': item.get('transport_mode').get('S'), 'distance': (item.get('distance').get('S')),
-             'emissions': item.get('emissions').get('S'), 'coordinates': coordinates}
+             'origin_lat_lng': lat_lng_text(item.get('origin_lat_lng')),
+             'destination_lat_lng': lat_lng_text(item.get('destination_lat_lng')),
+             'lead_time': number_text(item.get('lead_time')),
+             'transport_mode': item.get('transport_mode').get('S'), 'distance': number_text(item.get('distance')),
+             'emissions': number_text(item.get('emissions')), 'coordinates': coordinates}
         )
-        origin_lat_lng = item.get('origin_lat_lng').get('S')
-        destination_lat_lng = item.get('destination_lat_lng').get('S')
+        origin_lat_lng = lat_lng_text(item.get('origin_lat_lng'))
+        destination_lat_lng = lat_lng_text(item.get('destination_lat_lng'))
         # creating the set of intermediate destination points
         if origin_lat_lng not in points:
             points.append(origin_lat_lng)
         if destination_lat_lng not in points:
             points.append(destination_lat_lng)
         # accumulating total distance, emissions and lead time for a food item journey
-        distance += int(item.get('distance').get('S'))
-        emissions += int(item.get('emissions').get('S'))
-        lead_time += int(item.get('lead_time').get('S'))
-    return jsonify(items, {'total_distance': distance}, {'total_emissions': emissions},
-                   {'total_lead_time': lead_time}, {'points': list(points)}, {'name': name}, {'origin': origin})
+        distance += number_value(item.get('distance'))
+        emissions += number_value(item.get('emissions'))
+        lead_time += number_value(item.get('lead_time'))
+    return [items, {'total_distance': distance}, {'total_emissions': emissions},
+            {'total_lead_time': lead_time}, {'points': list(points)}, {'name': name}, {'origin': origin}]
+
+
+def reads_journeys():
+    # whether the endpoint handling the request has been moved over to the journey table
+    return bool(JOURNEY_TABLE) and has_request_context() and request.endpoint in JOURNEY_READ_ENDPOINTS
+
+
+def read_journey(name, origin):
+    # a food item and the copies of the routes of its legs, with one query of its partition
+    return split_partition(list(storage.query_table(
+        JOURNEY_TABLE,
+        KeyConditionExpression='pk = :pk',
+        ExpressionAttributeValues={':pk': {'S': item_partition(name, origin)}}
+    )))
+
+
+def get_journey(name, origin):
+    # a food item and the route of each leg of its journey in order, or (None, []) if there is no such item
+    if reads_journeys():
+        return read_journey(name, origin)
+    # journeys that have not changed since the bundle was built are read from it without touching storage
+    current_bundle = get_bundle()
+    journey = current_bundle.journey(name, origin, skip=changed_since_bundle) if current_bundle else None
+    if journey is not None:
+        return journey
+    return storage.journey(name, origin)
+
+
+def resolve_item_totals(item_keys):
+    # the totals of each unique food item, from the journey table when the endpoint reads from it
+    # and from the catalogue otherwise
+    if not reads_journeys():
+        return catalogue_item_totals(item_keys)
+    item_keys = list(dict.fromkeys(item_keys))
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        journeys = list(executor.map(lambda key: read_journey(*key), item_keys))
+    item_totals = {}
+    for (name, origin), (item, routes) in zip(item_keys, journeys):
+        if not item:
+            raise NotFoundError(f'Could not find food item with name "{name}" and origin "{origin}"')
+        item_totals[(name, origin)] = journey_totals(item, routes)
+    return item_totals
+
+
+def catalogue_item_totals(item_keys):
+    # the totals of each unique food item from the bundle, then the catalogue, reading only the items
+    # that are in neither from storage
+    item_totals = {}
+    current_bundle = get_bundle()
+    if current_bundle is not None:
+        item_totals.update(current_bundle.item_totals(item_keys, skip=changed_since_bundle))
+    missing = [key for key in item_keys if key not in item_totals]
+    current_catalogue = get_catalogue() if missing else None
+    if current_catalogue is not None:
+        item_totals.update(current_catalogue.item_totals(missing))
+        missing = [key for key in item_keys if key not in item_totals]
+    if missing:
+        item_totals.update(cached_item_totals(missing))
+    return item_totals
+
+
+def cached_item_totals(item_keys):
+    # the totals of food items read from storage, kept until the item or a route it uses is written
+    sync_dependencies()
+    item_totals = {}
+    for key in item_keys:
+        totals = item_totals_cache.get(key)
+        if totals is not None:
+            item_totals[key] = totals
+    missing = [key for key in item_keys if key not in item_totals]
+    if missing:
+        generation = dependency_index.generation
+        read = storage.item_totals(missing)
+        for key, totals in read.items():
+            item_totals_cache.put(key, totals, [key], generation)
+        item_totals.update(read)
+    return item_totals
+
+
+def list_item_totals(user_id):
+    # every item in a user's shopping list along with its totals, SQLite resolves the whole list in one join
+    # which is quicker than the catalogue
+    if isinstance(storage, SQLiteStorage) or not reads_journeys() and get_bundle() is None and get_catalogue() is None:
+        return storage.list_item_totals(user_id)
+    list_items = list(storage.query_table(
+        SHOPPING_LIST_TABLE,
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': {'S': user_id}}
+    ))
+    item_totals = resolve_item_totals([split_item_id(item['itemId']['S']) for item in list_items])
+    return [(item, item_totals[split_item_id(item['itemId']['S'])]) for item in list_items]
+
+
+def write_journey(item):
+    # writing a food item and copies of the routes of its legs to the journey table,
+    # removing the legs and route references an earlier version of the item no longer has
+    if not JOURNEY_TABLE:
+        return
+    result = storage.get_item(
+        TableName=JOURNEY_TABLE,
+        Key={'pk': {'S': item_partition(item['name']['S'], item['origin']['S'])}, 'sk': {'S': ITEM_SORT_KEY}}
+    )
+    routes = storage.batch_get(ROUTE_TABLE, ('origin', 'destination'), get_item_legs(item))
+    requests = [{'DeleteRequest': {'Key': key}} for key in stale_records(result.get('Item'), item)]
+    requests += [{'PutRequest': {'Item': record}} for record in journey_records(item, routes)]
+    storage.batch_write(JOURNEY_TABLE, requests)
+
+
+def update_journey_legs(route):
+    # updating the copy of a route in the journey of every food item that uses it
+    if not JOURNEY_TABLE:
+        return
+    references = storage.query_table(
+        JOURNEY_TABLE,
+        KeyConditionExpression='pk = :pk',
+        ExpressionAttributeValues={':pk': {'S': route_partition(route['origin']['S'], route['destination']['S'])}}
+    )
+    storage.batch_write(JOURNEY_TABLE, [
+        {'PutRequest': {'Item': leg_record(*parse_reference(reference['sk']['S']), route)}}
+        for reference in references
+    ])
+
+
+def update_journeys_of_routes(route_keys):
+    # updating the journey copies of routes written somewhere other than add_route, such as by a
+    # recompute of their distances or emissions, reading the routes back a batch at a time
+    if not JOURNEY_TABLE:
+        return
+    route_keys = list(dict.fromkeys(route_keys))
+    for i in range(0, len(route_keys), BATCH_GET_LIMIT):
+        for route in storage.batch_get(ROUTE_TABLE, ('origin', 'destination'),
+                                       route_keys[i:i + BATCH_GET_LIMIT]).values():
+            update_journey_legs(route)
 
 
 def capitalize_first_letter(s):
@@ -364,7 +1778,7 @@ def capitalize_first_letter(s):
 
 
 def get_suggestions(name, origin):
-    result = dynamodb_client.scan(
+    result = storage.scan(
         TableName=ITEM_TABLE,
         FilterExpression='#name = :name OR origin = :origin',
         ExpressionAttributeValues={
@@ -384,6 +1798,19 @@ def get_suggestions(name, origin):
     return suggestions
 
 
+@app.errorhandler(NotFoundError)
+def not_found_error(e):
+    return jsonify({'error': str(e)}), 404
+
+
+@app.errorhandler(UnprocessedKeysError)
+def unprocessed_keys_error(e):
+    # the table is being throttled, so the client is asked to try again shortly
+    response = make_response(jsonify({'error': str(e)}), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 @app.errorhandler(404)
 def resource_not_found(e):
     return make_response(jsonify(error='Not found!'), 404)
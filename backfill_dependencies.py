@@ -0,0 +1,40 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import CATALOGUE_TABLE, ITEM_TABLE, item_dependency_records, storage
+
+
+def backfill_segment(segment, total_segments, dry_run):
+    # recording which routes the food items in one segment of a parallel scan of the item table use,
+    # returns the number of items scanned, records written and records that could not be written
+    scanned = 0
+    written = 0
+    failed = 0
+    for page in storage.scan_pages(ITEM_TABLE, Segment=segment, TotalSegments=total_segments):
+        scanned += len(page)
+        requests = [{'PutRequest': {'Item': record}} for item in page for record in item_dependency_records(item)]
+        written += len(requests)
+        if requests and not dry_run:
+            failed += len(storage.batch_write(CATALOGUE_TABLE, requests))
+    return scanned, written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record which routes every food item uses')
+    parser.add_argument('--segments', type=int, default=4, help='number of parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='count the records without writing them')
+    args = parser.parse_args()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(executor.map(lambda segment: backfill_segment(segment, args.segments, args.dry_run),
+                                    range(args.segments)))
+    scanned, written, failed = (sum(counts) for counts in zip(*results))
+    elapsed = time.time() - start
+    print(f'{scanned} items scanned, {written} dependency records written, {failed} failed to write '
+          f'in {elapsed:.1f}s ({scanned / elapsed if elapsed else 0:.0f} items/s)')
+
+
+if __name__ == '__main__':
+    main()
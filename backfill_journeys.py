@@ -0,0 +1,51 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import ITEM_TABLE, JOURNEY_TABLE, ROUTE_TABLE, storage
+from journeys import journey_records
+from storage import get_item_legs
+
+
+def backfill_segment(segment, total_segments, dry_run):
+    # copying the food items in one segment of a parallel scan of the item table into the
+    # journey table a page at a time, returns the number of items scanned, records written
+    # and records that could not be written
+    scanned = 0
+    written = 0
+    failed = 0
+    for page in storage.scan_pages(ITEM_TABLE, Segment=segment, TotalSegments=total_segments):
+        if not page:
+            continue
+        scanned += len(page)
+        # getting the routes of every leg in the page together
+        routes = storage.batch_get(ROUTE_TABLE, ('origin', 'destination'),
+                                   [leg for item in page for leg in get_item_legs(item)])
+        requests = [{'PutRequest': {'Item': record}} for item in page for record in journey_records(item, routes)]
+        written += len(requests)
+        if requests and not dry_run:
+            failed += len(storage.batch_write(JOURNEY_TABLE, requests))
+    return scanned, written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy every food item and its legs into the journey table')
+    parser.add_argument('--segments', type=int, default=4, help='number of parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='count the records without writing them')
+    args = parser.parse_args()
+
+    if not JOURNEY_TABLE:
+        parser.error('JOURNEY_TABLE is not set')
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(executor.map(lambda segment: backfill_segment(segment, args.segments, args.dry_run),
+                                    range(args.segments)))
+    scanned, written, failed = (sum(counts) for counts in zip(*results))
+    elapsed = time.time() - start
+    print(f'{scanned} items scanned, {written} journey records written, {failed} failed to write '
+          f'in {elapsed:.1f}s ({scanned / elapsed if elapsed else 0:.0f} items/s)')
+
+
+if __name__ == '__main__':
+    main()
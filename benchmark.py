@@ -0,0 +1,75 @@
+import argparse
+import random
+import time
+
+from app import ITEM_TABLE, ROUTE_TABLE, SHOPPING_LIST_TABLE, app, storage
+
+
+def seed(item_count, leg_count):
+    # writing benchmark routes, food items and a shopping list straight to the storage backend,
+    # every name starts with "Benchmark" so they are easy to find and remove
+    routes = []
+    items = []
+    list_items = []
+    for i in range(item_count):
+        places = [f'Benchmark place {i}-{leg}' for leg in range(leg_count + 1)]
+        for origin, destination in zip(places, places[1:]):
+            lat, lng = random.uniform(-60, 60), random.uniform(-180, 180)
+            routes.append({'PutRequest': {'Item': {
+                'origin': {'S': origin}, 'destination': {'S': destination},
+                'origin_lat_lng': {'L': [{'N': str(lat)}, {'N': str(lng)}]},
+                'destination_lat_lng': {'L': [{'N': str(lat + 1)}, {'N': str(lng + 1)}]},
+                'lead_time': {'N': str(random.randint(1, 5))}, 'transport_mode': {'S': 'truck'},
+                'distance': {'N': str(random.randint(10, 2000))}, 'emissions': {'N': str(random.randint(1, 500))},
+                'coordinates': {'L': [{'L': [{'N': str(lat)}, {'N': str(lng)}]},
+                                      {'L': [{'N': str(lat + 1)}, {'N': str(lng + 1)}]}]},
+            }}})
+        items.append({'PutRequest': {'Item': {
+            'name': {'S': f'Benchmark food {i}'}, 'origin': {'S': places[0]},
+            'legs': {'L': [{'M': {'origin': {'S': origin}, 'destination': {'S': destination}}}
+                           for origin, destination in zip(places, places[1:])]},
+        }}})
+        list_items.append({'PutRequest': {'Item': {
+            'userId': {'S': 'benchmark'}, 'itemId': {'S': f'Benchmark food {i},{places[0]}'},
+        }}})
+    storage.batch_write(ROUTE_TABLE, routes)
+    storage.batch_write(ITEM_TABLE, items)
+    storage.batch_write(SHOPPING_LIST_TABLE, list_items)
+    return [(f'Benchmark food {i}', f'Benchmark place {i}-0') for i in range(item_count)]
+
+
+def measure(client, path, runs):
+    # (median, worst) milliseconds of a GET request
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise SystemExit(f'GET {path} returned {response.status_code}: {response.get_json()}')
+    timings.sort()
+    return timings[len(timings) // 2], timings[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the list details and route endpoints against the configured storage backend')
+    parser.add_argument('--items', type=int, default=100, help='number of food items in the shopping list')
+    parser.add_argument('--legs', type=int, default=3, help='number of legs in the journey of each food item')
+    parser.add_argument('--runs', type=int, default=20, help='number of times each request is made')
+    args = parser.parse_args()
+
+    backend = type(storage).__name__
+    start = time.time()
+    items = seed(args.items, args.legs)
+    print(f'{backend}: seeded {args.items} items with {args.legs} legs each in {time.time() - start:.1f}s')
+    client = app.test_client()
+    median, worst = measure(client, '/shoppingList/details/benchmark', args.runs)
+    print(f'{backend}: list details median {median:.1f}ms, worst {worst:.1f}ms')
+    name, origin = items[0]
+    median, worst = measure(client, f'/route/{name}/{origin}', args.runs)
+    print(f'{backend}: route median {median:.1f}ms, worst {worst:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
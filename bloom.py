@@ -0,0 +1,57 @@
+import hashlib
+import math
+
+import numpy as np
+
+# compact filter of which keys exist, so a lookup of a key that was never added can be answered
+# without reading storage; a key that was added is always found, a key that was not is wrongly
+# found only at about the error rate the filter was sized for
+
+
+class BloomFilter:
+    # a bit array with hashes bits set for every key added, the positions of the bits come from two
+    # 64 bit halves of one hash of the key (double hashing)
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    @staticmethod
+    def hash(key):
+        digest = hashlib.blake2b('\0'.join(key).encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def positions(self, key):
+        first, second = self.hash(key)
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys):
+        # adding many keys at once, setting their bits with numpy
+        hashes = np.array([self.hash(key) for key in keys], dtype=np.uint64).reshape(-1, 2)
+        if not len(hashes):
+            return
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        # reducing the halves first so the products fit in 64 bits, which gives the same positions as add
+        first = hashes[:, :1] % np.uint64(self.size)
+        second = hashes[:, 1:] % np.uint64(self.size)
+        positions = (first + steps * second % np.uint64(self.size)) % np.uint64(self.size)
+        positions = positions.ravel()
+        np.bitwise_or.at(self.bits, (positions >> np.uint64(3)).astype(np.int64),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(hashes)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def full(self):
+        # whether more keys have been added than it was sized for, so its error rate is higher
+        return self.count > self.capacity
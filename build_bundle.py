@@ -0,0 +1,33 @@
+import argparse
+import os
+import tempfile
+import time
+
+from app import CATALOGUE_BUNDLE, ITEM_TABLE, ROUTE_TABLE, load_catalogue_version, route_bbox, storage
+from catalogue import Catalogue, encode_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the read-only catalogue of every item and route that is deployed beside app.py')
+    parser.add_argument('--output', default=CATALOGUE_BUNDLE, help='where to write the bundle')
+    args = parser.parse_args()
+
+    start = time.time()
+    # the version is read before the tables, so anything written while they are read is newer than the bundle
+    version = load_catalogue_version()
+    routes = list(storage.scan_table(ROUTE_TABLE))
+    items = list(storage.scan_table(ITEM_TABLE))
+    data = encode_catalogue(version, routes, items, bbox=route_bbox, coordinates=True)
+    # writing to a temporary file first so a half written bundle is never packaged
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.output)))
+    with os.fdopen(handle, 'wb') as bundle_file:
+        bundle_file.write(data)
+    os.replace(temporary_path, args.output)
+    bundle = Catalogue(args.output)
+    print(f'Bundle version {bundle.version}: {len(bundle)} items and {len(bundle.routes)} routes, '
+          f'{len(data) / 1024:.0f} KiB, built in {time.time() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
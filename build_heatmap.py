@@ -0,0 +1,42 @@
+import argparse
+import time
+
+from app import (HEATMAP_RESOLUTIONS, HEATMAP_TABLE, SAVED_LIST_TABLE, count_list_routes, get_route_geometry,
+                 storage)
+from heatmap import heat_by_cell
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the emissions heatmap from every saved list')
+    parser.parse_args()
+
+    start = time.time()
+    # every item bought in every saved list
+    item_ids = []
+    list_count = 0
+    for saved_list in storage.scan_table(SAVED_LIST_TABLE):
+        list_count += 1
+        item_ids.extend(item['M']['itemId']['S'] for item in saved_list['items']['L'])
+    route_counts = count_list_routes(item_ids)
+    routes = get_route_geometry(list(route_counts))
+    for resolution in HEATMAP_RESOLUTIONS:
+        heat = heat_by_cell(routes, route_counts, resolution)
+        # replacing the cells of the resolution, removing cells that no longer have any emissions
+        old_cells = [cell['cell']['S'] for cell in storage.query_table(
+            HEATMAP_TABLE,
+            KeyConditionExpression='#resolution = :resolution',
+            ExpressionAttributeNames={'#resolution': 'resolution'},
+            ExpressionAttributeValues={':resolution': {'S': str(resolution)}}
+        )]
+        requests = [{'PutRequest': {'Item': {'resolution': {'S': str(resolution)}, 'cell': {'S': cell},
+                                             'emissions': {'N': str(round(emissions, 3))}}}}
+                    for cell, emissions in heat.items()]
+        requests += [{'DeleteRequest': {'Key': {'resolution': {'S': str(resolution)}, 'cell': {'S': cell}}}}
+                     for cell in old_cells if cell not in heat]
+        failed = storage.batch_write(HEATMAP_TABLE, requests)
+        print(f'Resolution {resolution}: {len(heat)} cells, {len(failed)} failed to write')
+    print(f'Heatmap built from {list_count} saved lists and {len(item_ids)} items in {time.time() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+from app import (METRICS, SAVED_LIST_TABLE, SKETCH_SHARDS, STATS_TABLE, add_to_sketches, found_item_totals,
+                 read_sketches, saved_list_totals, sketch_shard_key, stats_periods, storage, write_sketches)
+from storage import split_item_id
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rebuild the daily and monthly rollups of every user from their saved lists')
+    parser.parse_args()
+
+    start = time.time()
+    saved_lists = [(saved_list['userId']['S'], saved_list['createdAt']['S'],
+                    [item['M']['itemId']['S'] for item in saved_list['items']['L']])
+                   for saved_list in storage.scan_table(SAVED_LIST_TABLE)]
+    # resolving every unique food item across all the saved lists once
+    item_totals = found_item_totals([split_item_id(item_id) for _, _, item_ids in saved_lists for item_id in item_ids])
+    rollups = {}
+    sketches = read_sketches(None)
+    for user_id, created_at, item_ids in saved_lists:
+        totals = saved_list_totals(item_ids, item_totals)
+        add_to_sketches(sketches, user_id, item_ids, totals['emissions'])
+        for period in stats_periods(created_at):
+            rollup = rollups.setdefault(user_id, {}).setdefault(
+                period, dict.fromkeys(METRICS + ('items', 'lists'), 0))
+            for name in METRICS + ('items',):
+                rollup[name] += totals[name]
+            rollup['lists'] += 1
+    # replacing the rollups of each user, removing periods that no longer have any saved lists
+    requests = []
+    for user_id, periods in rollups.items():
+        old_periods = [rollup['period']['S'] for rollup in storage.query_table(
+            STATS_TABLE,
+            KeyConditionExpression='userId = :userId',
+            ExpressionAttributeValues={':userId': {'S': user_id}}
+        )]
+        for period, rollup in periods.items():
+            item = {name: {'N': str(value)} for name, value in rollup.items()}
+            item.update({'userId': {'S': user_id}, 'period': {'S': period}})
+            requests.append({'PutRequest': {'Item': item}})
+        requests += [{'DeleteRequest': {'Key': {'userId': {'S': user_id}, 'period': {'S': period}}}}
+                     for period in old_periods if period not in periods]
+    # the global sketches go in the first shard, emptying the others
+    write_sketches(0, sketches)
+    requests += [{'DeleteRequest': {'Key': sketch_shard_key(shard)}} for shard in range(1, SKETCH_SHARDS)]
+    failed = storage.batch_write(STATS_TABLE, requests)
+    print(f'Rollups of {len(rollups)} users built from {len(saved_lists)} saved lists, {len(failed)} failed to write '
+          f'in {time.time() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import time
+
+from app import ROUTE_TABLE, TILE_MAX_ZOOM, storage, tile_store
+from storage import number_text
+from tiles import encode_tile, tiles_for_line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build every map tile of the route network')
+    parser.add_argument('--max-zoom', type=int, default=TILE_MAX_ZOOM, help='highest zoom level to build')
+    args = parser.parse_args()
+
+    start = time.time()
+    # grouping the legs by the tiles they cross at every zoom level
+    tile_features = {}
+    route_count = 0
+    for route in storage.scan_table(ROUTE_TABLE):
+        route_count += 1
+        feature = {'origin': route['origin']['S'], 'destination': route['destination']['S'],
+                   'emissions': number_text(route['emissions']),
+                   'coordinates': [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])]
+                                   for coord in route['coordinates']['L']]}
+        for zoom in range(args.max_zoom + 1):
+            for tile in tiles_for_line(feature['coordinates'], zoom):
+                tile_features.setdefault(tile, []).append(feature)
+    # writing the new tiles over the old ones, then removing the tiles no leg crosses any more, so the
+    # tiles being served are never missing while the store is rebuilt
+    built = set()
+    for (zoom, x, y), features in tile_features.items():
+        tile = encode_tile(zoom, x, y, features)
+        if tile is not None:
+            tile_store.write(zoom, x, y, tile)
+            built.add((zoom, x, y))
+    for zoom, x, y in set(tile_store.tiles()) - built:
+        if zoom <= args.max_zoom:
+            tile_store.write(zoom, x, y, None)
+    print(f'{len(built)} tiles built from {route_count} routes in {time.time() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
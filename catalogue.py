@@ -0,0 +1,333 @@
+import bisect
+import fcntl
+import glob
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+from route_graph import to_number
+from storage import get_item_legs, lat_lng_text, number_value
+
+# first bytes of every catalogue file, then the format version
+MAGIC = b'FMC1'
+FORMAT_VERSION = 2
+# flag set when the catalogue has the coordinates of every route
+HAS_COORDINATES = 1
+# magic, format version, flags, catalogue version, number of strings, routes, items, legs and points
+HEADER = struct.Struct('<4sIIQIIIII')
+# fixed width columns of the routes, items and legs, strings are indexes into the string table
+# and the coordinates of a route are points[first_point:first_point + point_count]
+ROUTE_DTYPE = np.dtype([('origin', '<u4'), ('destination', '<u4'), ('origin_lat_lng', '<u4'),
+                        ('destination_lat_lng', '<u4'), ('transport_mode', '<u4'), ('distance', '<f8'),
+                        ('emissions', '<f8'), ('lead_time', '<f8'), ('bbox', '<f8', (4,)),
+                        ('first_point', '<u4'), ('point_count', '<u4')])
+ITEM_DTYPE = np.dtype([('name', '<u4'), ('origin', '<u4'), ('first_leg', '<u4'), ('leg_count', '<u4')])
+# route is the index of the leg's route, or -1 when the route does not exist
+LEG_DTYPE = np.dtype([('origin', '<u4'), ('destination', '<u4'), ('route', '<i4')])
+
+
+def pad(data):
+    # sections start on 8 byte boundaries so the numeric columns can be read in place
+    return data + b'\0' * (-len(data) % 8)
+
+
+def number_text(value):
+    # numbers are stored as floats, whole numbers go back to the int strings the tables use
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def encode_catalogue(version, routes, items, bbox=None, coordinates=False):
+    # encoding route table items and item table items into a catalogue file
+    # every string is stored once in a sorted string table, so comparing the indexes of two strings
+    # compares the strings, and routes and items are sorted by their keys so they can be found with
+    # a binary search of the mapped file; bbox(route) gives the bounding box of a route, and
+    # coordinates says whether the routes were read with their coordinates to keep them
+    routes = list(routes)
+    items = list(items)
+    strings = set()
+    for route in routes:
+        strings.update(route[attribute]['S'] for attribute in ('origin', 'destination', 'transport_mode'))
+        strings.update(lat_lng_text(route[attribute]) for attribute in ('origin_lat_lng', 'destination_lat_lng'))
+    for item in items:
+        strings.update((item['name']['S'], item['origin']['S']))
+        for leg in get_item_legs(item):
+            strings.update(leg)
+    strings = sorted(strings)
+    string_index = {string: i for i, string in enumerate(strings)}
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+
+    route_rows = np.zeros(len(routes), dtype=ROUTE_DTYPE)
+    points = []
+    for row, route in zip(route_rows, routes):
+        for attribute in ('origin', 'destination', 'transport_mode'):
+            row[attribute] = string_index[route[attribute]['S']]
+        for attribute in ('origin_lat_lng', 'destination_lat_lng'):
+            row[attribute] = string_index[lat_lng_text(route[attribute])]
+        for attribute in ('distance', 'emissions', 'lead_time'):
+            row[attribute] = number_value(route[attribute])
+        row['bbox'] = bbox(route) if bbox else [np.nan] * 4
+        if coordinates:
+            row['first_point'] = len(points)
+            row['point_count'] = len(route['coordinates']['L'])
+            points.extend((float(coord['L'][0]['N']), float(coord['L'][1]['N']))
+                          for coord in route['coordinates']['L'])
+    points = np.array(points, dtype='<f8').reshape(-1, 2)
+    route_rows = route_rows[np.lexsort((route_rows['destination'], route_rows['origin']))]
+    route_positions = {(int(row['origin']), int(row['destination'])): i for i, row in enumerate(route_rows)}
+
+    items = sorted(items, key=lambda item: (item['name']['S'], item['origin']['S']))
+    item_rows = np.zeros(len(items), dtype=ITEM_DTYPE)
+    leg_rows = []
+    for row, item in zip(item_rows, items):
+        legs = get_item_legs(item)
+        row['name'] = string_index[item['name']['S']]
+        row['origin'] = string_index[item['origin']['S']]
+        row['first_leg'] = len(leg_rows)
+        row['leg_count'] = len(legs)
+        for origin, destination in legs:
+            key = (string_index[origin], string_index[destination])
+            leg_rows.append(key + (route_positions.get(key, -1),))
+    leg_rows = np.array(leg_rows, dtype=LEG_DTYPE)
+
+    data = HEADER.pack(MAGIC, FORMAT_VERSION, HAS_COORDINATES if coordinates else 0, version, len(strings),
+                       len(route_rows), len(item_rows), len(leg_rows), len(points))
+    data = pad(data)
+    data += pad(offsets.tobytes())
+    data += pad(b''.join(encoded))
+    data += pad(route_rows.tobytes())
+    data += pad(item_rows.tobytes())
+    data += pad(leg_rows.tobytes())
+    data += pad(points.tobytes())
+    return data
+
+
+class Catalogue:
+    # read-only view of a catalogue file, the columns are numpy arrays over the memory mapped file
+    # so opening it costs next to nothing and processes mapping the same file share its pages
+    def __init__(self, path):
+        with open(path, 'rb') as catalogue_file:
+            self.buffer = mmap.mmap(catalogue_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, flags, self.version, string_count, route_count, item_count, leg_count,
+         point_count) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a food miles catalogue')
+        position = HEADER.size + (-HEADER.size % 8)
+        self.offsets, position = self.column('<u4', string_count + 1, position)
+        self.strings_start = position
+        position += int(self.offsets[-1])
+        position += -position % 8
+        self.routes, position = self.column(ROUTE_DTYPE, route_count, position)
+        self.items, position = self.column(ITEM_DTYPE, item_count, position)
+        self.legs, position = self.column(LEG_DTYPE, leg_count, position)
+        self.points, position = self.column(np.dtype(('<f8', (2,))), point_count, position)
+        self.has_coordinates = bool(flags & HAS_COORDINATES)
+        # 64 bit keys of the routes and items in sorted order, for searchsorted
+        self.route_keys = self.routes['origin'].astype(np.uint64) << np.uint64(32) | self.routes['destination']
+        self.item_keys = self.items['name'].astype(np.uint64) << np.uint64(32) | self.items['origin']
+
+    def column(self, dtype, count, position):
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=position)
+        position += array.nbytes
+        return array, position + (-position % 8)
+
+    def __len__(self):
+        return len(self.items)
+
+    def string(self, index):
+        start = self.strings_start + int(self.offsets[index])
+        end = self.strings_start + int(self.offsets[index + 1])
+        return self.buffer[start:end].decode('utf-8')
+
+    def string_index(self, string):
+        # index of a string in the sorted string table, or -1 if it is not in it
+        strings = StringTable(self)
+        index = bisect.bisect_left(strings, string)
+        return index if index < len(strings) and strings[index] == string else -1
+
+    def find(self, sorted_keys, key_pairs):
+        # positions of (string, string) keys in routes or items, -1 for the ones not found
+        positions = np.full(len(key_pairs), -1, dtype=np.int64)
+        indexes = [(self.string_index(first), self.string_index(second)) for first, second in key_pairs]
+        known = np.array([first >= 0 and second >= 0 for first, second in indexes], dtype=bool)
+        if not known.any() or not len(sorted_keys):
+            return positions
+        wanted = np.array([(first << 32) | second for first, second in indexes], dtype=np.int64).astype(np.uint64)
+        found = np.minimum(np.searchsorted(sorted_keys, wanted), len(sorted_keys) - 1)
+        hit = known & (sorted_keys[found] == wanted)
+        positions[hit] = found[hit]
+        return positions
+
+    def find_routes(self, keys):
+        return self.find(self.route_keys, list(keys))
+
+    def find_items(self, keys):
+        return self.find(self.item_keys, list(keys))
+
+    def item_legs(self, position):
+        # the legs of the item at a position, as (origin, destination) strings and route positions
+        item = self.items[position]
+        legs = self.legs[item['first_leg']:item['first_leg'] + item['leg_count']]
+        strings = StringTable(self)
+        return [(strings[leg['origin']], strings[leg['destination']]) for leg in legs], legs['route']
+
+    def item_totals(self, item_keys, skip=None):
+        # the distance, emissions and lead time of each food item found in the catalogue, items that
+        # are not in it, that have a leg whose route is not in it, or for which skip(key, legs) is true,
+        # are left out
+        item_keys = list(dict.fromkeys(item_keys))
+        positions = self.find_items(item_keys)
+        item_totals = {}
+        for key, position in zip(item_keys, positions.tolist()):
+            if position < 0:
+                continue
+            legs, route_positions = self.item_legs(position)
+            if (route_positions < 0).any() or (skip and skip(key, legs)):
+                continue
+            routes = self.routes[route_positions]
+            item_totals[key] = {
+                'name': key[0],
+                'origin': key[1],
+                'distance': to_number(routes['distance'].sum()),
+                'emissions': to_number(routes['emissions'].sum()),
+                'lead_time': to_number(routes['lead_time'].sum()),
+            }
+        return item_totals
+
+    def item_key_pairs(self):
+        # the (name, origin) key of every food item
+        strings = StringTable(self)
+        return [(strings[row['name']], strings[row['origin']]) for row in self.items]
+
+    def suggestions(self, name, origin):
+        # the food items with the name or the origin, as (name, origin) keys
+        strings = StringTable(self)
+        matches = (self.items['name'] == self.string_index(name)) | (self.items['origin'] == self.string_index(origin))
+        return [(strings[row['name']], strings[row['origin']]) for row in self.items[matches]]
+
+    def route_summaries(self):
+        # every route in the same form as the in memory route snapshot
+        strings = StringTable(self)
+        return [{
+            'origin': strings[row['origin']],
+            'destination': strings[row['destination']],
+            'origin_lat_lng': strings[row['origin_lat_lng']],
+            'destination_lat_lng': strings[row['destination_lat_lng']],
+            'distance': number_text(row['distance']),
+            'emissions': number_text(row['emissions']),
+            'lead_time': number_text(row['lead_time']),
+            'bbox': tuple(row['bbox'].tolist()),
+        } for row in self.routes]
+
+    def journey(self, name, origin, skip=None):
+        # a food item and the route of each leg of its journey, as the item and route table items they
+        # were built from, or None when the catalogue has no coordinates, is missing the item or one
+        # of its routes, or skip(key, legs) is true
+        if not self.has_coordinates:
+            return None
+        position = int(self.find_items([(name, origin)])[0])
+        if position < 0:
+            return None
+        legs, route_positions = self.item_legs(position)
+        if (route_positions < 0).any() or (skip and skip((name, origin), legs)):
+            return None
+        item = {'name': {'S': name}, 'origin': {'S': origin}, 'legs': {'L': [
+            {'M': {'origin': {'S': leg_origin}, 'destination': {'S': leg_destination}}}
+            for leg_origin, leg_destination in legs]}}
+        strings = StringTable(self)
+        routes = []
+        for row in self.routes[route_positions]:
+            points = self.points[row['first_point']:row['first_point'] + row['point_count']]
+            routes.append({
+                'origin': {'S': strings[row['origin']]},
+                'destination': {'S': strings[row['destination']]},
+                'origin_lat_lng': {'S': strings[row['origin_lat_lng']]},
+                'destination_lat_lng': {'S': strings[row['destination_lat_lng']]},
+                'transport_mode': {'S': strings[row['transport_mode']]},
+                'distance': {'S': number_text(row['distance'])},
+                'emissions': {'S': number_text(row['emissions'])},
+                'lead_time': {'S': number_text(row['lead_time'])},
+                'coordinates': {'L': [{'L': [{'N': repr(lat)}, {'N': repr(lng)}]} for lat, lng in points.tolist()]},
+            })
+        return item, routes
+
+    def close(self):
+        self.buffer.close()
+
+
+class StringTable:
+    # the string table of a catalogue as a sequence, so bisect can search it without decoding it all
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+    def __len__(self):
+        return len(self.catalogue.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.catalogue.string(int(index))
+
+
+class CatalogueStore:
+    # catalogue files kept as root/catalogue-<version>.bin, shared by every process on the machine
+    # and by later invocations of a warm container
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, version):
+        return os.path.join(self.root, f'catalogue-{version:012d}.bin')
+
+    def versions(self):
+        versions = []
+        for path in glob.glob(os.path.join(self.root, 'catalogue-*.bin')):
+            try:
+                versions.append(int(os.path.basename(path)[len('catalogue-'):-len('.bin')]))
+            except ValueError:
+                continue
+        return sorted(versions)
+
+    def open(self, version):
+        # the catalogue of a version, or None if it has not been built
+        try:
+            return Catalogue(self.path(version))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def latest(self):
+        versions = self.versions()
+        return self.open(versions[-1]) if versions else None
+
+    def write(self, version, data, keep=2):
+        # writing to a temporary file first so a catalogue being read is never half written,
+        # then removing all but the newest few versions, which processes still mapping them can keep reading
+        os.makedirs(self.root, exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(handle, 'wb') as catalogue_file:
+            catalogue_file.write(data)
+        os.replace(temporary_path, self.path(version))
+        for old_version in self.versions()[:-keep]:
+            try:
+                os.remove(self.path(old_version))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def build_lock(self):
+        # yields whether this process got the lock on building a catalogue, so only one
+        # process builds a new version while the others keep using the one they have
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'build.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
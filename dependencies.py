@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class DependencyIndex:
+    # which cached entries were derived from which food items, so a write to an item, or to a route
+    # used by some items, invalidates exactly the entries that depend on it instead of every cache;
+    # which items use a route is kept in storage as items are written, this index only holds the
+    # entries of the caches of this container
+    # number of recent invalidations the latency metrics are worked out from
+    RECENT = 1000
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.caches = {}
+        # counts every invalidation, so a result worked out while one happened is not cached
+        self.generation = 0
+        # food item key -> set of (cache name, entry key), and the reverse
+        self.item_entries = {}
+        self.entry_items = {}
+        self.invalidations = 0
+        self.invalidated_entries = 0
+        self.largest_fan_out = 0
+        self.recent = deque(maxlen=self.RECENT)
+
+    def register(self, name, cache):
+        self.caches[name] = cache
+
+    def track(self, name, key, items):
+        # recording that the entry key of the cache name was derived from the food items
+        with self.lock:
+            self.entry_items[(name, key)] = set(items)
+            for item in items:
+                self.item_entries.setdefault(item, set()).add((name, key))
+
+    def forget(self, name, key):
+        # an entry that has left its cache no longer needs invalidating
+        with self.lock:
+            for item in self.entry_items.pop((name, key), ()):
+                entries = self.item_entries.get(item)
+                if entries is not None:
+                    entries.discard((name, key))
+                    if not entries:
+                        del self.item_entries[item]
+
+    def invalidate(self, items, started=None):
+        # removing every entry derived from any of the food items, returns how many were removed;
+        # started is when the write causing it began, so the latency includes finding the items
+        started = started if started is not None else time.perf_counter()
+        with self.lock:
+            entries = set()
+            for item in items:
+                entries.update(self.item_entries.get(item, ()))
+            for name, key in entries:
+                self.forget(name, key)
+                self.caches[name].discard(key)
+            self.generation += 1
+            self.invalidations += 1
+            self.invalidated_entries += len(entries)
+            self.largest_fan_out = max(self.largest_fan_out, len(entries))
+            self.recent.append((len(entries), time.perf_counter() - started))
+        return len(entries)
+
+    def empty(self):
+        # whether no entry is tracked, so there is nothing for a write to invalidate
+        with self.lock:
+            return not self.entry_items
+
+    def clear(self):
+        # removing every entry of every cache, after a write to a whole table
+        with self.lock:
+            self.generation += 1
+            for cache in self.caches.values():
+                cache.clear()
+            self.item_entries.clear()
+            self.entry_items.clear()
+
+    def metrics(self):
+        with self.lock:
+            recent = list(self.recent)
+        fan_outs = sorted(fan_out for fan_out, _ in recent)
+        latencies = sorted(latency * 1000 for _, latency in recent)
+        return {
+            'tracked_items': len(self.item_entries),
+            'tracked_entries': len(self.entry_items),
+            'invalidations': self.invalidations,
+            'invalidated_entries': self.invalidated_entries,
+            'largest_fan_out': self.largest_fan_out,
+            'recent_fan_out': percentiles(fan_outs),
+            'recent_latency_ms': percentiles(latencies),
+        }
+
+
+def percentiles(values):
+    # p50, p90 and p99 of sorted values, None when there are none
+    if not values:
+        return None
+    return {f'p{p}': round(values[min(len(values) - 1, len(values) * p // 100)], 3) for p in (50, 90, 99)}
+
+
+class EntryCache:
+    # least recently used cache of derived results whose entries are tracked in a dependency index,
+    # bounded by a number of entries or, for byte string values, by their total size
+    def __init__(self, name, index, max_entries=None, max_bytes=None):
+        self.name = name
+        self.index = index
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        index.register(name, self)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, items, generation):
+        # storing a result derived from the food items, worked out when the index was at generation,
+        # unless something has been invalidated since as the result may be out of date
+        evicted = []
+        # holding the index lock so no invalidation can come between the check and the tracking
+        with self.index.lock, self.lock:
+            if generation != self.index.generation:
+                return
+            self.remove(key)
+            self.entries[key] = value
+            self.size += self.value_size(value)
+            while self.entries and self.over_limit():
+                evicted_key = next(iter(self.entries))
+                self.remove(evicted_key)
+                evicted.append(evicted_key)
+            self.index.track(self.name, key, items)
+            for evicted_key in evicted:
+                self.index.forget(self.name, evicted_key)
+
+    def value_size(self, value):
+        return len(value) if self.max_bytes is not None else 0
+
+    def over_limit(self):
+        return ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes))
+
+    def remove(self, key):
+        if key in self.entries:
+            self.size -= self.value_size(self.entries.pop(key))
+
+    def discard(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def metrics(self):
+        metrics = {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+        if self.max_bytes is not None:
+            metrics['bytes'] = self.size
+        return metrics
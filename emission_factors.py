@@ -0,0 +1,25 @@
+import numpy as np
+
+
+def parse_factors(item):
+    # a factor set item from the emission factor table as (version, {transport mode: factor})
+    factors = {mode: float(factor['N']) for mode, factor in item['factors']['M'].items()}
+    return item['factor_version']['S'], factors
+
+
+def compute_emissions(distance, transport_mode, factors):
+    # emissions of a leg are its distance multiplied by the factor of its transport mode,
+    # None when there is no factor for the transport mode
+    factor = factors.get(transport_mode)
+    if factor is None:
+        return None
+    return round(float(distance) * factor)
+
+
+def compute_emissions_batch(distances, transport_modes, factors):
+    # emissions of many legs in one numpy pass, legs with no factor for their transport mode are NaN
+    modes = sorted(factors)
+    mode_index = {mode: i for i, mode in enumerate(modes)}
+    factor_array = np.append(np.array([factors[mode] for mode in modes], dtype=np.float64), np.nan)
+    indexes = np.array([mode_index.get(mode, len(modes)) for mode in transport_modes], dtype=np.int64)
+    return np.rint(np.asarray(distances, dtype=np.float64) * factor_array[indexes])
@@ -0,0 +1,263 @@
+import heapq
+
+import numpy as np
+
+# mean radius of the earth in kilometres
+EARTH_RADIUS_KM = 6371.0088
+
+
+def parse_lat_lng(lat_lng):
+    # lat_lng attributes are stored as "lat,lng" strings
+    lat, lng = lat_lng.split(',')
+    return float(lat), float(lng)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # great-circle distance in kilometres between points given in degrees,
+    # works on single values or on whole numpy arrays of points at once
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def polyline_length(coordinates):
+    # length in kilometres of a line through a list of [lat, lng] points,
+    # every segment is measured in the same numpy pass
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return 0.0
+    return float(np.sum(haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])))
+
+
+def route_distance(coordinates, origin_lat_lng, destination_lat_lng):
+    # the distance of a leg from its polyline, or straight from origin to destination
+    # when the polyline does not have at least two points
+    if len(coordinates) >= 2:
+        return polyline_length(coordinates)
+    origin_lat, origin_lng = parse_lat_lng(origin_lat_lng)
+    destination_lat, destination_lng = parse_lat_lng(destination_lat_lng)
+    return float(haversine(origin_lat, origin_lng, destination_lat, destination_lng))
+
+
+def to_unit_vectors(lat_lngs):
+    # points on the sphere as 3d unit vectors, the straight line (chord) distance between two
+    # of them orders places the same way as the great-circle distance
+    lat_lngs = np.radians(np.asarray(lat_lngs, dtype=np.float64).reshape(-1, 2))
+    lat, lng = lat_lngs[:, 0], lat_lngs[:, 1]
+    return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+
+
+def km_to_chord(km):
+    return 2 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1))
+
+
+class PlaceIndex:
+    # k-d tree over named places for radius and nearest neighbour searches
+    # the tree is kept in flat lists, a node either splits its places on one axis or,
+    # when it is a leaf, holds the places order[start:end]
+    LEAF_SIZE = 16
+
+    def __init__(self, places):
+        # places is an iterable of (name, lat, lng)
+        places = list(places)
+        self.names = [name for name, _, _ in places]
+        self.lat_lngs = np.array([[lat, lng] for _, lat, lng in places], dtype=np.float64).reshape(-1, 2)
+        self.points = to_unit_vectors(self.lat_lngs)
+        self.order = np.arange(len(places))
+        self.node_axis = []
+        self.node_split = []
+        self.node_children = []
+        self.node_range = []
+        if places:
+            self.build(0, len(places))
+
+    def __len__(self):
+        return len(self.names)
+
+    def build(self, start, end):
+        node = len(self.node_axis)
+        self.node_axis.append(-1)
+        self.node_split.append(0.0)
+        self.node_children.append((-1, -1))
+        self.node_range.append((start, end))
+        if end - start <= self.LEAF_SIZE:
+            return node
+        # splitting on the axis the places are most spread out along, at the median place
+        indexes = self.order[start:end]
+        points = self.points[indexes]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        middle = (end - start) // 2
+        self.order[start:end] = indexes[np.argpartition(points[:, axis], middle)]
+        self.node_axis[node] = axis
+        self.node_split[node] = float(self.points[self.order[start + middle], axis])
+        left = self.build(start, start + middle)
+        right = self.build(start + middle, end)
+        self.node_children[node] = (left, right)
+        return node
+
+    def within(self, lat, lng, radius_km):
+        # every place within radius_km of the point, as (name, lat, lng, distance in km) nearest first
+        if not self.names:
+            return []
+        query = to_unit_vectors([lat, lng])[0]
+        radius = km_to_chord(radius_km)
+        found = []
+        found_distances = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            axis = self.node_axis[node]
+            if axis == -1:
+                start, end = self.node_range[node]
+                indexes = self.order[start:end]
+                distances = np.linalg.norm(self.points[indexes] - query, axis=1)
+                close = distances <= radius
+                found.append(indexes[close])
+                found_distances.append(distances[close])
+                continue
+            left, right = self.node_children[node]
+            if query[axis] - radius <= self.node_split[node]:
+                stack.append(left)
+            if query[axis] + radius >= self.node_split[node]:
+                stack.append(right)
+        indexes = np.concatenate(found)
+        distances = np.concatenate(found_distances)
+        nearest_first = np.argsort(distances, kind='stable')
+        return self.results(indexes[nearest_first], distances[nearest_first])
+
+    def nearest(self, lat, lng, k, radius_km=None):
+        # the k places nearest to the point, optionally only those within radius_km
+        if not self.names or k < 1:
+            return []
+        query = to_unit_vectors([lat, lng])[0]
+        radius = km_to_chord(radius_km) if radius_km is not None else np.inf
+        # best places so far as a heap of (-distance, index) so the furthest one is at the top
+        best = []
+        # nodes to visit, closest possible place first
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            limit = -best[0][0] if len(best) == k else radius
+            if bound > limit:
+                break
+            axis = self.node_axis[node]
+            if axis == -1:
+                start, end = self.node_range[node]
+                indexes = self.order[start:end]
+                distances = np.linalg.norm(self.points[indexes] - query, axis=1)
+                for index, distance in zip(indexes, distances):
+                    if distance > radius:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, int(index)))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, int(index)))
+                continue
+            left, right = self.node_children[node]
+            gap = query[axis] - self.node_split[node]
+            near, far = (left, right) if gap <= 0 else (right, left)
+            heapq.heappush(heap, (bound, near))
+            heapq.heappush(heap, (max(bound, abs(gap)), far))
+        best.sort(key=lambda place: -place[0])
+        return self.results(np.array([index for _, index in best], dtype=np.int64),
+                            np.array([-distance for distance, _ in best]))
+
+    def results(self, indexes, chords):
+        return [(self.names[index], float(self.lat_lngs[index, 0]), float(self.lat_lngs[index, 1]),
+                 float(chord_to_km(chord))) for index, chord in zip(indexes, chords)]
+
+
+def bounding_box(coordinates):
+    # (min lat, min lng, max lat, max lng) of a list of [lat, lng] points
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    return (float(points[:, 0].min()), float(points[:, 1].min()),
+            float(points[:, 0].max()), float(points[:, 1].max()))
+
+
+def simplify(coordinates, tolerance):
+    # Douglas-Peucker simplification of a list of [lat, lng] points, keeping the points that are
+    # more than tolerance degrees away from the simplified line
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(points) <= 2 or tolerance <= 0:
+        return points.tolist()
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        # distance of every point between first and last from the line joining them
+        start, end = points[first], points[last]
+        segment = end - start
+        between = points[first + 1:last] - start
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(between[:, 0], between[:, 1])
+        else:
+            distances = np.abs(segment[0] * between[:, 1] - segment[1] * between[:, 0]) / length
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            middle = first + 1 + furthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return points[keep].tolist()
+
+
+class BoxIndex:
+    # packed r-tree over bounding boxes for viewport searches
+    # the boxes are sorted into leaves of NODE_SIZE with sort-tile-recursive packing, and each
+    # level above groups NODE_SIZE consecutive nodes, so node i of a level covers
+    # nodes i * NODE_SIZE to (i + 1) * NODE_SIZE of the level below
+    NODE_SIZE = 16
+
+    def __init__(self, boxes):
+        # boxes is a list of (min lat, min lng, max lat, max lng)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.order = self.sort_tile_recursive(boxes)
+        level = boxes[self.order]
+        self.levels = [level]
+        while len(level) > self.NODE_SIZE:
+            starts = np.arange(0, len(level), self.NODE_SIZE)
+            level = np.column_stack([np.minimum.reduceat(level[:, 0], starts),
+                                     np.minimum.reduceat(level[:, 1], starts),
+                                     np.maximum.reduceat(level[:, 2], starts),
+                                     np.maximum.reduceat(level[:, 3], starts)])
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.order)
+
+    def sort_tile_recursive(self, boxes):
+        # ordering the boxes into vertical slices by the longitude of their centres,
+        # then each slice by the latitude of their centres
+        if not len(boxes):
+            return np.arange(0)
+        centres = (boxes[:, :2] + boxes[:, 2:]) / 2
+        leaves = -(-len(boxes) // self.NODE_SIZE)
+        slice_size = self.NODE_SIZE * int(np.ceil(np.sqrt(leaves)))
+        by_lng = np.argsort(centres[:, 1], kind='stable')
+        return np.concatenate([
+            by_lng[i:i + slice_size][np.argsort(centres[by_lng[i:i + slice_size], 0], kind='stable')]
+            for i in range(0, len(boxes), slice_size)
+        ])
+
+    def search(self, min_lat, min_lng, max_lat, max_lng):
+        # indexes of the boxes that intersect the viewport, only visiting nodes that intersect it
+        if not len(self.order):
+            return np.arange(0)
+        candidates = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[depth][candidates]
+            hit = ((boxes[:, 0] <= max_lat) & (boxes[:, 2] >= min_lat) &
+                   (boxes[:, 1] <= max_lng) & (boxes[:, 3] >= min_lng))
+            candidates = candidates[hit]
+            if depth:
+                children = (candidates[:, None] * self.NODE_SIZE + np.arange(self.NODE_SIZE)).ravel()
+                candidates = children[children < len(self.levels[depth - 1])]
+        return self.order[candidates]
@@ -0,0 +1,61 @@
+import numpy as np
+
+from geo import haversine
+
+
+def cell_key(row, col):
+    # sort key of a grid cell in the heatmap table
+    return f'{row}:{col}'
+
+
+def cell_bounds(key, resolution):
+    # (south, west) corner of a grid cell
+    row, col = (int(value) for value in key.split(':'))
+    return row * resolution - 90, col * resolution - 180
+
+
+def rasterize(coordinates, resolution):
+    # the grid cells of size resolution degrees a line through [lat, lng] points passes through,
+    # with the fraction of the line's length inside each cell
+    # every segment is sampled at least four times per cell it could cross, all in one numpy pass
+    # returns a (cells x 2) array of (row, col) and an array of fractions adding up to 1
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 1:
+        points = np.vstack([points, points])
+    starts, ends = points[:-1], points[1:]
+    lengths = haversine(starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1])
+    if not lengths.sum():
+        # a line with no length puts everything in the cell it is in
+        lengths = np.ones(len(starts))
+    steps = np.maximum(1, np.ceil(np.abs(ends - starts).max(axis=1) * 4 / resolution)).astype(np.int64)
+    segments = np.repeat(np.arange(len(starts)), steps)
+    # position of each sample along its segment, at the middle of equal slices of the segment
+    positions = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps) + 0.5) / steps[segments]
+    samples = starts[segments] + (ends[segments] - starts[segments]) * positions[:, None]
+    weights = lengths[segments] / steps[segments]
+    cells = np.floor((samples + [90, 180]) / resolution).astype(np.int64)
+    cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=weights, minlength=len(cells))
+    return cells, totals / totals.sum()
+
+
+def heat_by_cell(routes, route_counts, resolution, rasters=None):
+    # emissions flowing through each cell, every route weighted by how many times it was bought
+    # routes maps a route key to its (emissions, coordinates), route_counts maps it to a count,
+    # rasters is an optional cache of rasterized routes keyed by (route key, resolution)
+    heat = {}
+    for key, count in route_counts.items():
+        if key not in routes:
+            continue
+        emissions, coordinates = routes[key]
+        raster_key = (key, resolution)
+        if rasters is None or raster_key not in rasters:
+            raster = rasterize(coordinates, resolution)
+            if rasters is not None:
+                rasters[raster_key] = raster
+        else:
+            raster = rasters[raster_key]
+        cells, fractions = raster
+        for (row, col), fraction in zip(cells.tolist(), (fractions * float(emissions) * count).tolist()):
+            heat[cell_key(row, col)] = heat.get(cell_key(row, col), 0.0) + fraction
+    return heat
@@ -0,0 +1,108 @@
+from storage import NotFoundError, get_item_legs, number_value
+
+# the journey table keeps, in the partition of each food item, the item itself and a copy of the
+# route of each leg of its journey, so one query returns everything needed to show the journey
+#   pk "ITEM#name,origin"            sk "ITEM"             the food item
+#   pk "ITEM#name,origin"            sk "LEG#0000" ...     a copy of the route of each leg, in order
+#   pk "ROUTE#origin,destination"    sk "ITEM#name,origin#0000"
+#                                                          which food items use a route, at which leg,
+#                                                          so the copies can be updated when it changes
+ITEM_SORT_KEY = 'ITEM'
+LEG_PREFIX = 'LEG#'
+# route attributes copied into the journey of each food item
+LEG_ATTRIBUTES = ('origin', 'destination', 'origin_lat_lng', 'destination_lat_lng', 'lead_time',
+                  'transport_mode', 'distance', 'emissions', 'coordinates')
+
+
+def item_partition(name, origin):
+    return f'ITEM#{name},{origin}'
+
+
+def route_partition(origin, destination):
+    return f'ROUTE#{origin},{destination}'
+
+
+def leg_sort_key(position):
+    return f'{LEG_PREFIX}{position:04d}'
+
+
+def reference_sort_key(name, origin, position):
+    return f'ITEM#{name},{origin}#{position:04d}'
+
+
+def parse_reference(sort_key):
+    # (name, origin, position) of a route reference sort key
+    item_id, position = sort_key[len('ITEM#'):].rsplit('#', 1)
+    name, origin = item_id.split(',', 1)
+    return name, origin, int(position)
+
+
+def leg_record(name, origin, position, route):
+    record = {attribute: route[attribute] for attribute in LEG_ATTRIBUTES if attribute in route}
+    record['pk'] = {'S': item_partition(name, origin)}
+    record['sk'] = {'S': leg_sort_key(position)}
+    return record
+
+
+def journey_records(item, routes):
+    # every record of the journey table for a food item, routes maps the (origin, destination)
+    # of a leg to its route, legs whose route does not exist yet only get a reference so their
+    # copy is filled in when the route is added
+    name, origin = item['name']['S'], item['origin']['S']
+    records = [dict(item, pk={'S': item_partition(name, origin)}, sk={'S': ITEM_SORT_KEY})]
+    for position, leg in enumerate(get_item_legs(item)):
+        records.append({'pk': {'S': route_partition(*leg)},
+                        'sk': {'S': reference_sort_key(name, origin, position)}})
+        if leg in routes:
+            records.append(leg_record(name, origin, position, routes[leg]))
+    return records
+
+
+def stale_records(old_item, item):
+    # keys of the records of an old version of a food item that the new version does not replace
+    if not old_item:
+        return []
+    name, origin = item['name']['S'], item['origin']['S']
+    old_legs = get_item_legs(old_item)
+    legs = get_item_legs(item)
+    keys = []
+    for position, leg in enumerate(old_legs):
+        if position >= len(legs):
+            keys.append({'pk': {'S': item_partition(name, origin)}, 'sk': {'S': leg_sort_key(position)}})
+        if position >= len(legs) or legs[position] != leg:
+            keys.append({'pk': {'S': route_partition(*leg)},
+                         'sk': {'S': reference_sort_key(name, origin, position)}})
+    return keys
+
+
+def split_partition(records):
+    # the food item and its legs in order from the records of an item partition,
+    # raising NotFoundError for a leg whose route has not been copied in
+    item = None
+    legs = {}
+    for record in records:
+        if record['sk']['S'] == ITEM_SORT_KEY:
+            item = record
+        elif record['sk']['S'].startswith(LEG_PREFIX):
+            legs[int(record['sk']['S'][len(LEG_PREFIX):])] = record
+    if item is None:
+        return None, []
+    routes = []
+    for position, (route_origin, route_destination) in enumerate(get_item_legs(item)):
+        route = legs.get(position)
+        if route is None or (route['origin']['S'], route['destination']['S']) != (route_origin, route_destination):
+            raise NotFoundError(
+                f'Could not find route with origin "{route_origin}" and destination "{route_destination}"')
+        routes.append(route)
+    return item, routes
+
+
+def journey_totals(item, routes):
+    # the distance, emissions and lead time of a food item from the copies of its legs
+    return {
+        'name': item['name']['S'],
+        'origin': item['origin']['S'],
+        'distance': sum(number_value(route['distance']) for route in routes),
+        'emissions': sum(number_value(route['emissions']) for route in routes),
+        'lead_time': sum(number_value(route['lead_time']) for route in routes),
+    }
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def choose_origins(options, max_lead_time=None):
+    # picking one option for every item of a shopping list so the total emissions are as low as possible
+    # options is a list with one entry per item, each a list of (emissions, lead_time) pairs to choose from
+    # when max_lead_time is given the lead times of the chosen options must add up to at most max_lead_time
+    # returns the index of the chosen option for each item, or None if no choice fits the lead time
+    if max_lead_time is None:
+        return [min(range(len(item_options)), key=lambda i: item_options[i][0]) for item_options in options]
+    if max_lead_time < 0:
+        return None
+    # multiple-choice knapsack solved by dynamic programming over the total lead time,
+    # best[t] is the lowest emissions of the items so far with a total lead time of exactly t
+    budget = min(int(max_lead_time), sum(max(int(lead_time) for _, lead_time in item_options)
+                                         for item_options in options))
+    best = np.full(budget + 1, np.inf)
+    best[0] = 0
+    chosen = np.zeros((len(options), budget + 1), dtype=np.int32)
+    for n, item_options in enumerate(options):
+        next_best = np.full(budget + 1, np.inf)
+        for i, (emissions, lead_time) in enumerate(item_options):
+            lead_time = int(lead_time)
+            if lead_time > budget:
+                continue
+            # the totals when this option is added to every total lead time reached so far
+            candidate = np.full(budget + 1, np.inf)
+            candidate[lead_time:] = best[:budget + 1 - lead_time] + emissions
+            better = candidate < next_best
+            next_best[better] = candidate[better]
+            chosen[n][better] = i
+        best = next_best
+    total_lead_time = int(np.argmin(best))
+    if best[total_lead_time] == np.inf:
+        return None
+    # walking back through the items to find the option chosen for each one
+    choices = [0] * len(options)
+    for n in range(len(options) - 1, -1, -1):
+        choices[n] = int(chosen[n][total_lead_time])
+        total_lead_time -= int(options[n][choices[n]][1])
+    return choices
+
+
+def simulate_substitutions(base_counts, totals, substitutions):
+    # working out the totals of a shopping list under many what-if scenarios in one pass
+    # base_counts is how many of each item are in the list, totals is an (items x metrics) array
+    # of the totals of each item, and substitutions has one list of (from index, to index) swaps per scenario
+    # returns the base list totals and a (scenarios x metrics) array of the totals of each scenario
+    base_counts = np.asarray(base_counts, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64).reshape(len(base_counts), -1)
+    counts = np.tile(base_counts, (len(substitutions), 1))
+    rows = [scenario for scenario, swaps in enumerate(substitutions) for _ in swaps]
+    removed = [swap[0] for swaps in substitutions for swap in swaps]
+    added = [swap[1] for swaps in substitutions for swap in swaps]
+    np.subtract.at(counts, (rows, removed), 1)
+    np.add.at(counts, (rows, added), 1)
+    return base_counts @ totals, counts @ totals
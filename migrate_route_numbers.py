@@ -0,0 +1,60 @@
+import argparse
+import os
+
+from app import ITEM_TABLE, JOURNEY_TABLE, ROUTE_TABLE, SHOPPING_LIST_TABLE, TABLE_KEYS
+from migration import Migration, run_migration
+from storage import create_storage, lat_lng_attribute, number_attribute, number_value
+
+NUMBER_ATTRIBUTES = ('distance', 'emissions', 'lead_time')
+LAT_LNG_ATTRIBUTES = ('origin_lat_lng', 'destination_lat_lng')
+
+
+def open_storage():
+    return create_storage(TABLE_KEYS, ITEM_TABLE, ROUTE_TABLE, SHOPPING_LIST_TABLE)
+
+
+def route_numbers(item):
+    # the numbers of a route, or of the copy of a route in the journey table, that are still strings
+    # as N attributes and the places that are still "lat,lng" strings as numeric pairs
+    changes = {}
+    for attribute in NUMBER_ATTRIBUTES:
+        if 'S' in item.get(attribute, {}):
+            changes[attribute] = number_attribute(number_value(item[attribute]))
+    for attribute in LAT_LNG_ATTRIBUTES:
+        if 'S' in item.get(attribute, {}):
+            try:
+                changes[attribute] = lat_lng_attribute(item[attribute]['S'])
+            except ValueError:
+                print(f'Leaving {attribute} "{item[attribute]["S"]}" as it is not "lat,lng"')
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Store the distance, emissions and lead time of routes as numbers and their places as '
+                    '[lat, lng] pairs')
+    parser.add_argument('--table', choices=('route', 'journey'), default='route', help='table to migrate')
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of items read per scan page')
+    parser.add_argument('--checkpoint-dir', default='/tmp/food-miles-migrations',
+                        help='directory the progress of each segment is saved in')
+    parser.add_argument('--reset', action='store_true', help='start again instead of carrying on from the checkpoints')
+    parser.add_argument('--dry-run', action='store_true', help='count the changes without writing them')
+    args = parser.parse_args()
+
+    if args.table == 'journey' and not JOURNEY_TABLE:
+        parser.error('JOURNEY_TABLE is not set')
+    table = ROUTE_TABLE if args.table == 'route' else JOURNEY_TABLE
+    migration = Migration(f'route-numbers-{args.table}', table, route_numbers, open_storage)
+    totals = run_migration(migration, args.segments, args.workers or min(args.segments, os.cpu_count()),
+                           args.batch_size, args.checkpoint_dir, args.dry_run, args.reset)
+    # the catalogue version is left alone, the routes keep the same values in their new form so nothing
+    # any container has cached or bundled from them is out of date
+    if totals['skipped']:
+        print(f'{totals["skipped"]} items were changed while they were being migrated, '
+              f'run again with --reset to migrate them')
+
+
+if __name__ == '__main__':
+    main()
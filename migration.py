@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+# a migration rewrites every item of a table with transform(item), which returns the attributes
+# to change (name to new attribute value) or nothing when the item is already migrated;
+# open_storage() opens the storage backend in each worker process and both functions must be
+# defined at the top level of a module so they can be sent to the worker processes
+Migration = namedtuple('Migration', ('name', 'table', 'transform', 'open_storage'))
+
+# number of conditional updates of a page sent at the same time by each worker
+WRITE_THREADS = 8
+# seconds between progress reports
+REPORT_INTERVAL = 5
+
+# storage backend of a worker process, opened once when the process starts
+worker_storage = None
+
+
+class Checkpoint:
+    # progress of one segment of a migration, saved to a json file after every page so an
+    # interrupted migration carries on from the last page it finished
+    def __init__(self, directory, name, segment, total_segments):
+        self.path = os.path.join(directory, f'{name}.{segment}-of-{total_segments}.json')
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'start_key': None, 'scanned': 0, 'changed': 0, 'skipped': 0, 'done': False}
+
+    def save(self, state):
+        # writing to a temporary file first so a crash never leaves a half written checkpoint
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary_path, self.path)
+
+    def reset(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def changed_update(key, item, changes):
+    # an update setting the changed attributes, on condition that they still hold the values
+    # they were read with, so an item written by someone else since the scan is left alone
+    names = {}
+    values = {}
+    assignments = []
+    conditions = []
+    for i, (attribute, value) in enumerate(sorted(changes.items())):
+        names[f'#a{i}'] = attribute
+        values[f':new{i}'] = value
+        assignments.append(f'#a{i} = :new{i}')
+        if attribute in item:
+            values[f':old{i}'] = item[attribute]
+            conditions.append(f'#a{i} = :old{i}')
+        else:
+            conditions.append(f'attribute_not_exists(#a{i})')
+    return {'Key': key, 'UpdateExpression': 'SET ' + ', '.join(assignments),
+            'ConditionExpression': ' AND '.join(conditions),
+            'ExpressionAttributeNames': names, 'ExpressionAttributeValues': values}
+
+
+def write_change(table, update, storage=None):
+    # 'changed', or 'skipped' when the item was changed by someone else since it was read,
+    # written with the storage of the worker process unless another is given
+    storage = storage or worker_storage
+    try:
+        storage.update_item(TableName=table, **update)
+    except storage.exceptions.ConditionalCheckFailedException:
+        return 'skipped'
+    return 'changed'
+
+
+def open_worker(open_storage):
+    global worker_storage
+    worker_storage = open_storage()
+
+
+def migrate_segment(migration, segment, total_segments, batch_size, checkpoint_directory, dry_run):
+    # migrating one segment of a parallel scan of the table a page at a time, carrying on from
+    # the checkpoint of the segment, returns the final state of the segment
+    checkpoint = Checkpoint(checkpoint_directory, migration.name, segment, total_segments)
+    state = checkpoint.load()
+    key_names = worker_storage.tables[migration.table]
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as executor:
+        while not state['done']:
+            kwargs = {'ExclusiveStartKey': state['start_key']} if state['start_key'] else {}
+            result = worker_storage.scan(TableName=migration.table, Segment=segment, TotalSegments=total_segments,
+                                         Limit=batch_size, **kwargs)
+            items = result.get('Items', [])
+            updates = []
+            for item in items:
+                changes = migration.transform(item)
+                if changes:
+                    updates.append(changed_update({name: item[name] for name in key_names}, item, changes))
+            state['scanned'] += len(items)
+            if dry_run:
+                state['changed'] += len(updates)
+            else:
+                for outcome in executor.map(lambda update: write_change(migration.table, update), updates):
+                    state[outcome] += 1
+            state['start_key'] = result.get('LastEvaluatedKey')
+            state['done'] = state['start_key'] is None
+            # a dry run only reports what it would change, so it never leaves a checkpoint behind
+            if not dry_run:
+                checkpoint.save(state)
+    return state
+
+
+def run_migration(migration, segments, workers, batch_size, checkpoint_directory, dry_run=False, reset=False):
+    # migrating the table with a parallel scan of segments spread across worker processes,
+    # reporting progress and throughput as it goes, returns the totals of every segment
+    os.makedirs(checkpoint_directory, exist_ok=True)
+    checkpoints = [Checkpoint(checkpoint_directory, migration.name, segment, segments) for segment in range(segments)]
+    if reset:
+        for checkpoint in checkpoints:
+            checkpoint.reset()
+    already_scanned = sum(checkpoint.load()['scanned'] for checkpoint in checkpoints)
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=open_worker,
+                             initargs=(migration.open_storage,)) as executor:
+        pending = {executor.submit(migrate_segment, migration, segment, segments, batch_size,
+                                   checkpoint_directory, dry_run) for segment in range(segments)}
+        results = []
+        while pending:
+            done, pending = wait(pending, timeout=REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            results.extend(future.result() for future in done)
+            if pending and not dry_run:
+                states = [checkpoint.load() for checkpoint in checkpoints]
+                report(migration, states, sum(state['done'] for state in states), segments,
+                       already_scanned, time.time() - start)
+    totals = {name: sum(state[name] for state in results) for name in ('scanned', 'changed', 'skipped')}
+    report(migration, results, segments, segments, already_scanned, time.time() - start)
+    return totals
+
+
+def report(migration, states, finished, segments, already_scanned, elapsed):
+    scanned = sum(state['scanned'] for state in states)
+    changed = sum(state['changed'] for state in states)
+    skipped = sum(state['skipped'] for state in states)
+    rate = (scanned - already_scanned) / elapsed if elapsed else 0
+    print(f'{migration.name}: {finished}/{segments} segments finished, {scanned} items scanned, '
+          f'{changed} changed, {skipped} skipped as changed since read in {elapsed:.1f}s ({rate:.0f} items/s)',
+          flush=True)
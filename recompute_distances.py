@@ -0,0 +1,106 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app import ROUTE_TABLE, bump_catalogue_version, get_emission_factors, storage, update_journeys_of_routes
+from emission_factors import compute_emissions
+from geo import route_distance
+from storage import lat_lng_text, number_attribute, number_value
+
+# number of routes sent to a worker process at a time
+CHUNK_SIZE = 100
+
+
+def compute_distances(routes):
+    # working out the distance of each route in a chunk from its coordinates
+    return [(origin, destination, round(route_distance(points, origin_lat_lng, destination_lat_lng)))
+            for origin, destination, origin_lat_lng, destination_lat_lng, points in routes]
+
+
+def read_routes():
+    # reading the route table in chunks, with the coordinates converted to plain lists of points
+    # and the currently stored distances and the transport modes kept to compare against
+    chunk = []
+    stored = {}
+    for route in storage.scan_table(ROUTE_TABLE):
+        key = (route['origin']['S'], route['destination']['S'])
+        stored[key] = (number_value(route['distance']), route['transport_mode']['S'])
+        points = [[float(coord['L'][0]['N']), float(coord['L'][1]['N'])] for coord in route['coordinates']['L']]
+        chunk.append(key + (lat_lng_text(route['origin_lat_lng']), lat_lng_text(route['destination_lat_lng']), points))
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk, stored
+            chunk = []
+            stored = {}
+    if chunk:
+        yield chunk, stored
+
+
+def write_distances(chunk, scanned, changed, emission_factors, dry_run):
+    # writing back only the distances that are different to the stored ones, along with the emissions
+    # worked out from them so the two never disagree, and then to the copies of the routes in the journey table,
+    # recording the routes written so every container drops only what it derived from them
+    future, stored = chunk
+    factor_version, factors = emission_factors
+    written = []
+    for origin, destination, distance in future.result():
+        scanned += 1
+        stored_distance, transport_mode = stored[(origin, destination)]
+        # coordinates that all sit on one spot have no length, so the distance provided is kept
+        if stored_distance == distance or not distance:
+            continue
+        changed += 1
+        print(f'{origin} -> {destination}: {stored_distance} -> {distance}')
+        if dry_run:
+            continue
+        update_expression = 'SET #distance = :distance'
+        names = {'#distance': 'distance'}
+        values = {':distance': number_attribute(distance)}
+        # routes without a factor for their transport mode keep the emissions they were given
+        emissions = compute_emissions(distance, transport_mode, factors)
+        if emissions is not None:
+            update_expression += ', #emissions = :emissions, #emission_factor_version = :factor_version'
+            names.update({'#emissions': 'emissions', '#emission_factor_version': 'emission_factor_version'})
+            values.update({':emissions': number_attribute(emissions), ':factor_version': {'S': factor_version}})
+        storage.update_item(
+            TableName=ROUTE_TABLE,
+            Key={'origin': {'S': origin}, 'destination': {'S': destination}},
+            UpdateExpression=update_expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        written.append((origin, destination))
+    update_journeys_of_routes(written)
+    if written:
+        bump_catalogue_version('route', written)
+    return scanned, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute the distance of every route from its coordinates')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing them')
+    args = parser.parse_args()
+
+    start = time.time()
+    scanned = 0
+    changed = 0
+    workers = args.workers or os.cpu_count()
+    emission_factors = get_emission_factors()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keeping a few chunks in flight per worker so the whole table is never held in memory
+        max_pending = 2 * workers
+        pending = []
+        for chunk, stored in read_routes():
+            pending.append((executor.submit(compute_distances, chunk), stored))
+            if len(pending) >= max_pending:
+                scanned, changed = write_distances(pending.pop(0), scanned, changed, emission_factors, args.dry_run)
+        for chunk in pending:
+            scanned, changed = write_distances(chunk, scanned, changed, emission_factors, args.dry_run)
+    elapsed = time.time() - start
+    print(f'{scanned} routes scanned, {changed} distances changed in {elapsed:.1f}s '
+          f'({scanned / elapsed if elapsed else 0:.0f} routes/s)')
+
+
+if __name__ == '__main__':
+    main()
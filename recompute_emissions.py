@@ -0,0 +1,89 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app import (ROUTE_TABLE, CURRENT_FACTOR_VERSION, bump_catalogue_version, load_emission_factors, storage,
+                 update_journeys_of_routes)
+from emission_factors import compute_emissions_batch
+from migration import WRITE_THREADS, changed_update, write_change
+from storage import number_attribute, number_value
+
+
+def emissions_update(route, emissions, factor_version):
+    # setting only the emissions and their factor version, on condition that the route still has the
+    # emissions, distance and transport mode it was read with, so a route added since is left alone
+    update = changed_update({'origin': route['origin'], 'destination': route['destination']}, route,
+                            {'emissions': number_attribute(emissions),
+                             'emission_factor_version': {'S': factor_version}})
+    update['ExpressionAttributeNames'].update({'#distance': 'distance', '#transport_mode': 'transport_mode'})
+    update['ExpressionAttributeValues'].update({':distance': route['distance'],
+                                                ':transport_mode': route['transport_mode']})
+    update['ConditionExpression'] += ' AND #distance = :distance AND #transport_mode = :transport_mode'
+    return update
+
+
+def recompute_segment(segment, total_segments, factor_version, factors, dry_run):
+    # recomputing the emissions of the routes in one segment of a parallel scan a page at a time, sending the
+    # updates of a page at the same time, returns the number of routes scanned, changed and skipped because
+    # they were written since the scan
+    scanned = 0
+    changed = 0
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as executor:
+        for page in storage.scan_pages(ROUTE_TABLE, Segment=segment, TotalSegments=total_segments):
+            if not page:
+                continue
+            scanned += len(page)
+            emissions = compute_emissions_batch([number_value(route['distance']) for route in page],
+                                                [route['transport_mode']['S'] for route in page], factors)
+            current = np.array([number_value(route['emissions']) for route in page], dtype=np.float64)
+            other_version = np.array([route.get('emission_factor_version', {}).get('S') != factor_version
+                                      for route in page], dtype=bool)
+            # routes without a factor for their transport mode keep the emissions they have, the others are
+            # written when their emissions change or were computed with another factor version
+            changed_routes = np.flatnonzero(~np.isnan(emissions) & ((emissions != current) | other_version))
+            if dry_run:
+                changed += len(changed_routes)
+                continue
+            updates = [emissions_update(page[i], int(emissions[i]), factor_version) for i in changed_routes]
+            outcomes = list(executor.map(lambda update: write_change(ROUTE_TABLE, update, storage), updates))
+            written = [(page[i]['origin']['S'], page[i]['destination']['S'])
+                       for i, outcome in zip(changed_routes, outcomes) if outcome == 'changed']
+            changed += len(written)
+            skipped += len(outcomes) - len(written)
+            # and to the copies of the routes in the journey table, recording the routes written so every
+            # container drops only what it derived from them
+            update_journeys_of_routes(written)
+            if written:
+                bump_catalogue_version('route', written)
+    return scanned, changed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute the emissions of every route from an emission factor set')
+    parser.add_argument('--version', default=CURRENT_FACTOR_VERSION, help='emission factor version to apply')
+    parser.add_argument('--segments', type=int, default=4, help='number of parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='count the changes without writing them')
+    args = parser.parse_args()
+
+    factor_version, factors = load_emission_factors(args.version)
+    if factor_version is None:
+        parser.error(f'Could not find emission factor version "{args.version}"')
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(executor.map(
+            lambda segment: recompute_segment(segment, args.segments, factor_version, factors, args.dry_run),
+            range(args.segments)
+        ))
+    scanned, changed, skipped = (sum(counts) for counts in zip(*results))
+    elapsed = time.time() - start
+    print(f'Applied emission factor version "{factor_version}": {scanned} routes scanned, {changed} changed, '
+          f'{skipped} skipped as they were written since the scan in {elapsed:.1f}s '
+          f'({scanned / elapsed if elapsed else 0:.0f} routes/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import heapq
+import time
+from array import array
+
+import numpy as np
+
+# the values each leg of a journey can be weighted by
+METRICS = ('distance', 'emissions', 'lead_time')
+
+
+class RouteGraph:
+    # directed graph of the legs in the route table
+    # place names are interned to integer node ids and the legs are stored as compact
+    # adjacency arrays (compressed sparse rows), the legs leaving node u are
+    # the indexes offsets[u] to offsets[u + 1] of the edge arrays
+    def __init__(self, routes):
+        self.node_ids = {}
+        self.node_names = []
+        edges = []
+        for route in routes:
+            edges.append((self.intern(route['origin']), self.intern(route['destination']),
+                          [float(route[metric]) for metric in METRICS]))
+        # sorting the legs by origin node so each node's legs are next to each other
+        edges.sort(key=lambda edge: (edge[0], edge[1]))
+        self.offsets = array('l', [0] * (len(self.node_names) + 1))
+        self.sources = array('l')
+        self.targets = array('l')
+        self.weights = {metric: array('d') for metric in METRICS}
+        for source, target, values in edges:
+            self.offsets[source + 1] += 1
+            self.sources.append(source)
+            self.targets.append(target)
+            for metric, value in zip(METRICS, values):
+                self.weights[metric].append(value)
+        for node in range(len(self.node_names)):
+            self.offsets[node + 1] += self.offsets[node]
+
+    def intern(self, name):
+        node = self.node_ids.get(name)
+        if node is None:
+            node = len(self.node_names)
+            self.node_ids[name] = node
+            self.node_names.append(name)
+        return node
+
+    def __len__(self):
+        return len(self.targets)
+
+    def has_node(self, name):
+        return name in self.node_ids
+
+    def edge(self, e):
+        # details of a single leg of the graph
+        leg = {'origin': self.node_names[self.sources[e]], 'destination': self.node_names[self.targets[e]]}
+        for metric in METRICS:
+            leg[metric] = to_number(self.weights[metric][e])
+        return leg
+
+    def shortest_path(self, source, target, minimize='emissions'):
+        # Dijkstra's algorithm from source to target, returning the list of edge indexes of
+        # the path with the lowest total of the metric, or None if target can not be reached
+        if minimize not in METRICS:
+            raise ValueError(f'Can not minimize "{minimize}"')
+        if source not in self.node_ids or target not in self.node_ids:
+            return None
+        weights = self.weights[minimize]
+        offsets = self.offsets
+        targets = self.targets
+        start = self.node_ids[source]
+        end = self.node_ids[target]
+        best = {start: 0.0}
+        previous_edge = {}
+        heap = [(0.0, start)]
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if node == end:
+                break
+            if cost > best[node]:
+                continue
+            for e in range(offsets[node], offsets[node + 1]):
+                next_node = targets[e]
+                next_cost = cost + weights[e]
+                if next_cost < best.get(next_node, float('inf')):
+                    best[next_node] = next_cost
+                    previous_edge[next_node] = e
+                    heapq.heappush(heap, (next_cost, next_node))
+        if end not in best:
+            return None
+        # walking back from the target to build the path
+        path = []
+        node = end
+        while node != start:
+            e = previous_edge[node]
+            path.append(e)
+            node = self.sources[e]
+        path.reverse()
+        return path
+
+    def weight_matrix(self):
+        # the weights of every leg as one (legs x metrics) array, used to compare labels in bulk
+        if getattr(self, '_weight_matrix', None) is None:
+            self._weight_matrix = np.column_stack(
+                [np.frombuffer(self.weights[metric], dtype=np.float64) for metric in METRICS]
+            ).reshape(len(self), len(METRICS))
+        return self._weight_matrix
+
+    def pareto_paths(self, source, target, max_results=20, time_budget=0.5):
+        # multi-criteria label-setting search for the journeys from source to target that no
+        # other journey beats on distance, emissions and lead time all at once
+        # returns the list of paths (lists of edge indexes) and whether the search finished
+        # before running into max_results or the time budget
+        if source not in self.node_ids or target not in self.node_ids:
+            return [], True
+        deadline = time.monotonic() + time_budget
+        weights = self.weight_matrix()
+        start = self.node_ids[source]
+        end = self.node_ids[target]
+        # every label is a partial journey: its totals, the node it ends at, the label it
+        # was extended from and the edge used to get there
+        label_costs = []
+        label_nodes = []
+        label_parents = []
+        label_edges = []
+        label_alive = []
+        # the non-dominated labels at each node, as a (labels x metrics) array plus label ids
+        bags = {}
+        heap = []
+
+        def dominated(cost, node):
+            bag = bags.get(node)
+            return bag is not None and bool(np.any(np.all(bag[0] <= cost, axis=1)))
+
+        def add_label(cost, node, parent, edge):
+            # a label is dropped if a label at its node, or a finished journey, is at least as good
+            if dominated(cost, node) or dominated(cost, end):
+                return
+            label = len(label_costs)
+            label_costs.append(cost)
+            label_nodes.append(node)
+            label_parents.append(parent)
+            label_edges.append(edge)
+            label_alive.append(True)
+            bag = bags.get(node)
+            if bag is None:
+                bags[node] = (cost.reshape(1, -1), [label])
+            else:
+                # removing the labels the new label beats
+                beaten = np.all(cost <= bag[0], axis=1)
+                for old_label in np.array(bag[1])[beaten]:
+                    label_alive[old_label] = False
+                keep = ~beaten
+                bags[node] = (np.vstack([bag[0][keep], cost]),
+                              [old_label for old_label, kept in zip(bag[1], keep) if kept] + [label])
+            heapq.heappush(heap, (tuple(cost), label))
+
+        add_label(np.zeros(len(METRICS)), start, -1, -1)
+        results = []
+        complete = True
+        while heap:
+            if len(results) >= max_results or time.monotonic() > deadline:
+                complete = False
+                break
+            _, label = heapq.heappop(heap)
+            if not label_alive[label]:
+                continue
+            node = label_nodes[label]
+            if node == end:
+                # labels come off the heap in lexicographic order, so nothing found later can beat this one
+                results.append(label)
+                continue
+            first, last = self.offsets[node], self.offsets[node + 1]
+            if first == last:
+                continue
+            # extending the label along every leg out of the node in one step
+            next_costs = label_costs[label] + weights[first:last]
+            for e, next_cost in zip(range(first, last), next_costs):
+                add_label(next_cost, self.targets[e], label, e)
+        paths = []
+        for label in results:
+            path = []
+            while label_parents[label] != -1:
+                path.append(label_edges[label])
+                label = label_parents[label]
+            path.reverse()
+            paths.append(path)
+        return paths, complete
+
+    def path_totals(self, path):
+        return {metric: to_number(sum(self.weights[metric][e] for e in path)) for metric in METRICS}
+
+
+def to_number(value):
+    # whole numbers are returned as ints to match the totals in the rest of the api
+    if float(value).is_integer():
+        return int(value)
+    return round(value, 6)
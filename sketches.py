@@ -0,0 +1,186 @@
+import hashlib
+import math
+import struct
+import zlib
+
+import numpy as np
+
+# small mergeable summaries of every saved list, so global statistics never need a scan of the saved lists
+# every sketch is kept as a compact binary blob and two sketches of the same kind merge into one that
+# summarises everything either of them has seen
+
+
+class QuantileSketch:
+    # relative error quantile sketch (DDSketch): values are counted in logarithmic buckets so any
+    # quantile is within relative_accuracy of the true value, and merging adds up the bucket counts
+    MAGIC = b'QSK2'
+    # magic, relative accuracy, count of values at or below zero, smallest and largest value,
+    # index of the first bucket, number of buckets
+    HEADER = struct.Struct('<4sdQddiI')
+    # sketches written before the smallest and largest values were kept
+    OLD_MAGIC = b'QSK1'
+    OLD_HEADER = struct.Struct('<4sdQiI')
+    # values below this are counted as zero
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.uint64)
+        # the smallest and largest values counted, so quantiles never fall outside them
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return self.zero_count + int(self.counts.sum())
+
+    def bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def grow(self, first, last):
+        # making room for buckets first to last
+        if not len(self.counts):
+            self.offset = first
+            self.counts = np.zeros(last - first + 1, dtype=np.uint64)
+            return
+        new_first = min(first, self.offset)
+        new_last = max(last, self.offset + len(self.counts) - 1)
+        if new_first == self.offset and new_last == self.offset + len(self.counts) - 1:
+            return
+        counts = np.zeros(new_last - new_first + 1, dtype=np.uint64)
+        counts[self.offset - new_first:self.offset - new_first + len(self.counts)] = self.counts
+        self.offset = new_first
+        self.counts = counts
+
+    def add(self, value, count=1):
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value < self.MIN_VALUE:
+            self.zero_count += count
+            return
+        index = self.bucket(value)
+        self.grow(index, index)
+        self.counts[index - self.offset] += count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged')
+        self.zero_count += other.zero_count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(other.counts):
+            self.grow(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+        return self
+
+    def value(self, index):
+        # the value a bucket stands for, the middle of its range in relative terms
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        # the value q of the way through every value counted, None when nothing has been counted
+        total = len(self)
+        if not total:
+            return None
+        rank = q * (total - 1)
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = np.cumsum(self.counts) + self.zero_count
+        value = self.value(self.offset + int(np.searchsorted(cumulative, rank, side='right')))
+        return min(max(value, self.min), self.max)
+
+    def fraction_above(self, value):
+        # the fraction of the values counted that are greater than value
+        total = len(self)
+        if not total:
+            return None
+        if value < self.MIN_VALUE:
+            return int(self.counts.sum()) / total
+        first_above = self.bucket(value) + 1 - self.offset
+        return int(self.counts[max(first_above, 0):].sum()) / total
+
+    def to_bytes(self):
+        counts = self.counts
+        # leaving out empty buckets at either end
+        filled = np.flatnonzero(counts)
+        offset = self.offset
+        if len(filled):
+            counts = counts[filled[0]:filled[-1] + 1]
+            offset += int(filled[0])
+        else:
+            counts = counts[:0]
+        return self.HEADER.pack(self.MAGIC, self.relative_accuracy, self.zero_count, self.min, self.max, offset,
+                                len(counts)) + zlib.compress(counts.astype('<u8').tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] == cls.OLD_MAGIC:
+            # without the smallest and largest values the quantiles are left unclamped
+            _, relative_accuracy, zero_count, offset, length = cls.OLD_HEADER.unpack_from(data)
+            minimum, maximum, header_size = -math.inf, math.inf, cls.OLD_HEADER.size
+        else:
+            magic, relative_accuracy, zero_count, minimum, maximum, offset, length = cls.HEADER.unpack_from(data)
+            if magic != cls.MAGIC:
+                raise ValueError('Not a quantile sketch')
+            header_size = cls.HEADER.size
+        sketch = cls(relative_accuracy)
+        sketch.zero_count = zero_count
+        sketch.min = minimum
+        sketch.max = maximum
+        sketch.offset = offset
+        sketch.counts = np.frombuffer(zlib.decompress(data[header_size:]), dtype='<u8').astype(np.uint64)
+        if len(sketch.counts) != length:
+            raise ValueError('Truncated quantile sketch')
+        return sketch
+
+
+class DistinctSketch:
+    # HyperLogLog count of distinct values: each value is hashed to one of 2^precision registers, which
+    # keeps the longest run of leading zeros seen, and merging keeps the larger of each register
+    MAGIC = b'HLL1'
+    # magic and precision
+    HEADER = struct.Struct('<4sB')
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        register = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Only sketches with the same precision can be merged')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers ** 2 / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * registers and empty:
+            # counting the empty registers is more accurate while most of them are still empty
+            estimate = registers * math.log(registers / empty)
+        return round(estimate)
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.MAGIC, self.precision) + zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, precision = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError('Not a distinct count sketch')
+        sketch = cls(precision)
+        sketch.registers = np.frombuffer(zlib.decompress(data[cls.HEADER.size:]), dtype=np.uint8).copy()
+        return sketch
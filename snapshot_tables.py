@@ -0,0 +1,136 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app import (ITEM_TABLE, JOURNEY_TABLE, ROUTE_TABLE, SAVED_LIST_TABLE, SHOPPING_LIST_TABLE, bump_catalogue_version,
+                 storage)
+from backfill_journeys import backfill_segment
+from snapshots import (FORMATS, chunks, decode_records, encode_lines, read_lines, read_manifest, segment_path,
+                       write_lines, write_manifest)
+from storage import BATCH_WRITE_LIMIT
+
+# tables are stored under these names, so a snapshot of one stage can be restored into another
+TABLES = {'item': ITEM_TABLE, 'shoppingList': SHOPPING_LIST_TABLE, 'savedList': SAVED_LIST_TABLE,
+          'route': ROUTE_TABLE}
+
+
+def scan_records(table_name, segment, total_segments, counts):
+    # every item of one segment of a parallel scan, a page at a time, counting them as they go by
+    for page in storage.scan_pages(table_name, Segment=segment, TotalSegments=total_segments):
+        for item in page:
+            counts[segment] += 1
+            yield item
+
+
+def export_table(directory, table, segments, snapshot_format):
+    # streaming each segment of the table into its own compressed file, returns the number of records
+    counts = [0] * segments
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        list(executor.map(
+            lambda segment: write_lines(
+                segment_path(directory, table, segment, snapshot_format),
+                encode_lines(scan_records(TABLES[table], segment, segments, counts), snapshot_format)
+            ),
+            range(segments)
+        ))
+    return sum(counts)
+
+
+def restore_table(directory, table, segments, snapshot_format, workers):
+    # streaming the records of every file of the table back in with BatchWriteItem, keeping only a
+    # few batches per worker in flight so memory stays flat whatever the size of the table,
+    # returns the number of records read and the number that could not be written
+    restored = 0
+    failed = 0
+    records = (record for segment in range(segments)
+               for record in decode_records(read_lines(segment_path(directory, table, segment, snapshot_format)),
+                                            snapshot_format))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks(records, BATCH_WRITE_LIMIT):
+            restored += len(chunk)
+            pending.add(executor.submit(storage.batch_write, TABLES[table],
+                                        [{'PutRequest': {'Item': record}} for record in chunk]))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failed += sum(len(future.result()) for future in done)
+        failed += sum(len(future.result()) for future in pending)
+    return restored, failed
+
+
+def export(args):
+    os.makedirs(args.directory, exist_ok=True)
+    manifest = {'format': args.format, 'segments': args.segments,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'tables': {}}
+    start = time.time()
+    for table in args.tables:
+        table_start = time.time()
+        count = export_table(args.directory, table, args.segments, args.format)
+        manifest['tables'][table] = count
+        elapsed = time.time() - table_start
+        print(f'{table}: {count} records exported in {elapsed:.1f}s '
+              f'({count / elapsed if elapsed else 0:.0f} records/s)')
+    # the manifest is written last, so a snapshot without one is incomplete
+    write_manifest(args.directory, manifest)
+    report('exported', sum(manifest['tables'].values()), 0, time.time() - start)
+
+
+def restore(args):
+    manifest = read_manifest(args.directory)
+    tables = [table for table in args.tables if table in manifest['tables']]
+    start = time.time()
+    total = 0
+    total_failed = 0
+    for table in tables:
+        table_start = time.time()
+        restored, failed = restore_table(args.directory, table, manifest['segments'], manifest['format'],
+                                         args.workers)
+        total += restored
+        total_failed += failed
+        elapsed = time.time() - table_start
+        print(f'{table}: {restored} records restored, {failed} failed to write in {elapsed:.1f}s '
+              f'({restored / elapsed if elapsed else 0:.0f} records/s)')
+    if total and {'item', 'route'} & set(tables):
+        if JOURNEY_TABLE:
+            # the journey table holds copies of the items and routes, so it is written again from them
+            journey_start = time.time()
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                results = list(executor.map(lambda segment: backfill_segment(segment, args.workers, False),
+                                            range(args.workers)))
+            scanned, written, failed = (sum(counts) for counts in zip(*results))
+            total_failed += failed
+            print(f'journeys: {written} records of {scanned} items written, {failed} failed to write '
+                  f'in {time.time() - journey_start:.1f}s')
+        # making every container pick up the restored items and routes
+        bump_catalogue_version()
+    report('restored', total, total_failed, time.time() - start)
+
+
+def report(action, count, failed, elapsed):
+    print(f'{count} records {action}, {failed} failed to write in {elapsed:.1f}s '
+          f'({count / elapsed if elapsed else 0:.0f} records/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the tables to compressed snapshot files or restore them')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='write a snapshot of the tables')
+    export_parser.add_argument('--format', choices=FORMATS, default='ndjson', help='format of the snapshot files')
+    export_parser.add_argument('--segments', type=int, default=4, help='number of parallel scan segments per table')
+    restore_parser = commands.add_parser('restore', help='write a snapshot back into the tables')
+    restore_parser.add_argument('--workers', type=int, default=4, help='number of parallel batch writers')
+    for command_parser in (export_parser, restore_parser):
+        command_parser.add_argument('directory', help='directory of the snapshot')
+        command_parser.add_argument('--tables', nargs='+', choices=TABLES, default=list(TABLES),
+                                    help='tables to export or restore')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args)
+    else:
+        restore(args)
+
+
+if __name__ == '__main__':
+    main()
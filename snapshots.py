@@ -0,0 +1,85 @@
+import gzip
+import json
+import os
+import tempfile
+from itertools import islice
+
+# a snapshot is a directory with a manifest and one gzip compressed file per scan segment of each
+# table, records are kept as DynamoDB JSON so every attribute type comes back exactly as it was
+#   ndjson     one record per line
+#   columnar   one chunk of records per line as {"count": n, "columns": {attribute: [value or null, ...]}},
+#              the values of an attribute sit together so they compress better
+FORMATS = {'ndjson': 'ndjson.gz', 'columnar': 'columns.gz'}
+MANIFEST = 'manifest.json'
+# number of records in each line of a columnar file
+COLUMN_CHUNK = 1000
+
+
+def segment_path(directory, table, segment, snapshot_format):
+    return os.path.join(directory, f'{table}.{segment:04d}.{FORMATS[snapshot_format]}')
+
+
+def chunks(records, size):
+    # lists of up to size records from a stream of records, holding one list at a time
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_lines(records, snapshot_format):
+    # lines of a snapshot file from a stream of records
+    if snapshot_format == 'ndjson':
+        for record in records:
+            yield json.dumps(record, separators=(',', ':'))
+        return
+    for chunk in chunks(records, COLUMN_CHUNK):
+        columns = {}
+        for i, record in enumerate(chunk):
+            for attribute, value in record.items():
+                columns.setdefault(attribute, [None] * len(chunk))[i] = value
+        yield json.dumps({'count': len(chunk), 'columns': columns}, separators=(',', ':'))
+
+
+def decode_records(lines, snapshot_format):
+    # records from the lines of a snapshot file
+    for line in lines:
+        data = json.loads(line)
+        if snapshot_format == 'ndjson':
+            yield data
+            continue
+        for i in range(data['count']):
+            yield {attribute: values[i] for attribute, values in data['columns'].items() if values[i] is not None}
+
+
+def write_lines(path, lines):
+    # writing lines to a compressed file through a temporary file, so an interrupted export
+    # never leaves a partial file that looks complete, returns the number of lines written
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    count = 0
+    with os.fdopen(handle, 'wb') as raw_file, gzip.open(raw_file, 'wt', encoding='utf-8') as snapshot_file:
+        for line in lines:
+            snapshot_file.write(line + '\n')
+            count += 1
+    os.replace(temporary_path, path)
+    return count
+
+
+def read_lines(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            yield line
+
+
+def write_manifest(directory, manifest):
+    handle, temporary_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary_path, os.path.join(directory, MANIFEST))
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as manifest_file:
+        return json.load(manifest_file)
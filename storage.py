@@ -0,0 +1,763 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+import boto3
+
+# maximum number of keys DynamoDB accepts in a single BatchGetItem request
+BATCH_GET_LIMIT = 100
+# maximum number of writes DynamoDB accepts in a single BatchWriteItem request
+BATCH_WRITE_LIMIT = 25
+# number of times unprocessed writes are retried before giving up on them
+BATCH_WRITE_RETRIES = 8
+# number of times unprocessed keys are retried before giving up on the read
+BATCH_GET_RETRIES = 8
+
+
+class NotFoundError(Exception):
+    pass
+
+
+class UnprocessedKeysError(Exception):
+    # keys DynamoDB still had not read after every retry, usually because the table is being throttled
+    def __init__(self, table_name, keys):
+        super().__init__(f'Could not read {len(keys)} keys of {table_name} after {BATCH_GET_RETRIES} retries')
+        self.table_name = table_name
+        self.keys = keys
+
+
+def split_item_id(item_id):
+    # itemIds are stored as "name,origin", split at the first comma like the SQLite backend does
+    name, origin = item_id.split(',', 1)
+    return name, origin
+
+
+def number_value(attribute):
+    # a number stored either as an N or, as routes were before they were migrated, as an S
+    number = float(attribute.get('N', attribute.get('S')))
+    return int(number) if number.is_integer() else number
+
+
+def number_text(attribute):
+    # a number attribute in the string form the api returns it in
+    return str(number_value(attribute))
+
+
+def number_attribute(value):
+    return {'N': str(value)}
+
+
+def lat_lng_value(attribute):
+    # (lat, lng) of a place stored either as a numeric pair or, before it was migrated, as a "lat,lng" string
+    if 'L' in attribute:
+        return float(attribute['L'][0]['N']), float(attribute['L'][1]['N'])
+    lat, lng = attribute['S'].split(',')
+    return float(lat), float(lng)
+
+
+def lat_lng_text(attribute):
+    # a place in the "lat,lng" string form the api returns it in
+    if 'L' in attribute:
+        return f"{attribute['L'][0]['N']},{attribute['L'][1]['N']}"
+    return attribute['S']
+
+
+def lat_lng_attribute(lat_lng):
+    # a "lat,lng" string as a numeric pair attribute, raising ValueError when it is not one
+    lat, lng = (part.strip() for part in lat_lng.split(','))
+    # checking both parts are numbers, keeping them as they were written
+    float(lat)
+    float(lng)
+    return {'L': [{'N': lat}, {'N': lng}]}
+
+
+def get_item_legs(item):
+    # (origin, destination) key of each leg of the journey of a food item
+    return [(leg['M']['origin']['S'], leg['M']['destination']['S']) for leg in item['legs']['L']]
+
+
+class Storage:
+    # everything the app needs from a backend on top of the low-level DynamoDB style calls
+    # (get_item, put_item, delete_item, update_item, query, scan, batch_get_item, batch_write_item)
+    # which each backend provides
+    def __init__(self, tables, item_table, route_table, shopping_list_table):
+        # tables maps each table name to the names of its (hash, range) key attributes
+        self.tables = tables
+        self.item_table = item_table
+        self.route_table = route_table
+        self.shopping_list_table = shopping_list_table
+
+    def batch_get(self, table_name, key_names, keys, **kwargs):
+        # getting every unique key from the table with BatchGetItem, 100 keys per request,
+        # returns a dictionary of key tuple to item, keys that do not exist are left out, and raises
+        # UnprocessedKeysError if some keys are still unread after BATCH_GET_RETRIES retries
+        # any other arguments, such as a ProjectionExpression, are passed on with the keys
+        results = {}
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            request_items = {table_name: dict(kwargs, Keys=[
+                {key_names[0]: {'S': key[0]}, key_names[1]: {'S': key[1]}} for key in keys[i:i + BATCH_GET_LIMIT]
+            ])}
+            retries = 0
+            while request_items:
+                response = self.batch_get_item(RequestItems=request_items)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    results[(item[key_names[0]]['S'], item[key_names[1]]['S'])] = item
+                # retrying any keys DynamoDB did not get to, backing off a little each time
+                request_items = response.get('UnprocessedKeys')
+                if request_items and retries == BATCH_GET_RETRIES:
+                    raise UnprocessedKeysError(table_name, [
+                        (key[key_names[0]]['S'], key[key_names[1]]['S']) for key in request_items[table_name]['Keys']])
+                if request_items:
+                    time.sleep(min(0.05 * 2 ** retries, 1))
+                    retries += 1
+        return results
+
+    def batch_write(self, table_name, requests):
+        # writing PutRequests and DeleteRequests with BatchWriteItem, 25 per request,
+        # returns the requests that were still unprocessed after retrying them
+        failed = []
+        for i in range(0, len(requests), BATCH_WRITE_LIMIT):
+            request_items = {table_name: requests[i:i + BATCH_WRITE_LIMIT]}
+            retries = 0
+            while request_items:
+                response = self.batch_write_item(RequestItems=request_items)
+                # retrying any writes DynamoDB did not get to, backing off a little each time
+                request_items = response.get('UnprocessedItems')
+                if request_items and retries == BATCH_WRITE_RETRIES:
+                    failed.extend(request_items[table_name])
+                    break
+                if request_items:
+                    time.sleep(min(0.05 * 2 ** retries, 1))
+                    retries += 1
+        return failed
+
+    def query_table(self, table_name, **kwargs):
+        # reading every item matching a query, following LastEvaluatedKey across pages
+        while True:
+            result = self.query(TableName=table_name, **kwargs)
+            for item in result.get('Items', []):
+                yield item
+            if 'LastEvaluatedKey' not in result:
+                break
+            kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    def scan_table(self, table_name, **kwargs):
+        # reading every item in a table, following LastEvaluatedKey across pages
+        for page in self.scan_pages(table_name, **kwargs):
+            for item in page:
+                yield item
+
+    def scan_pages(self, table_name, **kwargs):
+        # reading a table a page at a time, pass Segment and TotalSegments to read
+        # one segment of a parallel scan
+        while True:
+            result = self.scan(TableName=table_name, **kwargs)
+            yield result.get('Items', [])
+            if 'LastEvaluatedKey' not in result:
+                break
+            kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    def item_totals(self, item_keys):
+        # the distance, emissions and lead time of each unique food item, resolving each
+        # unique item and each unique leg once
+        items = self.batch_get(self.item_table, ('name', 'origin'), item_keys)
+        for name, origin in item_keys:
+            if (name, origin) not in items:
+                raise NotFoundError(f'Could not find food item with name "{name}" and origin "{origin}"')
+        return self.totals_for_items(items)
+
+    def totals_for_items(self, items):
+        # getting each unique leg across all the food items once
+        leg_keys = [leg for item in items.values() for leg in get_item_legs(item)]
+        routes = self.batch_get(self.route_table, ('origin', 'destination'), leg_keys)
+        # adding up the distance, emissions and lead time of the legs of each food item
+        item_totals = {}
+        for (name, origin), item in items.items():
+            distance = 0
+            emissions = 0
+            lead_time = 0
+            for route_origin, route_destination in get_item_legs(item):
+                route = routes.get((route_origin, route_destination))
+                if not route:
+                    raise NotFoundError(
+                        f'Could not find route with origin "{route_origin}" and destination "{route_destination}"')
+                distance += number_value(route['distance'])
+                emissions += number_value(route['emissions'])
+                lead_time += number_value(route['lead_time'])
+            item_totals[(name, origin)] = {
+                'name': item['name']['S'],
+                'origin': item['origin']['S'],
+                'distance': distance,
+                'emissions': emissions,
+                'lead_time': lead_time,
+            }
+        return item_totals
+
+    def list_item_totals(self, user_id):
+        # every item in a user's shopping list along with its totals
+        list_items = list(self.query_table(
+            self.shopping_list_table,
+            KeyConditionExpression='userId = :userId',
+            ExpressionAttributeValues={':userId': {'S': user_id}}
+        ))
+        item_totals = self.item_totals([split_item_id(item['itemId']['S']) for item in list_items])
+        return [(item, item_totals[split_item_id(item['itemId']['S'])]) for item in list_items]
+
+    def journey(self, name, origin):
+        # a food item and the route of each leg of its journey in order,
+        # or (None, []) if there is no such food item
+        result = self.get_item(TableName=self.item_table, Key={'name': {'S': name}, 'origin': {'S': origin}})
+        item = result.get('Item')
+        if not item:
+            return None, []
+        legs = get_item_legs(item)
+        routes = self.batch_get(self.route_table, ('origin', 'destination'), legs)
+        for route_origin, route_destination in legs:
+            if (route_origin, route_destination) not in routes:
+                raise NotFoundError(
+                    f'Could not find route with origin "{route_origin}" and destination "{route_destination}"')
+        return item, [routes[leg] for leg in legs]
+
+    def journeys(self, item_keys):
+        # each food item found and the route of each leg of its journey in order, getting the unique items
+        # and then their unique legs with BatchGetItem, items that do not exist are left out and the route
+        # of a leg that does not exist is None
+        items = self.batch_get(self.item_table, ('name', 'origin'), item_keys)
+        legs = [leg for item in items.values() for leg in get_item_legs(item)]
+        routes = self.batch_get(self.route_table, ('origin', 'destination'), legs)
+        return {key: (item, [routes.get(leg) for leg in get_item_legs(item)]) for key, item in items.items()}
+
+
+class DynamoDBStorage(Storage):
+    # the low-level calls go straight to a boto3 DynamoDB client
+    def __init__(self, tables, item_table, route_table, shopping_list_table, client):
+        super().__init__(tables, item_table, route_table, shopping_list_table)
+        self.client = client
+        self.exceptions = client.exceptions
+
+    def __getattr__(self, name):
+        if name == 'client':
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+
+class SQLiteExceptions:
+    class ConditionalCheckFailedException(Exception):
+        pass
+
+
+def attribute_value(value):
+    # the python value of a DynamoDB attribute value that can be a key or a number
+    if 'S' in value:
+        return value['S']
+    if 'N' in value:
+        return Decimal(value['N'])
+    raise ValueError(f'Unsupported key attribute {value}')
+
+
+def dump_item(item):
+    # an item as DynamoDB JSON, with binary attributes as base64 strings
+    return json.dumps(item, default=lambda value: base64.b64encode(value).decode('ascii'))
+
+
+def load_item(text):
+    # an item from DynamoDB JSON, turning the base64 strings of binary attributes back into bytes
+    return json.loads(text, object_hook=lambda value: (
+        {'B': base64.b64decode(value['B'])} if len(value) == 1 and isinstance(value.get('B'), str) else value))
+
+
+def number_string(number):
+    # DynamoDB style number string of a Decimal, without an exponent
+    return format(number.normalize(), 'f')
+
+
+class SQLiteStorage(Storage):
+    # embedded backend keeping every table in one SQLite file
+    # each table stores its items as DynamoDB JSON keyed by (pk, sk), and the item and route tables
+    # are also kept in relational form (the legs of each item, the numbers of each route) so a
+    # food item, a journey or a whole shopping list can be resolved with a single join
+    exceptions = SQLiteExceptions
+    # number of items returned per page of a query or scan
+    PAGE_SIZE = 1000
+    # number of keys joined in a single statement, keeping under SQLite's variable limit
+    JOIN_CHUNK = 400
+
+    def __init__(self, tables, item_table, route_table, shopping_list_table, path):
+        super().__init__(tables, item_table, route_table, shopping_list_table)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.create_function('segment', 2, lambda pk, total: zlib.crc32(pk.encode('utf-8')) % total,
+                                        deterministic=True)
+        self.lock = threading.RLock()
+        for table_name in tables:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table_name}" '
+                f"(pk TEXT NOT NULL, sk TEXT NOT NULL DEFAULT '', item TEXT NOT NULL, PRIMARY KEY (pk, sk))"
+            )
+        self.legs_table = f'{item_table}__legs'
+        self.route_numbers_table = f'{route_table}__numbers'
+        with self.lock:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.legs_table}" (name TEXT NOT NULL, origin TEXT NOT NULL, '
+                f'position INTEGER NOT NULL, leg_origin TEXT NOT NULL, leg_destination TEXT NOT NULL, '
+                f'PRIMARY KEY (name, origin, position))'
+            )
+            self.connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self.legs_table}_leg" ON "{self.legs_table}" (leg_origin, leg_destination)'
+            )
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.route_numbers_table}" (origin TEXT NOT NULL, '
+                f'destination TEXT NOT NULL, distance REAL, emissions REAL, lead_time REAL, '
+                f'PRIMARY KEY (origin, destination))'
+            )
+
+    # keys and rows
+
+    def key_of(self, table_name, item):
+        key_names = self.tables[table_name]
+        pk = str(attribute_value(item[key_names[0]]))
+        sk = str(attribute_value(item[key_names[1]])) if len(key_names) > 1 else ''
+        return pk, sk
+
+    def read(self, table_name, key):
+        row = self.connection.execute(
+            f'SELECT item FROM "{table_name}" WHERE pk = ? AND sk = ?', key
+        ).fetchone()
+        return load_item(row[0]) if row else None
+
+    def write(self, table_name, item):
+        key = self.key_of(table_name, item)
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO "{table_name}" (pk, sk, item) VALUES (?, ?, ?)', key + (dump_item(item),)
+        )
+        self.write_relations(table_name, key, item)
+
+    def remove(self, table_name, key):
+        self.connection.execute(f'DELETE FROM "{table_name}" WHERE pk = ? AND sk = ?', key)
+        self.write_relations(table_name, key, None)
+
+    def write_relations(self, table_name, key, item):
+        # keeping the relational copies of the item and route tables in step with their items
+        if table_name == self.item_table:
+            self.connection.execute(f'DELETE FROM "{self.legs_table}" WHERE name = ? AND origin = ?', key)
+            if item is not None and 'legs' in item:
+                self.connection.executemany(
+                    f'INSERT INTO "{self.legs_table}" VALUES (?, ?, ?, ?, ?)',
+                    [key + (position,) + leg for position, leg in enumerate(get_item_legs(item))]
+                )
+        elif table_name == self.route_table:
+            self.connection.execute(
+                f'DELETE FROM "{self.route_numbers_table}" WHERE origin = ? AND destination = ?', key
+            )
+            if item is not None:
+                numbers = []
+                for attribute in ('distance', 'emissions', 'lead_time'):
+                    value = item.get(attribute)
+                    numbers.append(float(value.get('N', value.get('S'))) if value else None)
+                self.connection.execute(
+                    f'INSERT INTO "{self.route_numbers_table}" VALUES (?, ?, ?, ?, ?)', key + tuple(numbers)
+                )
+
+    # expressions
+
+    def attribute_name(self, token, names):
+        return (names or {}).get(token, token)
+
+    def project(self, item, projection, names):
+        if not projection or item is None:
+            return item
+        attributes = [self.attribute_name(token.strip(), names) for token in projection.split(',')]
+        return {attribute: item[attribute] for attribute in attributes if attribute in item}
+
+    def condition_matches(self, item, expression, names, values):
+        # evaluating a condition or filter expression made of comparisons joined by AND / OR
+        if not expression:
+            return True
+        for alternative in re.split(r'\s+OR\s+', expression.strip(), flags=re.IGNORECASE):
+            if all(self.comparison_matches(item, part, names, values)
+                   for part in re.split(r'\s+AND\s+', alternative.strip(), flags=re.IGNORECASE)):
+                return True
+        return False
+
+    def comparison_matches(self, item, expression, names, values):
+        item = item or {}
+        function = re.fullmatch(r'(attribute_exists|attribute_not_exists|begins_with|contains)\((.+?)\)',
+                                expression.strip())
+        if function:
+            arguments = [argument.strip() for argument in function.group(2).split(',')]
+            attribute = item.get(self.attribute_name(arguments[0], names))
+            if function.group(1) == 'attribute_exists':
+                return attribute is not None
+            if function.group(1) == 'attribute_not_exists':
+                return attribute is None
+            if attribute is None:
+                return False
+            operand = values[arguments[1]]
+            if function.group(1) == 'begins_with':
+                return attribute_value(attribute).startswith(attribute_value(operand))
+            (attribute_type, contents), = attribute.items()
+            (_, operand_value), = operand.items()
+            return operand_value in contents
+        comparison = re.fullmatch(r'(\S+)\s*(=|<>|<=|<|>=|>)\s*(\S+)', expression.strip())
+        if not comparison:
+            raise ValueError(f'Unsupported expression "{expression}"')
+        attribute = item.get(self.attribute_name(comparison.group(1), names))
+        if attribute is None:
+            return comparison.group(2) == '<>'
+        operand = values[comparison.group(3)]
+        if comparison.group(2) in ('=', '<>') and not {'S', 'N'} & set(attribute) & set(operand):
+            # lists, maps and values of different types are only ever compared for equality
+            return (attribute == operand) == (comparison.group(2) == '=')
+        left = attribute_value(attribute)
+        right = attribute_value(operand)
+        return {'=': left == right, '<>': left != right, '<': left < right, '<=': left <= right,
+                '>': left > right, '>=': left >= right}[comparison.group(2)]
+
+    def apply_update(self, item, expression, names, values):
+        # applying the SET, ADD and REMOVE clauses of an update expression to an item
+        clauses = re.split(r'\s*\b(SET|ADD|REMOVE)\s+', ' ' + expression.strip(), flags=re.IGNORECASE)[1:]
+        for action, body in zip(clauses[::2], clauses[1::2]):
+            action = action.upper()
+            for part in split_top_level(body):
+                if action == 'REMOVE':
+                    item.pop(self.attribute_name(part, names), None)
+                elif action == 'ADD':
+                    attribute, operand = part.split()
+                    attribute = self.attribute_name(attribute, names)
+                    value = values[operand]
+                    if 'N' in value:
+                        current = Decimal(item[attribute]['N']) if attribute in item else Decimal(0)
+                        item[attribute] = {'N': number_string(current + Decimal(value['N']))}
+                    else:
+                        (set_type, members), = value.items()
+                        current = item.get(attribute, {set_type: []})[set_type]
+                        item[attribute] = {set_type: current + [member for member in members if member not in current]}
+                else:
+                    attribute, operand = (side.strip() for side in part.split('=', 1))
+                    item[self.attribute_name(attribute, names)] = self.operand_value(item, operand, names, values)
+        return item
+
+    def operand_value(self, item, operand, names, values):
+        if_not_exists = re.fullmatch(r'if_not_exists\((.+?),\s*(.+?)\)', operand)
+        if if_not_exists:
+            current = item.get(self.attribute_name(if_not_exists.group(1).strip(), names))
+            return current if current is not None else values[if_not_exists.group(2).strip()]
+        list_append = re.fullmatch(r'list_append\((.+?),\s*(.+?)\)', operand)
+        if list_append:
+            first, second = (self.operand_value(item, argument.strip(), names, values)
+                             for argument in (list_append.group(1), list_append.group(2)))
+            return {'L': (first or {'L': []})['L'] + (second or {'L': []})['L']}
+        arithmetic = re.fullmatch(r'(\S+)\s*([+-])\s*(\S+)', operand)
+        if arithmetic:
+            left = Decimal(self.operand_value(item, arithmetic.group(1), names, values)['N'])
+            right = Decimal(self.operand_value(item, arithmetic.group(3), names, values)['N'])
+            return {'N': number_string(left + right if arithmetic.group(2) == '+' else left - right)}
+        if operand.startswith(':'):
+            return values[operand]
+        return item.get(self.attribute_name(operand, names))
+
+    # low-level calls
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self.lock:
+            item = self.read(TableName, self.key_of(TableName, Key))
+        item = self.project(item, ProjectionExpression, ExpressionAttributeNames)
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                previous = self.read(TableName, self.key_of(TableName, Item))
+                if ConditionExpression and not self.condition_matches(
+                        previous, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues or {}):
+                    raise self.exceptions.ConditionalCheckFailedException('The conditional request failed')
+                self.write(TableName, Item)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return {'Attributes': previous} if ReturnValues == 'ALL_OLD' and previous is not None else {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        key = self.key_of(TableName, Key)
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                if ConditionExpression and not self.condition_matches(
+                        self.read(TableName, key), ConditionExpression, ExpressionAttributeNames,
+                        ExpressionAttributeValues or {}):
+                    raise self.exceptions.ConditionalCheckFailedException('The conditional request failed')
+                self.remove(TableName, key)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, ReturnValues=None, **kwargs):
+        key = self.key_of(TableName, Key)
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                current = self.read(TableName, key)
+                if ConditionExpression and not self.condition_matches(
+                        current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues or {}):
+                    raise self.exceptions.ConditionalCheckFailedException('The conditional request failed')
+                item = self.apply_update(dict(current or Key), UpdateExpression, ExpressionAttributeNames,
+                                         ExpressionAttributeValues or {})
+                self.write(TableName, item)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return {'Attributes': item} if ReturnValues and ReturnValues != 'NONE' else {}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              ExclusiveStartKey=None, Limit=None, ScanIndexForward=True, ProjectionExpression=None,
+              FilterExpression=None, **kwargs):
+        names = ExpressionAttributeNames
+        values = ExpressionAttributeValues
+        condition = re.fullmatch(r'\s*(\S+)\s*=\s*(:\w+)\s*(?:AND\s+(.+))?', KeyConditionExpression,
+                                 flags=re.IGNORECASE)
+        if not condition:
+            raise ValueError(f'Unsupported key condition "{KeyConditionExpression}"')
+        where = ['pk = ?']
+        parameters = [str(attribute_value(values[condition.group(2)]))]
+        range_condition = condition.group(3)
+        range_condition = range_condition.strip() if range_condition else None
+        begins_with = between = comparison = None
+        if range_condition:
+            begins_with = re.fullmatch(r'begins_with\(\s*(\S+?)\s*,\s*(:\w+)\s*\)', range_condition)
+            between = re.fullmatch(r'(\S+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)', range_condition, flags=re.IGNORECASE)
+            comparison = re.fullmatch(r'(\S+)\s*(=|<=|<|>=|>)\s*(:\w+)', range_condition)
+            if not (begins_with or between or comparison):
+                raise ValueError(f'Unsupported key condition "{KeyConditionExpression}"')
+        # the sort key column holds text, so a number range key is compared and ordered as a number
+        operands = []
+        if between:
+            operands = [values[between.group(2)], values[between.group(3)]]
+        elif comparison:
+            operands = [values[comparison.group(3)]]
+        if ExclusiveStartKey and len(self.tables[TableName]) > 1:
+            operands.append(ExclusiveStartKey[self.tables[TableName][1]])
+        sort_key = 'CAST(sk AS REAL)' if self.number_range_key(TableName, parameters[0], operands) else 'sk'
+        if begins_with:
+            where.append('substr(sk, 1, length(?)) = ?')
+            prefix = str(attribute_value(values[begins_with.group(2)]))
+            parameters += [prefix, prefix]
+        elif between:
+            where.append(f'{sort_key} BETWEEN ? AND ?')
+            parameters += [str(attribute_value(values[between.group(2)])),
+                           str(attribute_value(values[between.group(3)]))]
+        elif comparison:
+            where.append(f'{sort_key} {comparison.group(2)} ?')
+            parameters.append(str(attribute_value(values[comparison.group(3)])))
+        if ExclusiveStartKey:
+            where.append(f'{sort_key} > ?' if ScanIndexForward else f'{sort_key} < ?')
+            parameters.append(self.key_of(TableName, ExclusiveStartKey)[1])
+        order = 'ASC' if ScanIndexForward else 'DESC'
+        return self.page(TableName, ' AND '.join(where), parameters, f'{sort_key} {order}', Limit,
+                         ProjectionExpression, FilterExpression, names, values)
+
+    def number_range_key(self, table_name, pk, operands):
+        # whether the range key of the table is a number, from the values it is compared with or,
+        # when there are none, from an item of the partition
+        key_names = self.tables[table_name]
+        if len(key_names) < 2:
+            return False
+        if operands:
+            return 'N' in operands[0]
+        with self.lock:
+            row = self.connection.execute(f'SELECT item FROM "{table_name}" WHERE pk = ? LIMIT 1', [pk]).fetchone()
+        return row is not None and 'N' in load_item(row[0])[key_names[1]]
+
+    def scan(self, TableName, Segment=None, TotalSegments=None, ExclusiveStartKey=None, Limit=None,
+             ProjectionExpression=None, FilterExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, **kwargs):
+        where = ['1']
+        parameters = []
+        if TotalSegments:
+            where.append('segment(pk, ?) = ?')
+            parameters += [TotalSegments, Segment]
+        if ExclusiveStartKey:
+            where.append('(pk, sk) > (?, ?)')
+            parameters += list(self.key_of(TableName, ExclusiveStartKey))
+        return self.page(TableName, ' AND '.join(where), parameters, 'pk, sk', Limit, ProjectionExpression,
+                         FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues or {})
+
+    def page(self, table_name, where, parameters, order, limit, projection, filter_expression, names, values):
+        # one page of a query or scan, the limit applies before the filter as it does in DynamoDB
+        limit = limit or self.PAGE_SIZE
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT item FROM "{table_name}" WHERE {where} ORDER BY {order} LIMIT ?', parameters + [limit + 1]
+            ).fetchall()
+        items = [load_item(row[0]) for row in rows[:limit]]
+        result = {'Items': [self.project(item, projection, names) for item in items
+                            if self.condition_matches(item, filter_expression, names, values)]}
+        result['Count'] = len(result['Items'])
+        if len(rows) > limit:
+            key_names = self.tables[table_name]
+            result['LastEvaluatedKey'] = {name: items[-1][name] for name in key_names}
+        return result
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            items = []
+            with self.lock:
+                for key in request['Keys']:
+                    item = self.read(table_name, self.key_of(table_name, key))
+                    if item is not None:
+                        items.append(self.project(item, request.get('ProjectionExpression'),
+                                                  request.get('ExpressionAttributeNames')))
+            responses[table_name] = items
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                for table_name, requests in RequestItems.items():
+                    for request in requests:
+                        if 'PutRequest' in request:
+                            self.write(table_name, request['PutRequest']['Item'])
+                        else:
+                            self.remove(table_name, self.key_of(table_name, request['DeleteRequest']['Key']))
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return {'UnprocessedItems': {}}
+
+    # joins
+
+    def totals_query(self, source, where):
+        # joining food items to their legs and the routes of those legs, adding up each item's totals
+        # and picking out any leg whose route is missing
+        return (
+            f'SELECT {source}, i.pk IS NOT NULL, TOTAL(n.distance), TOTAL(n.emissions), TOTAL(n.lead_time), '
+            f"MIN(CASE WHEN l.position IS NOT NULL AND n.origin IS NULL "
+            f"THEN l.leg_origin || char(0) || l.leg_destination END) "
+            f'FROM {where} '
+            f'LEFT JOIN "{self.item_table}" i ON i.pk = w.name AND i.sk = w.origin '
+            f'LEFT JOIN "{self.legs_table}" l ON l.name = w.name AND l.origin = w.origin '
+            f'LEFT JOIN "{self.route_numbers_table}" n ON n.origin = l.leg_origin '
+            f'AND n.destination = l.leg_destination '
+        )
+
+    def check_totals(self, name, origin, found, missing_leg):
+        if not found:
+            raise NotFoundError(f'Could not find food item with name "{name}" and origin "{origin}"')
+        if missing_leg is not None:
+            route_origin, route_destination = missing_leg.split('\0')
+            raise NotFoundError(
+                f'Could not find route with origin "{route_origin}" and destination "{route_destination}"')
+
+    def item_totals(self, item_keys):
+        item_keys = list(dict.fromkeys(item_keys))
+        item_totals = {}
+        for i in range(0, len(item_keys), self.JOIN_CHUNK):
+            chunk = item_keys[i:i + self.JOIN_CHUNK]
+            wanted = ', '.join(['(?, ?)'] * len(chunk))
+            with self.lock:
+                rows = self.connection.execute(
+                    f'WITH w(name, origin) AS (VALUES {wanted}) ' +
+                    self.totals_query('w.name, w.origin', 'w') + 'GROUP BY w.name, w.origin',
+                    [value for key in chunk for value in key]
+                ).fetchall()
+            for name, origin, found, distance, emissions, lead_time, missing_leg in rows:
+                self.check_totals(name, origin, found, missing_leg)
+                item_totals[(name, origin)] = {'name': name, 'origin': origin, 'distance': whole(distance),
+                                               'emissions': whole(emissions), 'lead_time': whole(lead_time)}
+        return item_totals
+
+    def list_item_totals(self, user_id):
+        # the whole shopping list, with every item resolved to its totals, in one statement
+        with self.lock:
+            rows = self.connection.execute(
+                f'WITH w AS (SELECT s.item AS list_item, s.sk AS item_id, '
+                f"substr(s.sk, 1, instr(s.sk, ',') - 1) AS name, substr(s.sk, instr(s.sk, ',') + 1) AS origin "
+                f'FROM "{self.shopping_list_table}" s WHERE s.pk = ?) ' +
+                self.totals_query('w.list_item, w.name, w.origin', 'w') + 'GROUP BY w.item_id ORDER BY w.item_id',
+                [user_id]
+            ).fetchall()
+        list_items = []
+        for list_item, name, origin, found, distance, emissions, lead_time, missing_leg in rows:
+            self.check_totals(name, origin, found, missing_leg)
+            list_items.append((load_item(list_item), {
+                'name': name, 'origin': origin, 'distance': whole(distance),
+                'emissions': whole(emissions), 'lead_time': whole(lead_time)}))
+        return list_items
+
+    def journey(self, name, origin):
+        # a food item and the route of each leg of its journey in order, in one statement
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT i.item, l.leg_origin, l.leg_destination, r.item FROM "{self.item_table}" i '
+                f'LEFT JOIN "{self.legs_table}" l ON l.name = i.pk AND l.origin = i.sk '
+                f'LEFT JOIN "{self.route_table}" r ON r.pk = l.leg_origin AND r.sk = l.leg_destination '
+                f'WHERE i.pk = ? AND i.sk = ? ORDER BY l.position',
+                [name, origin]
+            ).fetchall()
+        if not rows:
+            return None, []
+        routes = []
+        for _, route_origin, route_destination, route in rows:
+            if route_origin is None:
+                continue
+            if route is None:
+                raise NotFoundError(
+                    f'Could not find route with origin "{route_origin}" and destination "{route_destination}"')
+            routes.append(load_item(route))
+        return load_item(rows[0][0]), routes
+
+
+def split_top_level(body):
+    # splitting the actions of an update clause on the commas that are not inside brackets
+    parts = []
+    depth = 0
+    current = ''
+    for character in body:
+        if character == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += character == '('
+        depth -= character == ')'
+        current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def whole(number):
+    # totals of whole numbers are returned as ints like the rest of the api
+    return int(number) if float(number).is_integer() else number
+
+
+def create_storage(tables, item_table, route_table, shopping_list_table):
+    # choosing the backend with STORAGE_BACKEND, "dynamodb" (the default) or "sqlite"
+    backend = os.environ.get('STORAGE_BACKEND', 'dynamodb')
+    if backend == 'sqlite':
+        return SQLiteStorage(tables, item_table, route_table, shopping_list_table,
+                             os.environ.get('SQLITE_PATH', '/tmp/food-miles.sqlite3'))
+    if backend != 'dynamodb':
+        raise ValueError(f'Unknown STORAGE_BACKEND "{backend}"')
+    client = boto3.client('dynamodb')
+    if os.environ.get('IS_OFFLINE'):
+        client = boto3.client(
+            'dynamodb', region_name='localhost', endpoint_url='http://localhost:8000'
+        )
+    return DynamoDBStorage(tables, item_table, route_table, shopping_list_table, client)
@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+
+import boto3
+import pytest
+
+# the app reads its configuration when it is imported, so the tables and local directories are set first
+TEST_TABLES = {
+    'ITEM_TABLE': 'items',
+    'SHOPPING_LIST_TABLE': 'shoppingList',
+    'SAVED_LIST_TABLE': 'savedList',
+    'ROUTE_TABLE': 'routes',
+    'EMISSION_FACTOR_TABLE': 'emissionFactors',
+    'HEATMAP_TABLE': 'heatmap',
+    'STATS_TABLE': 'stats',
+    'CATALOGUE_TABLE': 'catalogue',
+    'JOURNEY_TABLE': 'journeys',
+}
+for variable, table in TEST_TABLES.items():
+    os.environ.setdefault(variable, table)
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'food-miles.sqlite3'))
+os.environ.setdefault('CATALOGUE_DIR', tempfile.mkdtemp())
+os.environ.setdefault('CATALOGUE_BUNDLE', os.path.join(tempfile.mkdtemp(), 'catalogue.bundle'))
+os.environ.setdefault('TILE_STORE_DIR', tempfile.mkdtemp())
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from catalogue import CatalogueStore  # noqa: E402
+from storage import DynamoDBStorage, SQLiteStorage  # noqa: E402
+from tiles import TileStore  # noqa: E402
+
+# every backend the tests run against; DynamoDB is emulated with moto, or reached at DYNAMODB_ENDPOINT
+# (such as DynamoDB Local) when that is set
+BACKENDS = ['sqlite', 'dynamodb']
+# a table of the storage tests whose range key is a number, every other key is a string like the app's tables
+NUMBERED_TABLE = 'numbered'
+STORAGE_TABLES = dict(app_module.TABLE_KEYS, **{NUMBERED_TABLE: ('pk', 'sk')})
+
+
+def mock_aws(service):
+    # moto 5 mocks every service together, earlier versions have a mock per service
+    try:
+        import moto
+    except ImportError:
+        pytest.skip('moto is not installed')
+    if hasattr(moto, 'mock_aws'):
+        return moto.mock_aws()
+    return getattr(moto, f'mock_{service}')()
+
+
+def attribute_types(table):
+    return ['S', 'N'] if table == NUMBERED_TABLE else ['S', 'S']
+
+
+def create_dynamodb_tables(client, tables):
+    # creating each table with the same keys as serverless.yml, every key attribute a string but the range key
+    # of the numbered table
+    existing = set(client.list_tables()['TableNames'])
+    for table, key_names in tables.items():
+        if table in existing:
+            client.delete_table(TableName=table)
+            client.get_waiter('table_not_exists').wait(TableName=table)
+        key_types = ['HASH', 'RANGE']
+        client.create_table(
+            TableName=table,
+            KeySchema=[{'AttributeName': name, 'KeyType': key_type} for name, key_type in zip(key_names, key_types)],
+            AttributeDefinitions=[{'AttributeName': name, 'AttributeType': key_type}
+                                  for name, key_type in zip(key_names, attribute_types(table))],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        client.get_waiter('table_exists').wait(TableName=table)
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, tmp_path):
+    tables = STORAGE_TABLES
+    if request.param == 'sqlite':
+        yield SQLiteStorage(tables, app_module.ITEM_TABLE, app_module.ROUTE_TABLE, app_module.SHOPPING_LIST_TABLE,
+                            str(tmp_path / 'food-miles.sqlite3'))
+        return
+    endpoint = os.environ.get('DYNAMODB_ENDPOINT')
+    if endpoint:
+        client = boto3.client('dynamodb', endpoint_url=endpoint)
+        create_dynamodb_tables(client, tables)
+        yield DynamoDBStorage(tables, app_module.ITEM_TABLE, app_module.ROUTE_TABLE,
+                              app_module.SHOPPING_LIST_TABLE, client)
+        return
+    with mock_aws('dynamodb'):
+        client = boto3.client('dynamodb')
+        create_dynamodb_tables(client, tables)
+        yield DynamoDBStorage(tables, app_module.ITEM_TABLE, app_module.ROUTE_TABLE,
+                              app_module.SHOPPING_LIST_TABLE, client)
+
+
+@pytest.fixture
+def app(storage, monkeypatch, tmp_path):
+    # the app on a fresh backend, with none of what earlier tests cached in the module
+    monkeypatch.setattr(app_module, 'storage', storage)
+    for name in ('route_snapshot', 'route_graph', 'place_indexes', 'route_box_index', 'emission_factors',
+                 'catalogue', 'catalogue_build', 'bundle', 'dependencies_version', 'global_sketches',
+                 'item_filter', 'item_filter_version'):
+        monkeypatch.setattr(app_module, name, None)
+    for name in ('route_snapshot_loaded_at', 'emission_factors_loaded_at', 'catalogue_checked_at',
+                 'catalogue_version', 'catalogue_min_version', 'bundle_checked_at', 'global_sketches_read_at'):
+        monkeypatch.setattr(app_module, name, 0)
+    monkeypatch.setattr(app_module, 'bundle_opened', False)
+    monkeypatch.setattr(app_module, 'bundle_changes', {'item': set(), 'route': set(), 'all': False})
+    monkeypatch.setattr(app_module, 'local_changes', {'item': set(), 'route': set(), 'all': False})
+    monkeypatch.setattr(app_module, 'catalogue_store', CatalogueStore(str(tmp_path / 'catalogue')))
+    monkeypatch.setattr(app_module, 'tile_store', TileStore(str(tmp_path / 'tiles')))
+    # reading the version item on every request, so writes are seen straight away
+    monkeypatch.setattr(app_module, 'CATALOGUE_CHECK_INTERVAL', -1)
+    # catalogues are built in a background thread, which would outlive the backend of the test
+    monkeypatch.setattr(app_module, 'start_catalogue_build', lambda version: None)
+    app_module.dependency_index.clear()
+    return app_module
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def route(origin, destination, origin_lat_lng, destination_lat_lng, transport_mode='truck', lead_time=1, **extra):
+    # the body of a POST /route with a straight leg between the two places
+    body = {'origin': origin, 'destination': destination,
+            'origin_lat_lng': f'{origin_lat_lng[0]},{origin_lat_lng[1]}',
+            'destination_lat_lng': f'{destination_lat_lng[0]},{destination_lat_lng[1]}',
+            'lead_time': str(lead_time), 'transport_mode': transport_mode, 'emissions': '10',
+            'coordinates': [list(origin_lat_lng), list(destination_lat_lng)]}
+    body.update(extra)
+    return body
+
+
+VALENCIA = (39.47, -0.38)
+MADRID = (40.42, -3.70)
+CORK = (51.9, -8.47)
+DUBLIN = (53.35, -6.26)
+
+
+@pytest.fixture
+def seeded(client):
+    # a small network: oranges from Valencia by road and sea, milk and oranges from Cork by road
+    client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.1, 'ship': 0.02}})
+    for body in (route('Valencia', 'Madrid', VALENCIA, MADRID),
+                 route('Madrid', 'Dublin', MADRID, DUBLIN, 'ship', 3),
+                 route('Cork', 'Dublin', CORK, DUBLIN),
+                 route('Valencia', 'Dublin', VALENCIA, DUBLIN, 'plane', emissions='900')):
+        assert client.post('/route', json=body).status_code == 200
+    for name, origin, legs in (('Oranges', 'Valencia', [('Valencia', 'Madrid'), ('Madrid', 'Dublin')]),
+                               ('Milk', 'Cork', [('Cork', 'Dublin')]),
+                               ('Oranges', 'Cork', [('Cork', 'Dublin')])):
+        response = client.post('/food/item', json={'name': name, 'origin': origin, 'legs': [
+            {'origin': leg_origin, 'destination': leg_destination} for leg_origin, leg_destination in legs]})
+        assert response.status_code == 200
+    return client
@@ -0,0 +1,319 @@
+import gzip
+import json
+
+from conftest import CORK, DUBLIN, MADRID, VALENCIA, route
+from storage import SQLiteStorage
+from tiles import tiles_for_line
+
+# the endpoints run against every backend with the seeded network of conftest.py
+
+
+def test_create_and_get_item(client):
+    legs = [{'origin': 'Cork', 'destination': 'Dublin'}]
+    assert client.post('/food/item', json={'name': 'Milk', 'origin': 'Cork', 'legs': legs}).status_code == 200
+    response = client.get('/food/item/Milk/Cork')
+    assert response.status_code == 200
+    assert response.get_json() == {'name': 'Milk', 'origin': 'Cork', 'legs': legs}
+    assert client.get('/food/item/Milk/Kerry').status_code == 404
+    assert client.post('/food/item', json={'name': 'Milk', 'origin': 'Cork'}).status_code == 400
+
+
+def test_get_route(seeded):
+    response = seeded.get('/route/oranges/valencia')
+    assert response.status_code == 200
+    legs, distance, emissions, lead_time, points, name, origin = response.get_json()
+    assert [(leg['origin'], leg['destination']) for leg in legs] == [('Valencia', 'Madrid'), ('Madrid', 'Dublin')]
+    assert distance['total_distance'] == sum(int(leg['distance']) for leg in legs)
+    assert emissions['total_emissions'] == sum(int(leg['emissions']) for leg in legs)
+    assert lead_time == {'total_lead_time': 4}
+    assert len(points['points']) == 3
+    assert (name, origin) == ({'name': 'Oranges'}, {'origin': 'Valencia'})
+
+
+def test_get_route_gzip(seeded):
+    plain = seeded.get('/route/Oranges/Valencia')
+    compressed = seeded.get('/route/Oranges/Valencia', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.get_json()
+
+
+def test_get_route_not_found(seeded):
+    response = seeded.get('/route/Oranges/Kerry')
+    assert response.status_code == 404
+    assert {'name': 'Oranges', 'origin': 'Valencia'} in response.get_json()['suggestions']
+
+
+def test_get_route_after_route_changes(seeded):
+    before = seeded.get('/route/Milk/Cork').get_json()
+    assert before[2] == {'total_emissions': int(before[0][0]['emissions'])}
+    # the cached response is dropped when one of its legs is written
+    assert seeded.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, 'ship', 2)).status_code == 200
+    after = seeded.get('/route/Milk/Cork').get_json()
+    assert after[0][0]['transport_mode'] == 'ship'
+    assert after[3] == {'total_lead_time': 2}
+
+
+def test_add_route_distance(client):
+    client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.1}})
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, distance='lots')).status_code == 400
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, distance='5000')).status_code == 400
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, lead_time='soon')).status_code == 400
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, distance='220')).status_code == 200
+    # a leg whose coordinates all sit on one spot keeps the distance provided
+    assert client.post('/route', json=route('Cork', 'Cork', CORK, CORK, distance='12')).status_code == 200
+    client.post('/food/item', json={'name': 'Milk', 'origin': 'Cork', 'legs': [
+        {'origin': 'Cork', 'destination': 'Cork'}, {'origin': 'Cork', 'destination': 'Dublin'}]})
+    assert [leg['distance'] for leg in client.get('/route/Milk/Cork').get_json()[0]] == ['12', '220']
+
+
+def test_add_route_emissions(client):
+    client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.1}})
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, 'plane', emissions='')).status_code == 400
+    assert client.post('/route', json=route('Cork', 'Dublin', CORK, DUBLIN, distance='200')).status_code == 200
+    client.post('/food/item', json={'name': 'Milk', 'origin': 'Cork', 'legs': [
+        {'origin': 'Cork', 'destination': 'Dublin'}]})
+    assert client.get('/route/Milk/Cork').get_json()[0][0]['emissions'] == '20'
+
+
+def test_emission_factors(client):
+    assert client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.1}}).status_code == 200
+    assert client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.2}}).status_code == 409
+    assert client.post('/emissionFactors', json={'version': 'v2', 'factors': {'truck': 'x'}}).status_code == 400
+    assert client.get('/emissionFactors').get_json() == {'version': 'v1', 'factors': {'truck': 0.1}}
+    assert client.get('/emissionFactors/v9').status_code == 404
+
+
+def test_food_origins(seeded):
+    response = seeded.get('/food/oranges/origins')
+    assert response.status_code == 200
+    origins = response.get_json()['origins']
+    assert sorted(origin['origin'] for origin in origins) == ['Cork', 'Valencia']
+    assert origins == sorted(origins, key=lambda totals: (totals['emissions'], totals['origin']))
+    assert seeded.get('/food/Bananas/origins').status_code == 404
+
+
+def test_shopping_list(seeded):
+    for name, origin in (('Oranges', 'Valencia'), ('Milk', 'Cork')):
+        response = seeded.post('/shoppingList/item', json={'userId': 'ann', 'name': name, 'origin': origin})
+        assert response.get_json() == {'userId': 'ann', 'itemId': f'{name},{origin}'}
+    items, distance, emissions, lead_time = seeded.get('/shoppingList/details/ann').get_json()
+    assert sorted(item['itemId']['S'] for item in items) == ['Milk,Cork', 'Oranges,Valencia']
+    assert emissions['total_emissions'] == sum(item['itemDetails']['emissions'] for item in items)
+    assert lead_time == {'total_lead_time': 5}
+    seeded.delete('/shoppingList/delete', json={'userId': 'ann', 'name': 'Milk', 'origin': 'Cork'})
+    items = seeded.get('/shoppingList/details/ann').get_json()[0]
+    assert [item['itemId']['S'] for item in items] == ['Oranges,Valencia']
+
+
+def test_shopping_list_with_a_catalogue(seeded, app, monkeypatch):
+    seeded.post('/shoppingList/item', json={'userId': 'ann', 'name': 'Oranges', 'origin': 'Valencia'})
+    expected = seeded.get('/shoppingList/details/ann').get_json()
+    app.build_catalogue(app.load_catalogue_version())
+    joins = []
+    list_item_totals = app.storage.list_item_totals
+    monkeypatch.setattr(app.storage, 'list_item_totals', lambda user_id: joins.append(user_id) or
+                        list_item_totals(user_id))
+    # SQLite resolves the list with its single join even when there is a catalogue
+    assert seeded.get('/shoppingList/details/ann').get_json() == expected
+    assert joins == (['ann'] if isinstance(app.storage, SQLiteStorage) else [])
+
+
+def test_catalogue_totals_match_storage(seeded, app):
+    # the api writes whole numbers, but a route written to the table directly may have fractions
+    key = {'origin': {'S': 'Cork'}, 'destination': {'S': 'Dublin'}}
+    fractional = dict(app.storage.get_item(TableName=app.ROUTE_TABLE, Key=key)['Item'], emissions={'N': '2.75'})
+    app.storage.put_item(TableName=app.ROUTE_TABLE, Item=fractional)
+    app.build_catalogue(app.load_catalogue_version())
+    keys = [('Milk', 'Cork'), ('Oranges', 'Valencia')]
+    assert app.catalogue.item_totals(keys) == app.storage.item_totals(keys)
+    assert app.catalogue.item_totals(keys)[('Milk', 'Cork')]['emissions'] == 2.75
+
+
+def test_shopping_list_origin_with_comma(client):
+    # the item id is split at the first comma, so an origin with a comma is found on every backend
+    client.post('/emissionFactors', json={'version': 'v1', 'factors': {'truck': 0.1}})
+    client.post('/route', json=route('Cork, Ireland', 'Dublin', CORK, DUBLIN))
+    client.post('/food/item', json={'name': 'Milk', 'origin': 'Cork, Ireland', 'legs': [
+        {'origin': 'Cork, Ireland', 'destination': 'Dublin'}]})
+    client.post('/shoppingList/item', json={'userId': 'ann', 'name': 'Milk', 'origin': 'Cork, Ireland'})
+    items = client.get('/shoppingList/details/ann').get_json()[0]
+    assert [item['itemDetails']['origin'] for item in items] == ['Cork, Ireland']
+    response = client.get('/shoppingList/optimize/ann')
+    assert response.status_code == 200
+    assert response.get_json()['items'][0]['current']['origin'] == 'Cork, Ireland'
+
+
+def test_optimize(seeded):
+    seeded.post('/shoppingList/item', json={'userId': 'ann', 'name': 'Oranges', 'origin': 'Valencia'})
+    response = seeded.get('/shoppingList/optimize/ann')
+    assert response.status_code == 200
+    [item] = response.get_json()['items']
+    assert item['optimal']['emissions'] <= item['current']['emissions']
+    assert seeded.get('/shoppingList/optimize/ann?max_item_lead_time=0').status_code == 400
+    assert seeded.get('/shoppingList/optimize/ann?max_lead_time=soon').status_code == 400
+    assert seeded.get('/shoppingList/optimize/ann?max_lead_time=-1').status_code == 400
+    assert seeded.get('/shoppingList/optimize/ann?max_item_lead_time=-1').status_code == 400
+
+
+def test_shopping_list_batch(seeded):
+    operations = [{'op': 'add', 'name': 'Milk', 'origin': 'Cork'},
+                  {'op': 'add', 'name': 'Oranges', 'origin': 'Valencia'},
+                  {'op': 'delete', 'name': 'Milk', 'origin': 'Cork'},
+                  {'op': 'add', 'name': 'Oranges', 'origin': 'Cork'}]
+    response = seeded.post('/shoppingList/items:batch', json={'userId': 'ann', 'operations': operations})
+    assert [result['status'] for result in response.get_json()['results']] == [
+        'superseded', 'added', 'deleted', 'added']
+    items = seeded.get('/shoppingList/details/ann').get_json()[0]
+    assert sorted(item['itemId']['S'] for item in items) == ['Oranges,Cork', 'Oranges,Valencia']
+    response = seeded.post('/shoppingList/items:batch', json={'userId': 'ann', 'operations': [
+        {'op': 'delete', 'name': 'Oranges', 'origin': 'Cork'}, {'op': 'move', 'name': 'Milk', 'origin': 'Cork'}]})
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['index'] == 1
+    assert len(seeded.get('/shoppingList/details/ann').get_json()[0]) == 2
+
+
+def test_batch_get_items(seeded):
+    response = seeded.post('/food/items:batchGet', json={'keys': [
+        {'name': 'Milk', 'origin': 'Cork'}, {'name': 'Milk', 'origin': 'Kerry'}, {'name': 'Milk', 'origin': 'Cork'}]})
+    results = response.get_json()['results']
+    assert results[0]['item']['legs'] == [{'origin': 'Cork', 'destination': 'Dublin'}]
+    assert 'error' in results[1]
+    assert results[2] == results[0]
+    assert seeded.post('/food/items:batchGet', json={'keys': []}).status_code == 400
+    assert seeded.post('/food/items:batchGet', json={'keys': [{'name': 'Milk'}]}).status_code == 400
+
+
+def test_batch_get_routes(seeded):
+    response = seeded.post('/route:batchGet', json={'keys': [
+        {'name': 'oranges', 'origin': 'valencia'}, {'name': 'Tea', 'origin': 'Kenya'}]})
+    results = response.get_json()['results']
+    assert results[0]['route'] == seeded.get('/route/Oranges/Valencia').get_json()
+    assert results[1]['name'] == 'Tea' and 'error' in results[1]
+
+
+def test_route_queries(seeded):
+    response = seeded.get('/route/path?from=valencia&to=Dublin&minimize=emissions')
+    assert [(leg['origin'], leg['destination']) for leg in response.get_json()['legs']] == [
+        ('Valencia', 'Madrid'), ('Madrid', 'Dublin')]
+    assert seeded.get('/route/path?from=Dublin&to=Valencia').status_code == 404
+    response = seeded.get('/route/bbox?minLat=38&minLng=-10&maxLat=54&maxLng=0')
+    assert len(response.get_json()['legs']) == 4
+    response = seeded.get('/route/bbox?minLat=50&minLng=-10&maxLat=54&maxLng=-7')
+    assert [(leg['origin'], leg['destination']) for leg in response.get_json()['legs']] == [('Cork', 'Dublin')]
+    response = seeded.get(f'/route/nearby?lat={MADRID[0]}&lng={MADRID[1]}&radius=50')
+    assert [place['name'] for place in response.get_json()['places']] == ['Madrid']
+
+
+def test_tiles(seeded):
+    assert seeded.get('/tiles/0/1/0').status_code == 404
+    [(zoom, x, y)] = tiles_for_line([VALENCIA], 6)
+    response = seeded.get(f'/tiles/{zoom}/{x}/{y}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'].startswith('public')
+    etag = response.headers['ETag']
+    assert seeded.get(f'/tiles/{zoom}/{x}/{y}', headers={'If-None-Match': etag}).status_code == 304
+    # a tile no leg crosses is sent empty and must not be kept
+    response = seeded.get(f'/tiles/{zoom}/{(x + 32) % 64}/{(y + 32) % 64}')
+    assert response.status_code == 204
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_cache_metrics(seeded):
+    seeded.get('/route/Oranges/Valencia')
+    seeded.get('/route/Oranges/Valencia')
+    metrics = seeded.get('/metrics/caches').get_json()
+    assert {'dependencies', 'caches', 'item_filter'} <= set(metrics)
+
+
+def test_item_filter_misses(seeded, app, monkeypatch):
+    app.build_catalogue(app.load_catalogue_version())
+    monkeypatch.setattr(app, 'CATALOGUE_CHECK_INTERVAL', 30)
+    reads = []
+    load_catalogue_version = app.load_catalogue_version
+    monkeypatch.setattr(app, 'load_catalogue_version', lambda: reads.append(1) or load_catalogue_version())
+    batch_gets = []
+    batch_get = app.storage.batch_get
+    monkeypatch.setattr(app.storage, 'batch_get', lambda table, *args, **kwargs: batch_gets.append(args[1]) or
+                        batch_get(table, *args, **kwargs))
+    # made up items are answered from the filter, checking the version again at most once
+    keys = [{'name': f'Made up {i}', 'origin': 'Nowhere'} for i in range(50)]
+    results = seeded.post('/food/items:batchGet', json={'keys': keys}).get_json()['results']
+    assert all('error' in result for result in results)
+    for i in range(20):
+        assert seeded.get(f'/route/Made up {i}/Nowhere').status_code == 404
+    assert len(reads) <= 1
+    assert batch_gets == [[]]
+    assert seeded.get('/metrics/caches').get_json()['item_filter']['rejected'] >= 70
+    assert seeded.get('/route/Milk/Cork').status_code == 200
+
+
+def test_item_filter_miss_checks_the_version(seeded, app, monkeypatch):
+    app.build_catalogue(app.load_catalogue_version())
+    assert seeded.get('/route/Milk/Cork').status_code == 200
+    monkeypatch.setattr(app, 'CATALOGUE_CHECK_INTERVAL', 30)
+    monkeypatch.setattr(app, 'ITEM_FILTER_RECHECK_INTERVAL', 0)
+    # an item written by another container is only in the change log, not in this container's filter
+    with monkeypatch.context() as context:
+        context.setattr(app, 'update_item_filter', lambda changes: None)
+        seeded.post('/food/item', json={'name': 'Butter', 'origin': 'Cork', 'legs': [
+            {'origin': 'Cork', 'destination': 'Dublin'}]})
+    assert ('Butter', 'Cork') not in app.item_filter
+    assert seeded.get('/route/Butter/Cork').status_code == 200
+
+
+def test_change_log(seeded, app, monkeypatch):
+    version = app.load_catalogue_version()
+    routes = [(f'Place {i}', 'Dublin') for i in range(2500)]
+    app.bump_catalogue_version('route', routes)
+    # one record for every thousand keys, each in the partition of its version
+    assert app.load_catalogue_version() == version + 3
+    changes = app.read_changes(version)
+    assert changes == {'item': set(), 'route': set(routes), 'all': False, 'version': version + 3}
+    assert app.read_changes(version + 3)['version'] == version + 3
+    import trim_changes
+    monkeypatch.setattr(trim_changes, 'storage', app.storage)
+    monkeypatch.setattr('sys.argv', ['trim_changes.py', '--version', str(version + 1)])
+    trim_changes.main()
+    assert app.read_changes(version + 1)['route'] == set(routes[1000:])
+    # what was written since a trimmed version can no longer be told apart
+    assert app.read_changes(version)['all']
+
+
+def test_recompute_emissions(seeded, app, monkeypatch):
+    import recompute_emissions
+    monkeypatch.setattr(recompute_emissions, 'storage', app.storage)
+    # the same factors under a new version leave the emissions as they are but not their version
+    seeded.post('/emissionFactors', json={'version': 'v2', 'factors': {'truck': 0.1, 'ship': 0.02}})
+    factor_version, factors = app.load_emission_factors('v2')
+    version = app.load_catalogue_version()
+    assert recompute_emissions.recompute_segment(0, 1, factor_version, factors, False) == (4, 3, 0)
+    routes = {(route['origin']['S'], route['destination']['S']): route
+              for route in app.storage.scan_table(app.ROUTE_TABLE)}
+    versions = {key: route.get('emission_factor_version', {}).get('S') for key, route in routes.items()}
+    assert versions == {('Valencia', 'Madrid'): 'v2', ('Madrid', 'Dublin'): 'v2', ('Cork', 'Dublin'): 'v2',
+                        ('Valencia', 'Dublin'): None}
+    assert app.read_changes(version)['route'] == {('Valencia', 'Madrid'), ('Madrid', 'Dublin'), ('Cork', 'Dublin')}
+    assert recompute_emissions.recompute_segment(0, 1, factor_version, factors, False) == (4, 0, 0)
+
+
+def test_route_changes_drop_their_rasters(seeded, app, monkeypatch):
+    monkeypatch.setattr(app, 'route_rasters', {})
+    app.update_heatmap(['Milk,Cork'])
+    old = {key: raster for key, raster in app.route_rasters.items() if key[0] == ('Cork', 'Dublin')}
+    assert old
+    # the leg is written again along a different path
+    body = route('Cork', 'Dublin', CORK, DUBLIN, coordinates=[list(CORK), [52.7, -9.5], list(DUBLIN)])
+    assert seeded.post('/route', json=body).status_code == 200
+    assert not any(key[0] == ('Cork', 'Dublin') for key in app.route_rasters)
+    app.update_heatmap(['Milk,Cork'])
+    assert any(str(app.route_rasters[key][0]) != str(raster[0]) for key, raster in old.items())
+
+
+def test_route_changes_invalidate_their_users(seeded, app):
+    seeded.get('/route/Milk/Cork')
+    seeded.get('/route/Oranges/Valencia')
+    assert {key[:2] for key in app.route_response_cache.entries} == {('Milk', 'Cork'), ('Oranges', 'Valencia')}
+    # as a recompute records the routes it wrote
+    app.bump_catalogue_version('route', [('Madrid', 'Dublin'), ('Nowhere', 'Dublin')])
+    assert {key[:2] for key in app.route_response_cache.entries} == {('Milk', 'Cork')}
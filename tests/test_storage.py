@@ -0,0 +1,194 @@
+import pytest
+
+import app as app_module
+from conftest import NUMBERED_TABLE
+from storage import NotFoundError
+
+# the DynamoDB style calls the app makes, run against every backend so the SQLite emulation of
+# condition, update, key condition, filter and projection expressions behaves like DynamoDB
+
+ROUTES = app_module.ROUTE_TABLE
+CATALOGUE = app_module.CATALOGUE_TABLE
+ITEMS = app_module.ITEM_TABLE
+
+
+def route_key(origin, destination):
+    return {'origin': {'S': origin}, 'destination': {'S': destination}}
+
+
+def put_route(storage, origin, destination, **attributes):
+    item = dict(route_key(origin, destination), **attributes)
+    storage.put_item(TableName=ROUTES, Item=item)
+    return item
+
+
+def test_put_and_get_item(storage):
+    item = put_route(storage, 'Cork', 'Dublin', distance={'N': '250'}, transport_mode={'S': 'truck'},
+                     coordinates={'L': [{'L': [{'N': '51.9'}, {'N': '-8.47'}]}]})
+    assert storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'))['Item'] == item
+    assert 'Item' not in storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Galway'))
+
+
+def test_get_item_projection(storage):
+    put_route(storage, 'Cork', 'Dublin', distance={'N': '250'}, emissions={'N': '20'})
+    result = storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'),
+                              ProjectionExpression='#origin, #distance',
+                              ExpressionAttributeNames={'#origin': 'origin', '#distance': 'distance'})
+    assert result['Item'] == {'origin': {'S': 'Cork'}, 'distance': {'N': '250'}}
+
+
+def test_conditional_put(storage):
+    put_route(storage, 'Cork', 'Dublin', distance={'N': '250'})
+    with pytest.raises(storage.exceptions.ConditionalCheckFailedException):
+        storage.put_item(TableName=ROUTES, Item=dict(route_key('Cork', 'Dublin'), distance={'N': '1'}),
+                         ConditionExpression='attribute_not_exists(origin)')
+    storage.put_item(TableName=ROUTES, Item=dict(route_key('Cork', 'Galway'), distance={'N': '1'}),
+                     ConditionExpression='attribute_not_exists(origin)')
+    assert storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'))['Item']['distance'] == {'N': '250'}
+
+
+def test_versioned_put(storage):
+    # the optimistic concurrency the sketches are written with
+    condition = 'attribute_not_exists(#version) OR #version = :version'
+    key = {'pk': {'S': 'sketch'}, 'sk': {'S': '0'}}
+    storage.put_item(TableName=CATALOGUE, Item=dict(key, version={'N': '1'}), ConditionExpression=condition,
+                     ExpressionAttributeNames={'#version': 'version'},
+                     ExpressionAttributeValues={':version': {'N': '0'}})
+    storage.put_item(TableName=CATALOGUE, Item=dict(key, version={'N': '2'}), ConditionExpression=condition,
+                     ExpressionAttributeNames={'#version': 'version'},
+                     ExpressionAttributeValues={':version': {'N': '1'}})
+    with pytest.raises(storage.exceptions.ConditionalCheckFailedException):
+        storage.put_item(TableName=CATALOGUE, Item=dict(key, version={'N': '2'}), ConditionExpression=condition,
+                         ExpressionAttributeNames={'#version': 'version'},
+                         ExpressionAttributeValues={':version': {'N': '1'}})
+
+
+def test_update_add_and_set(storage):
+    key = {'pk': {'S': 'catalogue'}, 'sk': {'S': 'version'}}
+    for expected in ('1', '2'):
+        result = storage.update_item(TableName=CATALOGUE, Key=key, UpdateExpression='ADD #version :one',
+                                     ExpressionAttributeNames={'#version': 'version'},
+                                     ExpressionAttributeValues={':one': {'N': '1'}}, ReturnValues='UPDATED_NEW')
+        assert result['Attributes']['version'] == {'N': expected}
+    storage.update_item(TableName=CATALOGUE, Key=key, UpdateExpression='SET #kind = :kind, #count = :count',
+                        ExpressionAttributeNames={'#kind': 'kind', '#count': 'count'},
+                        ExpressionAttributeValues={':kind': {'S': 'all'}, ':count': {'N': '3'}})
+    item = storage.get_item(TableName=CATALOGUE, Key=key)['Item']
+    assert item['version'] == {'N': '2'}
+    assert item['kind'] == {'S': 'all'}
+    assert item['count'] == {'N': '3'}
+
+
+def test_conditional_update(storage):
+    put_route(storage, 'Cork', 'Dublin', emissions={'N': '20'})
+    update = dict(TableName=ROUTES, Key=route_key('Cork', 'Dublin'), UpdateExpression='SET #emissions = :new',
+                  ConditionExpression='#emissions = :old', ExpressionAttributeNames={'#emissions': 'emissions'})
+    storage.update_item(ExpressionAttributeValues={':new': {'N': '30'}, ':old': {'N': '20'}}, **update)
+    with pytest.raises(storage.exceptions.ConditionalCheckFailedException):
+        storage.update_item(ExpressionAttributeValues={':new': {'N': '40'}, ':old': {'N': '20'}}, **update)
+    assert storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'))['Item']['emissions'] == {'N': '30'}
+
+
+def test_delete_item(storage):
+    put_route(storage, 'Cork', 'Dublin')
+    storage.delete_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'))
+    assert 'Item' not in storage.get_item(TableName=ROUTES, Key=route_key('Cork', 'Dublin'))
+
+
+@pytest.fixture
+def change_log(storage):
+    for version in range(1, 13):
+        storage.put_item(TableName=CATALOGUE, Item={'pk': {'S': 'log'}, 'sk': {'S': str(version).zfill(4)},
+                                                    'version': {'N': str(version)}})
+    storage.put_item(TableName=CATALOGUE, Item={'pk': {'S': 'other'}, 'sk': {'S': '0005'}})
+    return storage
+
+
+def sort_keys(items):
+    return [item['sk']['S'] for item in items]
+
+
+@pytest.mark.parametrize('condition, values, expected', [
+    ('pk = :pk', {}, [str(version).zfill(4) for version in range(1, 13)]),
+    ('pk = :pk AND sk > :sk', {':sk': {'S': '0010'}}, ['0011', '0012']),
+    ('pk = :pk AND sk >= :sk', {':sk': {'S': '0011'}}, ['0011', '0012']),
+    ('pk = :pk AND sk < :sk', {':sk': {'S': '0003'}}, ['0001', '0002']),
+    ('pk = :pk AND sk BETWEEN :low AND :high', {':low': {'S': '0004'}, ':high': {'S': '0006'}},
+     ['0004', '0005', '0006']),
+    ('pk = :pk AND begins_with(sk, :prefix)', {':prefix': {'S': '001'}}, ['0010', '0011', '0012']),
+])
+def test_query_key_conditions(change_log, condition, values, expected):
+    items = change_log.query_table(CATALOGUE, KeyConditionExpression=condition,
+                                   ExpressionAttributeValues=dict(values, **{':pk': {'S': 'log'}}))
+    assert sort_keys(items) == expected
+
+
+def test_query_pages_and_order(change_log):
+    result = change_log.query(TableName=CATALOGUE, KeyConditionExpression='pk = :pk', Limit=5,
+                              ExpressionAttributeValues={':pk': {'S': 'log'}}, ScanIndexForward=False)
+    assert sort_keys(result['Items']) == ['0012', '0011', '0010', '0009', '0008']
+    assert 'LastEvaluatedKey' in result
+    # query_table follows LastEvaluatedKey across every page
+    items = change_log.query_table(CATALOGUE, KeyConditionExpression='pk = :pk', Limit=5,
+                                   ExpressionAttributeValues={':pk': {'S': 'log'}})
+    assert len(list(items)) == 12
+
+
+@pytest.mark.parametrize('condition, values, expected', [
+    ('pk = :pk', {}, list(range(1, 13))),
+    ('pk = :pk AND sk > :sk', {':sk': {'N': '9'}}, [10, 11, 12]),
+    ('pk = :pk AND sk <= :sk', {':sk': {'N': '2'}}, [1, 2]),
+    ('pk = :pk AND sk BETWEEN :low AND :high', {':low': {'N': '8'}, ':high': {'N': '10'}}, [8, 9, 10]),
+])
+def test_query_number_range_keys(storage, condition, values, expected):
+    # number range keys are compared and ordered as numbers, 9 coming before 10
+    for version in range(1, 13):
+        storage.put_item(TableName=NUMBERED_TABLE, Item={'pk': {'S': 'log'}, 'sk': {'N': str(version)}})
+    items = storage.query_table(NUMBERED_TABLE, KeyConditionExpression=condition, Limit=2,
+                                ExpressionAttributeValues=dict(values, **{':pk': {'S': 'log'}}))
+    assert [int(item['sk']['N']) for item in items] == expected
+
+
+def test_scan_filter_expression(storage):
+    for name, origin in (('Milk', 'Cork'), ('Oranges', 'Cork'), ('Oranges', 'Valencia'), ('Tea', 'Kenya')):
+        storage.put_item(TableName=ITEMS, Item={'name': {'S': name}, 'origin': {'S': origin}})
+    items = storage.scan_table(ITEMS, FilterExpression='#name = :name OR origin = :origin',
+                               ExpressionAttributeNames={'#name': 'name'},
+                               ExpressionAttributeValues={':name': {'S': 'Oranges'}, ':origin': {'S': 'Cork'}})
+    assert sorted((item['name']['S'], item['origin']['S']) for item in items) == [
+        ('Milk', 'Cork'), ('Oranges', 'Cork'), ('Oranges', 'Valencia')]
+
+
+def test_parallel_scan_covers_every_item(storage):
+    for i in range(40):
+        put_route(storage, f'Place{i}', 'Dublin')
+    segments = [list(storage.scan_table(ROUTES, Segment=segment, TotalSegments=3)) for segment in range(3)]
+    keys = [item['origin']['S'] for segment in segments for item in segment]
+    assert sorted(keys) == sorted(f'Place{i}' for i in range(40))
+
+
+def test_batch_write_and_get(storage):
+    requests = [{'PutRequest': {'Item': dict(route_key(f'Place{i}', 'Dublin'), distance={'N': str(i)})}}
+                for i in range(60)]
+    assert storage.batch_write(ROUTES, requests) == []
+    assert storage.batch_write(ROUTES, [{'DeleteRequest': {'Key': route_key('Place0', 'Dublin')}}]) == []
+    keys = [(f'Place{i}', 'Dublin') for i in range(150)] + [('Place5', 'Dublin')]
+    routes = storage.batch_get(ROUTES, ('origin', 'destination'), keys)
+    assert sorted(routes) == sorted((f'Place{i}', 'Dublin') for i in range(1, 60))
+    assert routes[('Place7', 'Dublin')]['distance'] == {'N': '7'}
+
+
+def test_item_totals_and_journey(storage):
+    put_route(storage, 'Valencia', 'Madrid', distance={'N': '350'}, emissions={'N': '35'}, lead_time={'N': '1'})
+    put_route(storage, 'Madrid', 'Dublin', distance={'N': '1450'}, emissions={'N': '29'}, lead_time={'N': '3'})
+    storage.put_item(TableName=ITEMS, Item={'name': {'S': 'Oranges'}, 'origin': {'S': 'Valencia'}, 'legs': {'L': [
+        {'M': {'origin': {'S': 'Valencia'}, 'destination': {'S': 'Madrid'}}},
+        {'M': {'origin': {'S': 'Madrid'}, 'destination': {'S': 'Dublin'}}}]}})
+    totals = storage.item_totals([('Oranges', 'Valencia')])
+    assert totals[('Oranges', 'Valencia')] == {'name': 'Oranges', 'origin': 'Valencia', 'distance': 1800,
+                                               'emissions': 64, 'lead_time': 4}
+    item, routes = storage.journey('Oranges', 'Valencia')
+    assert [route['origin']['S'] for route in routes] == ['Valencia', 'Madrid']
+    assert storage.journey('Oranges', 'Cork') == (None, [])
+    with pytest.raises(NotFoundError):
+        storage.item_totals([('Oranges', 'Cork')])
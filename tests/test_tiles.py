@@ -0,0 +1,57 @@
+import boto3
+
+from conftest import CORK, DUBLIN, MADRID, VALENCIA, mock_aws, route
+from tiles import S3TileStore, decode_tile, encode_tile, patch_tile, tiles_for_line
+
+CORK_DUBLIN = {'origin': 'Cork', 'destination': 'Dublin', 'emissions': '25', 'coordinates': [CORK, DUBLIN]}
+VALENCIA_MADRID = {'origin': 'Valencia', 'destination': 'Madrid', 'emissions': '35',
+                   'coordinates': [VALENCIA, MADRID]}
+
+
+def tile_legs(tile):
+    return sorted((line['origin'], line['destination']) for line in decode_tile(tile)[1]) if tile else []
+
+
+def test_patch_tile_matches_encoding_every_leg():
+    tile = encode_tile(0, 0, 0, [VALENCIA_MADRID])
+    patched = patch_tile(tile, 0, 0, 0, ('Cork', 'Dublin'), CORK_DUBLIN)
+    assert decode_tile(patched) == decode_tile(encode_tile(0, 0, 0, [VALENCIA_MADRID, CORK_DUBLIN]))
+    # replacing a leg leaves one copy of it, removing the last leg leaves no tile
+    moved = dict(CORK_DUBLIN, coordinates=[CORK, MADRID, DUBLIN])
+    assert decode_tile(patch_tile(patched, 0, 0, 0, ('Cork', 'Dublin'), moved)) == decode_tile(
+        encode_tile(0, 0, 0, [VALENCIA_MADRID, moved]))
+    assert patch_tile(encode_tile(0, 0, 0, [CORK_DUBLIN]), 0, 0, 0, ('Cork', 'Dublin')) is None
+
+
+def test_add_route_updates_every_zoom(seeded, app):
+    legs = [('Cork', 'Dublin'), ('Madrid', 'Dublin'), ('Valencia', 'Dublin'), ('Valencia', 'Madrid')]
+    assert tile_legs(app.tile_store.read(0, 0, 0)) == legs
+    # moving the Cork to Dublin leg east takes it off the tiles only its old geometry crossed
+    detour = (45.0, 20.0)
+    body = route('Cork', 'Dublin', CORK, DUBLIN, coordinates=[list(CORK), list(detour), list(DUBLIN)])
+    assert seeded.post('/route', json=body).status_code == 200
+    [cork_dublin] = [line for line in decode_tile(app.tile_store.read(0, 0, 0))[1]
+                     if (line['origin'], line['destination']) == ('Cork', 'Dublin')]
+    assert len(cork_dublin['points']) == 3
+    for zoom in (3, 8):
+        [detour_tile] = tiles_for_line([detour], zoom)
+        assert ('Cork', 'Dublin') in tile_legs(app.tile_store.read(*detour_tile))
+    old_tiles = tiles_for_line([CORK, DUBLIN], 8) - tiles_for_line([CORK, detour, DUBLIN], 8)
+    assert old_tiles
+    assert all(('Cork', 'Dublin') not in tile_legs(app.tile_store.read(*tile)) for tile in old_tiles)
+
+
+def test_s3_tile_store():
+    with mock_aws('s3'):
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='tiles')
+        store = S3TileStore('tiles', 'tiles/', client)
+        assert store.read(0, 0, 0) is None
+        tile = encode_tile(0, 0, 0, [CORK_DUBLIN])
+        store.write(0, 0, 0, tile)
+        store.write(3, 3, 2, tile)
+        assert store.read(0, 0, 0) == tile
+        assert sorted(store.tiles()) == [(0, 0, 0), (3, 3, 2)]
+        store.write(0, 0, 0, None)
+        assert store.read(0, 0, 0) is None
+        assert list(store.tiles()) == [(3, 3, 2)]
@@ -0,0 +1,292 @@
+import math
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+import boto3
+import numpy as np
+
+from geo import simplify
+
+# size of a tile in tile coordinates, and how far outside the tile lines are kept
+# so lines crossing the edge of a tile join up with the next tile
+EXTENT = 4096
+BUFFER = 64
+# web mercator can not show the poles, latitudes are clamped to this
+MAX_LATITUDE = 85.05112878
+# first bytes of every encoded tile
+MAGIC = b'FMT1'
+
+
+def project(coordinates, zoom):
+    # [lat, lng] points to web mercator positions measured in tiles at the zoom level
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    lat = np.radians(np.clip(points[:, 0], -MAX_LATITUDE, MAX_LATITUDE))
+    scale = 2 ** zoom
+    x = (points[:, 1] + 180) / 360 * scale
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * scale
+    return np.column_stack([x, y])
+
+
+def tile_bounds(zoom, x, y):
+    # (min lat, min lng, max lat, max lng) of a tile
+    scale = 2 ** zoom
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / scale))))
+
+    return lat(y + 1), x / scale * 360 - 180, lat(y), (x + 1) / scale * 360 - 180
+
+
+def tiles_for_line(coordinates, zoom):
+    # every tile at the zoom level that a line through the [lat, lng] points may cross,
+    # taken as the tiles under the bounding box of each segment of the line
+    positions = project(coordinates, zoom)
+    last = 2 ** zoom - 1
+    if len(positions) == 1:
+        positions = np.vstack([positions, positions])
+    starts, ends = positions[:-1], positions[1:]
+    low = np.clip(np.floor(np.minimum(starts, ends)), 0, last).astype(np.int64)
+    high = np.clip(np.floor(np.maximum(starts, ends)), 0, last).astype(np.int64)
+    tiles = set()
+    for (min_x, min_y), (max_x, max_y) in zip(low, high):
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                tiles.add((zoom, x, y))
+    return tiles
+
+
+def clip_runs(points):
+    # splitting a line in tile coordinates into the runs of segments that touch the buffered tile
+    runs = []
+    if len(points) < 2:
+        return runs
+    starts, ends = points[:-1], points[1:]
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    inside = np.all((high >= -BUFFER) & (low <= EXTENT + BUFFER), axis=1)
+    run_start = None
+    for i, segment_inside in enumerate(inside):
+        if segment_inside and run_start is None:
+            run_start = i
+        elif not segment_inside and run_start is not None:
+            runs.append(points[run_start:i + 1])
+            run_start = None
+    if run_start is not None:
+        runs.append(points[run_start:])
+    return runs
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def encode_tile(zoom, x, y, features):
+    # encoding the legs crossing a tile into our own compact binary format
+    # features is a list of dicts with the origin, destination, emissions and [lat, lng] coordinates of a leg
+    # returns None when no line crosses the tile
+    return encode_lines(zoom, x, y, [line for feature in features for line in feature_lines(zoom, x, y, feature)])
+
+
+def feature_lines(zoom, x, y, feature):
+    # the lines of a leg inside a tile, with points in tile coordinates simplified to within one unit at
+    # the zoom level, in the form decode_tile returns them
+    positions = (project(feature['coordinates'], zoom) - [x, y]) * EXTENT
+    positions = np.asarray(simplify(positions, 1.0))
+    lines = []
+    for run in clip_runs(positions):
+        run = np.rint(run).astype(np.int64)
+        # dropping points that round onto the point before them
+        keep = np.ones(len(run), dtype=bool)
+        keep[1:] = np.any(run[1:] != run[:-1], axis=1)
+        run = run[keep]
+        if len(run) < 2:
+            continue
+        lines.append({'origin': feature['origin'], 'destination': feature['destination'],
+                      'emissions': float(feature['emissions']), 'points': run.tolist()})
+    return lines
+
+
+def encode_lines(zoom, x, y, lines):
+    # the tile is a header, a table of the place names used, then each line as the indexes of its
+    # place names, its emissions and its points as zigzag varint deltas in tile coordinates,
+    # all compressed with zlib; returns None when there are no lines
+    if not lines:
+        return None
+    names = {}
+    data = bytearray()
+    for line in lines:
+        for name in (line['origin'], line['destination']):
+            names.setdefault(name, len(names))
+        write_varint(data, names[line['origin']])
+        write_varint(data, names[line['destination']])
+        data += struct.pack('>f', line['emissions'])
+        write_varint(data, len(line['points']))
+        deltas = np.diff(np.asarray(line['points'], dtype=np.int64), axis=0, prepend=[[0, 0]])
+        for dx, dy in deltas.tolist():
+            write_varint(data, zigzag(dx))
+            write_varint(data, zigzag(dy))
+    header = bytearray(struct.pack('>4sBII', MAGIC, zoom, x, y))
+    write_varint(header, len(names))
+    for name in names:
+        encoded = name.encode('utf-8')
+        write_varint(header, len(encoded))
+        header += encoded
+    write_varint(header, len(lines))
+    return zlib.compress(bytes(header + data), 9)
+
+
+def patch_tile(tile, zoom, x, y, key, feature=None):
+    # a stored tile (or None) with the lines of the (origin, destination) leg replaced by those of
+    # feature, or removed when feature is None, worked out from the tile alone without reading the
+    # other legs crossing it
+    lines = decode_tile(tile)[1] if tile is not None else []
+    lines = [line for line in lines if (line['origin'], line['destination']) != key]
+    if feature is not None:
+        lines += feature_lines(zoom, x, y, feature)
+    return encode_lines(zoom, x, y, lines)
+
+
+def decode_tile(tile):
+    # the (zoom, x, y) of an encoded tile and its lines, with points in tile coordinates
+    data = zlib.decompress(tile)
+    magic, zoom, x, y = struct.unpack_from('>4sBII', data)
+    if magic != MAGIC:
+        raise ValueError('Not a food miles tile')
+    position = struct.calcsize('>4sBII')
+    name_count, position = read_varint(data, position)
+    names = []
+    for _ in range(name_count):
+        length, position = read_varint(data, position)
+        names.append(data[position:position + length].decode('utf-8'))
+        position += length
+    line_count, position = read_varint(data, position)
+    lines = []
+    for _ in range(line_count):
+        origin, position = read_varint(data, position)
+        destination, position = read_varint(data, position)
+        emissions, = struct.unpack_from('>f', data, position)
+        position += 4
+        point_count, position = read_varint(data, position)
+        points = []
+        point_x = point_y = 0
+        for _ in range(point_count):
+            dx, position = read_varint(data, position)
+            dy, position = read_varint(data, position)
+            point_x += unzigzag(dx)
+            point_y += unzigzag(dy)
+            points.append([point_x, point_y])
+        lines.append({'origin': names[origin], 'destination': names[destination],
+                      'emissions': emissions, 'points': points})
+    return (zoom, x, y), lines
+
+
+class TileStore:
+    # encoded tiles kept as files under root/z/x/y.tile, only a stand-in for S3TileStore on a single host,
+    # as every Lambda container has its own /tmp
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, zoom, x, y):
+        return os.path.join(self.root, str(zoom), str(x), f'{y}.tile')
+
+    def read(self, zoom, x, y):
+        try:
+            with open(self.path(zoom, x, y), 'rb') as tile_file:
+                return tile_file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, zoom, x, y, tile):
+        # writing to a temporary file first so a tile being served is never half written,
+        # an empty tile (None) removes the file
+        path = self.path(zoom, x, y)
+        if tile is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, 'wb') as tile_file:
+            tile_file.write(tile)
+        os.replace(temporary_path, path)
+
+    def tiles(self):
+        # the (zoom, x, y) of every stored tile
+        if not os.path.isdir(self.root):
+            return
+        for zoom in os.listdir(self.root):
+            for x in os.listdir(os.path.join(self.root, zoom)):
+                for name in os.listdir(os.path.join(self.root, zoom, x)):
+                    if name.endswith('.tile'):
+                        yield int(zoom), int(x), int(name[:-len('.tile')])
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class S3TileStore:
+    # encoded tiles kept as objects at prefix/z/x/y.tile of an S3 bucket, shared by every container
+    # and by build_tiles.py wherever it runs
+    def __init__(self, bucket, prefix, client):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+
+    def key(self, zoom, x, y):
+        return f'{self.prefix}{zoom}/{x}/{y}.tile'
+
+    def read(self, zoom, x, y):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(zoom, x, y))['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def write(self, zoom, x, y, tile):
+        # a single PUT replaces the whole object, an empty tile (None) removes it
+        if tile is None:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(zoom, x, y))
+            return
+        self.client.put_object(Bucket=self.bucket, Key=self.key(zoom, x, y), Body=tile,
+                               ContentType='application/x-foodmiles-tile')
+
+    def tiles(self):
+        # the (zoom, x, y) of every stored tile
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for content in page.get('Contents', []):
+                zoom, x, y = content['Key'][len(self.prefix):-len('.tile')].split('/')
+                yield int(zoom), int(x), int(y)
+
+
+def create_tile_store(root):
+    # tiles go to the S3 bucket TILE_BUCKET when it is set, so every container serves the same tiles,
+    # and to files under root otherwise
+    bucket = os.environ.get('TILE_BUCKET')
+    if bucket:
+        return S3TileStore(bucket, os.environ.get('TILE_PREFIX', 'tiles/'), boto3.client('s3'))
+    return TileStore(root)
@@ -0,0 +1,64 @@
+import argparse
+import time
+
+from app import (CATALOGUE_BUNDLE, CATALOGUE_CHANGES_PREFIX, CATALOGUE_TABLE, CATALOGUE_VERSION_KEY, CHANGE_SHARDS,
+                 change_sort_key, storage)
+from catalogue import Catalogue
+
+
+def bundle_version():
+    # the version of the bundle beside app.py, or None when there is no bundle
+    try:
+        return Catalogue(CATALOGUE_BUNDLE).version
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete the records of the change log up to a version')
+    parser.add_argument('--version', type=int, default=None,
+                        help='newest version to delete, by default the version of the bundle beside app.py, '
+                             'which is what to run after a deployment')
+    args = parser.parse_args()
+
+    version = args.version if args.version is not None else bundle_version()
+    if version is None:
+        parser.error(f'Could not open the bundle "{CATALOGUE_BUNDLE}", please provide --version')
+    start = time.time()
+    # saying the records are trimmed on the version item before deleting any of them, so anyone reading the
+    # writes since an older version knows some are missing; a version the tables have not reached yet is refused
+    try:
+        storage.update_item(
+            TableName=CATALOGUE_TABLE,
+            Key=CATALOGUE_VERSION_KEY,
+            UpdateExpression='SET #trimmed = :version',
+            ConditionExpression='#version >= :version AND attribute_not_exists(#trimmed) OR '
+                                '#version >= :version AND #trimmed < :version',
+            ExpressionAttributeNames={'#version': 'version', '#trimmed': 'trimmed'},
+            ExpressionAttributeValues={':version': {'N': str(version)}}
+        )
+    except storage.exceptions.ConditionalCheckFailedException:
+        result = storage.get_item(TableName=CATALOGUE_TABLE, Key=CATALOGUE_VERSION_KEY, ConsistentRead=True)
+        item = result.get('Item', {})
+        if 'version' not in item or int(item['version']['N']) < version:
+            parser.error(f'The tables are not at version {version} yet')
+        # trimmed further already, the records up to this version are deleted again in case that was interrupted
+    deleted = 0
+    failed = 0
+    for shard in range(CHANGE_SHARDS):
+        records = storage.query_table(
+            CATALOGUE_TABLE,
+            KeyConditionExpression='pk = :pk AND sk <= :version',
+            ExpressionAttributeValues={':pk': {'S': f'{CATALOGUE_CHANGES_PREFIX}{shard}'},
+                                       ':version': {'S': change_sort_key(version)}},
+            ProjectionExpression='pk, sk'
+        )
+        requests = [{'DeleteRequest': {'Key': record}} for record in records]
+        failed += len(storage.batch_write(CATALOGUE_TABLE, requests))
+        deleted += len(requests)
+    print(f'{deleted - failed} change records up to version {version} deleted, {failed} failed to delete '
+          f'in {time.time() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()